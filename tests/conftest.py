@@ -0,0 +1,168 @@
+"""
+Load webnavigator.py without GTK and Newelle.
+
+The extension is a module of the Newelle package, so it is loaded as
+newelle.webnavigator next to minimal stand-ins for gi and for the Newelle
+modules it imports. Only the code that doesn't need a browser can be tested.
+"""
+import functools
+import importlib.util
+import re
+import sys
+import tempfile
+import threading
+import types
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+CACHE_DIR = tempfile.mkdtemp(prefix="webnavigator-tests-")
+
+
+class Anything:
+    """Stands for any GTK or WebKit object, every attribute and call gives another one"""
+
+    def __getattr__(self, name):
+        return Anything()
+
+    def __call__(self, *args, **kwargs):
+        return Anything()
+
+
+class GLib:
+    PRIORITY_HIGH = -100
+    PRIORITY_DEFAULT = 0
+    PRIORITY_DEFAULT_IDLE = 200
+
+    @staticmethod
+    def idle_add(function, *args):
+        function(*args)
+        return 0
+
+    @staticmethod
+    def get_user_cache_dir():
+        return CACHE_DIR
+
+    class Variant:
+        def __init__(self, kind, value):
+            self.kind = kind
+            self.value = value
+
+
+class NewelleExtension:
+    def __init__(self):
+        self.settings = {}
+        self.rag = None
+        self.llm = None
+
+    def get_setting(self, key):
+        if key in self.settings:
+            return self.settings[key]
+        for setting in self.get_extra_settings():
+            if setting["key"] == key:
+                return setting["default"]
+        return None
+
+
+class ExtraSettings:
+    @staticmethod
+    def ToggleSetting(key, title, description, default, **kwargs):
+        return {"key": key, "default": default}
+
+    @staticmethod
+    def SpinSetting(key, title, description, default, *args, **kwargs):
+        return {"key": key, "default": default}
+
+    @staticmethod
+    def ComboSetting(key, title, description, values, default, **kwargs):
+        return {"key": key, "default": default}
+
+    @staticmethod
+    def EntrySetting(key, title, description, default, **kwargs):
+        return {"key": key, "default": default}
+
+
+class WebsiteScraper:
+    """Converts HTML to text by dropping the tags"""
+
+    def __init__(self, url):
+        self.url = url
+
+    def set_html(self, html):
+        self.html = html
+
+    def clean_html_to_markdown(self, html, include_links=False):
+        return re.sub(r"\s*\n\s*", "\n\n", re.sub(r"<[^>]+>", "\n", html)).strip()
+
+
+def _module(name: str, **attributes) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def _load():
+    if "newelle.webnavigator" in sys.modules:
+        return sys.modules["newelle.webnavigator"]
+    _module("gi", require_version=lambda *args: None)
+    _module("gi.repository", Gio=Anything(), GLib=GLib, WebKit=Anything())
+    _module("newelle", __path__=[])
+    _module("newelle.extensions", NewelleExtension=NewelleExtension)
+    _module("newelle.handlers", ExtraSettings=ExtraSettings)
+    _module("newelle.ui", __path__=[])
+    _module("newelle.ui.widgets", BrowserWidget=Anything)
+    _module("newelle.utility", __path__=[])
+    _module("newelle.utility.website_scraper", WebsiteScraper=WebsiteScraper)
+    _module("newelle.tools", create_io_tool=lambda name, description, function, **kwargs: (name, function))
+    spec = importlib.util.spec_from_file_location("newelle.webnavigator", ROOT / "webnavigator.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def webnav():
+    """The webnavigator module"""
+    return _load()
+
+
+@pytest.fixture
+def navigator(webnav):
+    """A navigator with the default settings and no browser"""
+    return webnav.WebNavigator()
+
+
+class SiteHandler(SimpleHTTPRequestHandler):
+    """Serves a directory over HTTP/1.1, so connections are kept alive"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site(tmp_path):
+    """
+    Serve the files written in a temporary directory.
+
+    Yields a function that writes a page and returns its URL.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(SiteHandler, directory=str(tmp_path)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    root = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    def page(path: str, html: str) -> str:
+        file = tmp_path / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(html)
+        return root + path
+
+    page.root = root
+    yield page
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import Anything
+
+
+@pytest.fixture
+def page(webnav, navigator):
+    """A navigator on a page whose in-page steps are recorded, submit and navigating clicks load a new page"""
+    watcher = webnav.PageLoadWatcher(Anything())
+    navigator.current = SimpleNamespace(lasturl="https://example.com/", loaded_url="https://example.com/",
+                                        is_open=lambda: True, load_watcher=watcher)
+    batches = []
+
+    def call_library(name, args=None, timeout=10000):
+        steps = args["steps"]
+        batches.append([step["action"] for step in steps])
+        results = []
+        for step in steps:
+            if step.get("selector") == "#missing":
+                results.append({"action": step["action"], "success": False, "error": "Element not found"})
+                return {"results": results}
+            if step["action"] == "submit" or step.get("selector") == "a.next":
+                watcher.begin_navigation()
+                watcher._set_state("started", "https://example.com/next")
+                watcher._set_state("load")
+                raise Exception("The page was unloaded")
+            results.append({"action": step["action"], "success": True})
+        return {"results": results}
+
+    navigator.call_library = call_library
+    navigator.get_page_bundle = lambda parts, budgets: {"url": watcher.url, "parts": {}}
+    return SimpleNamespace(batches=batches, watcher=watcher)
+
+
+def test_steps_after_a_submit_run_on_the_new_page(navigator, page):
+    result = navigator.run_actions([
+        {"action": "fill", "selector": "#q", "value": "query"},
+        {"action": "submit", "selector": "form"},
+        {"action": "wait_for_selector", "selector": ".results"},
+        {"action": "extract", "parts": ["text"]}
+    ])
+    assert page.batches == [["fill", "submit"], ["wait_for_selector"]]
+    assert [step["action"] for step in result["steps"]] == ["fill", "submit", "wait_for_selector", "extract"]
+    assert result["steps"][1]["load"]["success"]
+    assert result["success"]
+    assert result["completed"] == 4
+    assert result["extraction"]["url"] == "https://example.com/next"
+
+
+def test_click_that_does_not_navigate_continues_in_the_page(navigator, page):
+    result = navigator.run_actions([
+        {"action": "click", "selector": "button.tab"},
+        {"action": "scroll"},
+        {"action": "click", "selector": "a.next"},
+    ])
+    assert page.batches == [["click"], ["scroll", "click"]]
+    assert result["success"]
+    assert "load" not in result["steps"][0]
+
+
+def test_failing_step_is_reported_as_itself(navigator, page):
+    result = navigator.run_actions([
+        {"action": "fill", "selector": "#q", "value": "query"},
+        {"action": "click", "selector": "#missing"},
+        {"action": "extract"}
+    ])
+    assert [(step["action"], step["success"]) for step in result["steps"]] == [("fill", True), ("click", False)]
+    assert result["completed"] == 1
+    assert not result["success"]
+
+
+def test_script_errors_are_not_blamed_on_the_first_step(navigator, page):
+    def call_library(name, args=None, timeout=10000):
+        raise Exception("JavaScript execution timed out")
+
+    navigator.call_library = call_library
+    result = navigator.run_actions([{"action": "fill", "selector": "#q", "value": "x"}, {"action": "scroll"}])
+    assert result["steps"] == [{"action": "sequence", "steps": ["fill", "scroll"], "success": False,
+                                "error": "JavaScript execution timed out"}]
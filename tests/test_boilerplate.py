@@ -0,0 +1,29 @@
+import subprocess
+import sys
+
+from conftest import ROOT
+
+FOOTER = "Posted on {} by the editors, {} comments so far"
+ARTICLE = "Article number {} talks about a different subject than the other ones"
+
+
+def test_blocks_that_only_differ_in_numbers_match(webnav):
+    assert webnav.simhash(FOOTER.format("12 March 2024", 34)) == webnav.simhash(FOOTER.format("15 March 2025", 2))
+    assert webnav.simhash("The quick brown fox jumps over the lazy dog") != webnav.simhash("A different sentence about cats and mice")
+
+
+def test_repeated_blocks_are_stripped_from_other_pages(webnav):
+    boilerplate = webnav.BoilerplateFilter()
+    first = ARTICLE.format(1) + "\n\n" + FOOTER.format("12 March 2024", 34)
+    second = "A page about gardening and the care of old apple trees" + "\n\n" + FOOTER.format("15 March 2025", 2)
+    assert boilerplate.strip("https://example.com/1", first) == first
+    stripped = boilerplate.strip("https://example.com/2", second)
+    assert stripped.startswith("A page about gardening")
+    assert "comments so far" not in stripped
+
+
+def test_simhash_is_the_same_in_every_process(webnav):
+    script = "import sys; sys.path.insert(0, 'tests'); import conftest; print(conftest._load().simhash('Posted on a date by the editors'))"
+    outputs = {subprocess.run([sys.executable, "-c", script], cwd=ROOT, env={"PYTHONHASHSEED": str(seed)},
+                              capture_output=True, text=True, check=True).stdout for seed in (1, 2)}
+    assert outputs == {str(webnav.simhash("Posted on a date by the editors")) + "\n"}
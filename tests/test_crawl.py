@@ -0,0 +1,50 @@
+import pytest
+
+TEXT = "<p>" + "Some text written for this page of the test site. " * 8 + "</p>"
+
+
+def html(title, *links):
+    anchors = "".join(f'<a href="{link}">{link}</a> ' for link in links)
+    return f"<html><head><title>{title}</title></head><body><h1>{title}</h1>{TEXT}<p>{anchors}</p></body></html>"
+
+
+@pytest.fixture
+def crawl_site(site):
+    site("robots.txt", "User-agent: *\nDisallow: /private/\n")
+    site("index.html", html("Home", "docs/a.html", "docs/b.html", "private/secret.html", "https://other.example/"))
+    site("docs/a.html", html("Page A", "deep/c.html"))
+    # Same content as the home page under another URL
+    site("docs/b.html", html("Home", "docs/a.html", "docs/b.html", "private/secret.html", "https://other.example/"))
+    site("docs/deep/c.html", html("Page C", "d.html"))
+    site("docs/deep/d.html", html("Page D"))
+    site("private/secret.html", html("Secret"))
+    return site
+
+
+def crawler(webnav, navigator, **kwargs):
+    return webnav.SiteCrawler(navigator.fetch_crawled_page, navigator.fetch_text, delay=0, **kwargs)
+
+
+def test_crawl_follows_links_up_to_max_depth(webnav, navigator, crawl_site):
+    results = list(crawler(webnav, navigator, max_depth=2).crawl(crawl_site.root + "index.html"))
+    read = {result["url"].removeprefix(crawl_site.root): result["depth"] for result in results if "cleaned" in result}
+    assert read == {"index.html": 0, "docs/a.html": 1, "docs/deep/c.html": 2}
+    errors = {result["url"].removeprefix(crawl_site.root): result["error"] for result in results if "error" in result}
+    assert errors == {"private/secret.html": "Disallowed by robots.txt"}
+    duplicates = [result["url"].removeprefix(crawl_site.root) for result in results if "duplicate_of" in result]
+    assert duplicates == ["docs/b.html"]
+
+
+def test_crawl_stops_at_max_pages(webnav, navigator, crawl_site):
+    results = list(crawler(webnav, navigator, max_pages=2, max_depth=3).crawl(crawl_site.root + "index.html"))
+    assert len([result for result in results if "cleaned" in result]) == 2
+    assert results[-1] == {"stopped": "max_pages"}
+
+
+def test_crawled_pages_are_saved_and_searchable(navigator, crawl_site):
+    manifest = navigator.crawl(crawl_site.root + "index.html", max_pages=5, max_depth=1)
+    assert manifest["success"]
+    assert [page["url"].removeprefix(crawl_site.root) for page in manifest["pages"]] == ["index.html", "docs/a.html"]
+    assert manifest["duplicates"] == 1
+    assert navigator.old_pages.get(crawl_site.root + "docs/a.html") is not None
+    assert "Page A" in str(navigator.search_visited_pages("Page A"))
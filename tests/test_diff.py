@@ -0,0 +1,32 @@
+import types
+
+
+def read(navigator, url, text, diff=True):
+    navigator._snapshot_part = lambda name: ({"url": url, "title": "Page"}, {"text": text, "totalLength": len(text)})
+    return navigator.get_page_text(2000, diff)
+
+
+def test_diff_blocks_finds_added_removed_and_changed(webnav):
+    diff = webnav.diff_blocks(["intro", "price 10", "footer"], ["intro", "price 12", "footer", "new offer"])
+    assert [block["text"] for block in diff["added"]] == ["new offer"]
+    assert [(block["before"], block["after"]) for block in diff["changed"]] == [("price 10", "price 12")]
+    assert diff["removed"] == []
+    assert diff["unchanged"] == 2
+
+
+def test_page_text_diff_returns_appended_paragraph(navigator):
+    navigator.current = types.SimpleNamespace(last_text=None)
+    first = "Title\nFirst paragraph of the page.\nSecond paragraph."
+    read(navigator, "https://example.com/", first)
+    result = read(navigator, "https://example.com/", first + "\nA paragraph loaded later.")
+    assert [block["text"] for block in result["diff"]["added"]] == ["A paragraph loaded later."]
+    assert result["diff"]["changed"] == []
+    assert result["diff"]["unchanged"] == 3
+
+
+def test_page_text_diff_needs_same_page(navigator):
+    navigator.current = types.SimpleNamespace(last_text=None)
+    read(navigator, "https://example.com/a", "Some text")
+    result = read(navigator, "https://example.com/b", "Other text")
+    assert "diff" not in result
+    assert result["text"] == "Other text"
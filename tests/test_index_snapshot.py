@@ -0,0 +1,45 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+class Embedding:
+    def get_setting(self, key):
+        return "test"
+
+    def get_embedding(self, texts):
+        vectors = np.zeros((len(texts), 16))
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, sum(word.encode()) % 16] += 1
+        return vectors
+
+
+def session(webnav, path, max_bytes=0):
+    state = webnav.RagIndexState()
+    snapshot = webnav.IndexSnapshot(str(path), Embedding(), np, max_bytes)
+    snapshot.load(state)
+    return state, snapshot
+
+
+def test_pages_of_earlier_sessions_are_evicted_oldest_first(webnav, tmp_path):
+    state, snapshot = session(webnav, tmp_path)
+    store = webnav.PageStore()
+    for page in range(20):
+        store[f"https://example.com/{page}"] = f"Page {page} " + "words of the page " * 20
+        state.sync(store)
+        snapshot.update(state)
+    size = snapshot.size()
+    state, snapshot = session(webnav, tmp_path, size // 2)
+    store = webnav.PageStore()
+    store["https://example.com/new"] = "A page of this session"
+    state.sync(store)
+    snapshot.update(state)
+    assert snapshot.size() <= size // 2
+    assert "https://example.com/new" in state.pages
+    assert "https://example.com/19" in state.pages
+    assert "https://example.com/0" not in state.pages
+    state, snapshot = session(webnav, tmp_path)
+    assert "https://example.com/0" not in state.pages
+    assert "https://example.com/new" in state.pages
+
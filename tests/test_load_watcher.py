@@ -0,0 +1,58 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import Anything
+
+
+class LoadEvent:
+    STARTED = "started"
+    COMMITTED = "committed"
+    FINISHED = "finished"
+
+
+class Message:
+    def __init__(self, message):
+        self.message = message
+
+    def to_string(self):
+        return json.dumps(self.message)
+
+
+@pytest.fixture
+def watcher(webnav, monkeypatch):
+    monkeypatch.setattr(webnav.WebKit, "LoadEvent", LoadEvent, raising=False)
+    return webnav.PageLoadWatcher(Anything())
+
+
+def test_previous_document_idle_message_is_ignored(watcher):
+    navigation = watcher.begin_navigation()
+    watcher._on_load_changed(Anything(), LoadEvent.STARTED)
+    # The idle timer of the page being left fires before the new one is committed
+    watcher._on_script_message(None, Message({"type": "load", "state": "networkidle", "url": "https://old.example/"}))
+    assert watcher.wait("load", timeout=0, navigation=navigation)["outcome"] == "timeout"
+    watcher._on_load_changed(Anything(), LoadEvent.COMMITTED)
+    watcher._on_script_message(None, Message({"type": "load", "state": "domcontentloaded", "url": "https://new.example/"}))
+    assert watcher.wait("domcontentloaded", timeout=0, navigation=navigation)["outcome"] == "ok"
+    assert watcher.wait("load", timeout=0, navigation=navigation)["outcome"] == "timeout"
+
+
+def test_page_that_times_out_is_stopped_and_reported(navigator):
+    stopped = []
+    outcome = {"outcome": "timeout", "success": False, "elapsed_ms": 20000}
+    tab = SimpleNamespace(
+        content_filter=None, loaded_url="https://example.com/",
+        load_watcher=SimpleNamespace(wait=lambda *args: outcome),
+        dispatcher=SimpleNamespace(submit=lambda script, callback, *args, **kwargs: callback(script() if callable(script) else None, None)),
+        driver=SimpleNamespace(webview=SimpleNamespace(stop_loading=lambda: stopped.append(True)),
+                               get_page_html_sync=lambda: "<p>Partial page</p>")
+    )
+    navigator.start_navigation = lambda url: (tab, {"url": url, "id": 1})
+    result = navigator.get_answer("https://example.com/", "openlink")
+    assert stopped == [True]
+    assert "Partial page" in result
+    assert result.endswith("[The page didn't finish loading in 20 seconds, its content may be incomplete]")
+    outcome.update(outcome="ok", success=True)
+    assert "didn't finish loading" not in navigator.get_answer("https://example.com/", "openlink")
+    assert stopped == [True]
@@ -0,0 +1,76 @@
+def markdown(webnav, html, chunk_size=7):
+    chunks = [html[i:i + chunk_size] for i in range(0, len(html), chunk_size)]
+    return list(webnav.stream_markdown(iter(chunks), "https://example.com/page/"))
+
+
+def test_head_without_end_tag_is_skipped(webnav):
+    html = "<html><head><title>t</title><body><h1>Title</h1><p>Body</p>"
+    assert markdown(webnav, html) == ["# Title", "Body"]
+
+
+def test_head_ends_at_the_first_block(webnav):
+    html = "<head><title>t</title><style>p {}</style><p>Body</p>"
+    assert markdown(webnav, html) == ["Body"]
+
+
+def test_unclosed_button_ends_with_its_block(webnav):
+    html = "<div><button>Menu<span>v</span></div><p>Text after the button</p>"
+    assert markdown(webnav, html) == ["Text after the button"]
+    assert markdown(webnav, "<p><button>Open</p><p>Next</p>") == ["Next"]
+
+
+def test_blocks_inside_a_button_are_skipped(webnav):
+    html = "<button><div>Label</div><div>More</div></button><p>Text</p>"
+    assert markdown(webnav, html) == ["Text"]
+
+
+def test_table(webnav):
+    html = "<table><tr><th>Name</th><th>Price</th></tr><tr><td>Apple</td><td>1 | 2</td></tr></table>"
+    assert markdown(webnav, html) == ["| Name | Price |\n| --- | --- |\n| Apple | 1 \\| 2 |"]
+
+
+def test_nested_table_stays_in_its_cell(webnav):
+    html = ("<table><tr><td>outer <table><tr><td>inner</td><td>x</td></tr><tr><td>y</td></tr></table></td><td>b</td></tr>"
+            "<tr><td>c</td><td>d</td></tr></table><p>After</p>")
+    assert markdown(webnav, html) == ["| outer inner, x; y | b |\n| --- | --- |\n| c | d |", "After"]
+
+
+def test_lists(webnav):
+    html = "<ol><li><p>first</p></li><li>second<ul><li>nested</li></ul></li></ol><ul><li><h3>Item title</h3></li><li></li></ul><p>After</p>"
+    assert markdown(webnav, html) == ["1. first", "2. second", "  - nested", "- ### Item title", "After"]
+
+
+def test_headings_links_and_emphasis(webnav):
+    html = '<h2>Section <em>two</em></h2><p>Read <a href="../other">the <b>other</b> page</a>.</p><p><a href="#top"></a></p>'
+    assert markdown(webnav, html) == ["## Section *two*", "Read [the **other** page](https://example.com/other)."]
+
+
+def test_links_are_collected(webnav):
+    parser = webnav.MarkdownStream("https://example.com/page/")
+    list(webnav.stream_markdown(iter(['<a href="/a">First</a> <a href="b">Second link</a>']), "https://example.com/page/", parser=parser))
+    assert parser.links == [{"href": "https://example.com/a", "text": "First"},
+                            {"href": "https://example.com/page/b", "text": "Second link"}]
+
+
+def test_preformatted_text_keeps_its_lines(webnav):
+    html = "<pre><code>def f():\n    return <b>1</b>\n</code></pre><p>After</p>"
+    assert markdown(webnav, html) == ["```\ndef f():\n    return 1\n```", "After"]
+
+
+def test_reading_stops_at_the_limit(webnav):
+    read = []
+    closed = []
+
+    def chunks():
+        try:
+            for number in range(1000):
+                read.append(number)
+                yield f"<p>Paragraph number {number}</p>"
+        finally:
+            closed.append(True)
+
+    blocks = list(webnav.stream_markdown(chunks(), "https://example.com/", limit=100))
+    assert blocks[0] == "Paragraph number 0"
+    assert sum(len(block) + 2 for block in blocks) >= 100
+    assert len(read) < 10
+    assert closed == [True]
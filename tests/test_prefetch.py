@@ -0,0 +1,61 @@
+import threading
+from time import monotonic, sleep
+
+from test_static_fetch import rendered_tab
+
+
+def wait_until(condition, timeout=5):
+    deadline = monotonic() + timeout
+    while not condition():
+        assert monotonic() < deadline
+        sleep(0.01)
+
+
+def test_prefetched_pages_are_served_once(webnav):
+    prefetcher = webnav.LinkPrefetcher(lambda url: "Content of " + url)
+    prefetcher.schedule(["https://example.com/a", "https://example.com/b"])
+    wait_until(lambda: prefetcher.get_stats()["completed"] == 2)
+    assert prefetcher.get("https://example.com/a#section") == "Content of https://example.com/a"
+    assert prefetcher.get("https://example.com/a") is None
+    assert prefetcher.get_stats()["hits"] == 1
+    assert prefetcher.get_stats()["misses"] == 1
+
+
+def test_cancel_drops_the_downloads_not_started(webnav):
+    release = threading.Event()
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        release.wait(5)
+        return "Content of " + url
+
+    prefetcher = webnav.LinkPrefetcher(fetch, max_workers=1)
+    prefetcher.schedule(["https://example.com/a", "https://example.com/b"])
+    wait_until(lambda: fetched)
+    prefetcher.cancel()
+    release.set()
+    wait_until(lambda: prefetcher.get_stats()["discarded"] == 1)
+    assert fetched == ["https://example.com/a"]
+    assert prefetcher.get("https://example.com/a") is None
+
+
+def test_oldest_pages_are_evicted_over_the_budget(webnav):
+    prefetcher = webnav.LinkPrefetcher(lambda url: url[-1] * 10, max_workers=1, max_bytes=25)
+    prefetcher.schedule(["https://example.com/a", "https://example.com/b", "https://example.com/c"])
+    wait_until(lambda: prefetcher.get_stats()["completed"] == 3)
+    assert prefetcher.get("https://example.com/a") is None
+    assert prefetcher.get("https://example.com/c") == "c" * 10
+
+
+def test_prefetched_page_is_opened_before_page_tools(webnav, navigator):
+    navigator.current = rendered_tab(webnav, "https://example.com/a", "Text of page A")
+    navigator.prefetcher = webnav.LinkPrefetcher(lambda url: "Prefetched text of " + url)
+    navigator.prefetcher.schedule(["https://example.com/b"])
+    wait_until(lambda: navigator.prefetcher.get_stats()["completed"] == 1)
+    opened = []
+    navigator.start_navigation = lambda url: (opened.append(url), (None, {"error": "no browser"}))[1]
+    assert "Prefetched text of https://example.com/b" in navigator.get_answer("https://example.com/b", "openlink")
+    assert opened == []
+    assert navigator.get_page_text() == {"error": "no browser"}
+    assert opened == ["https://example.com/b"]
@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import Anything
+
+
+class FilterStore:
+    """Compiles filters at once, load() only finds the ones saved before"""
+
+    def __init__(self, saved=()):
+        self.saved = set(saved)
+        self.compiled = 0
+
+    def load(self, identifier, cancellable, callback, data):
+        callback(self, identifier if identifier in self.saved else None, data)
+
+    def load_finish(self, result):
+        if result is None:
+            raise Exception("Filter not found")
+        return "filter:" + result
+
+    def save(self, identifier, rules, cancellable, callback, data):
+        self.compiled += 1
+        self.saved.add(identifier)
+        callback(self, identifier, data)
+
+    def save_finish(self, result):
+        return "filter:" + result
+
+
+@pytest.fixture
+def blocker(webnav, tmp_path, monkeypatch):
+    monkeypatch.setattr(webnav.GLib, "Bytes", SimpleNamespace(new=lambda data: data), raising=False)
+    return webnav.ResourceBlocker(str(tmp_path))
+
+
+def test_filters_saved_on_disk_are_not_compiled_again(blocker):
+    rules = '[{"trigger": {"url-filter": ".*"}, "action": {"type": "block"}}]'
+    blocker.store = FilterStore([blocker.identifier(rules)])
+    assert blocker.prepare(rules).is_set()
+    assert blocker.store.compiled == 0
+    blocker.store = FilterStore()
+    blocker.filters.clear()
+    blocker.ready.clear()
+    assert blocker.prepare(rules).is_set()
+    assert blocker.store.compiled == 1
+
+
+def test_first_scrape_mode_page_is_loaded_with_the_filter(navigator, blocker):
+    navigator.settings["scrape_mode"] = True
+    navigator.resource_blocker = blocker
+    blocker.store = FilterStore()
+    tab = SimpleNamespace(content_filter=None, driver=Anything(), loaded_url="https://example.com/")
+    navigator.prepare_resource_blocking()
+    navigator.update_resource_blocking(tab)
+    assert tab.content_filter is not None
+
+
+def test_loads_are_recorded_with_and_without_scrape_mode(navigator, webnav):
+    resources = '{"requests": 10, "transferSize": 5000, "bodySize": 8000}'
+    dispatcher = SimpleNamespace(submit=lambda script, callback, *args, **kwargs: callback(resources, None))
+    tab = SimpleNamespace(content_filter=None, loaded_url="https://example.com/", dispatcher=dispatcher)
+    navigator.record_load(tab, {"elapsed_ms": 300})
+    navigator.settings["scrape_mode"] = True
+    tab.content_filter = "filter"
+    navigator.record_load(tab, {"elapsed_ms": 100})
+    loads = navigator.get_stats()["page_loads"]
+    assert loads["normal"]["pages"] == loads["scrape"]["pages"] == 1
+    assert loads["normal"]["avg_load_ms"] == 300
+    assert loads["scrape"]["avg_transfer_bytes"] == 5000
@@ -0,0 +1,84 @@
+import os
+
+
+def document(url, text):
+    return "text:Source: " + url + "\n\n" + text
+
+
+def test_page_back_to_previous_version_is_current(webnav):
+    store = webnav.PageStore()
+    state = webnav.RagIndexState()
+    url = "https://example.com/"
+    store[url] = "Version one of the page"
+    state.sync(store)
+    state.embedded.update(state.owners)
+    store[url] = "Version two of the page"
+    state.sync(store)
+    state.embedded.update(state.owners)
+    assert not state.is_current(document(url, "Version one of the page")[len("text:"):])
+    store[url] = "Version one of the page"
+    state.sync(store)
+    assert state.is_current(document(url, "Version one of the page")[len("text:"):])
+    assert not state.is_current(document(url, "Version two of the page")[len("text:"):])
+
+
+class FakeIndex:
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    def insert(self, documents):
+        self.documents += documents
+
+    def query(self, query):
+        return [document[len("text:"):] for document in self.documents if query in document]
+
+
+class FakeRag:
+    def build_index(self, documents, chunk_size):
+        return FakeIndex(documents)
+
+
+def test_pages_read_with_bm25_are_embedded_after_switching_to_rag(navigator):
+    navigator.rag = FakeRag()
+    navigator.settings["retrieval_backend"] = "bm25"
+    navigator.old_pages["https://example.com/"] = "Apples grow on trees"
+    assert "Apples" in navigator.get_context("apples")
+    navigator.settings["retrieval_backend"] = "rag"
+    assert "Apples grow on trees" in navigator.get_context("Apples")
+
+
+def test_sync_keeps_no_copy_of_the_chunks_for_later(webnav):
+    store = webnav.PageStore()
+    state = webnav.RagIndexState()
+    for version in range(50):
+        store["https://example.com/"] = f"Version {version} of the page"
+        state.sync(store)
+    assert len(state.owners) == 1
+    assert not state.tombstones
+
+
+def test_indexes_keep_hashes_and_load_the_text_from_the_store(webnav):
+    store = webnav.PageStore()
+    state = webnav.RagIndexState()
+    store["https://example.com/a"] = "Apples grow on trees"
+    store["https://example.com/b"] = "Bananas grow on plants"
+    state.sync(store)
+    index = state.get_keyword_index()
+    assert all(isinstance(digests, tuple) for _, digests in state.pages.values())
+    assert not hasattr(index, "documents")
+    state.cache.clear()
+    assert index.search("bananas", 1) == [(webnav.content_hash(document("https://example.com/b", "Bananas grow on plants")),
+                                           document("https://example.com/b", "Bananas grow on plants"))]
+    store["https://example.com/b"] = "Cherries grow on trees"
+    state.sync(store)
+    assert index.search("bananas", 1) == []
+    assert [text for _, text in index.search("trees", 2)] == [document("https://example.com/a", "Apples grow on trees"),
+                                                             document("https://example.com/b", "Cherries grow on trees")]
+
+
+def test_turning_the_snapshot_off_deletes_it(navigator, webnav):
+    path = os.path.join(webnav.GLib.get_user_cache_dir(), "webnavigator", "index")
+    os.makedirs(path, exist_ok=True)
+    navigator.settings["index_snapshot"] = False
+    assert navigator.get_index_snapshot() is None
+    assert not os.path.exists(path)
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+ARTICLE = "<html><body><h1>Static article</h1>" + "<p>Text rendered by the server without any script.</p>" * 20 + "</body></html>"
+
+
+def test_client_keeps_the_connection_alive(webnav, site):
+    url = site("article.html", ARTICLE)
+    client = webnav.KeepAliveHTTPClient()
+    try:
+        first = client.get(url)
+        second = client.get(url)
+    finally:
+        client.close()
+    assert first.status == second.status == 200
+    assert "Static article" in second.text()
+    assert client.stats["requests"] == 2
+    assert client.stats["reused_connections"] == 1
+
+
+def test_client_follows_redirects(webnav, site):
+    site("docs/index.html", ARTICLE)
+    client = webnav.KeepAliveHTTPClient()
+    try:
+        # The server redirects directories to their trailing slash
+        response = client.get(site.root + "docs")
+    finally:
+        client.close()
+    assert response.url == site.root + "docs/"
+    assert "Static article" in response.text()
+
+
+def test_page_read_without_browser_is_opened_before_page_tools(navigator, site):
+    url = site("article.html", ARTICLE)
+    navigator.settings["static_fetch"] = True
+    opened = []
+    navigator.start_navigation = lambda url: (opened.append(url), (None, {"error": "no browser"}))[1]
+    assert "Static article" in navigator.get_answer(url, "openlink")
+    assert opened == []
+    result = navigator.click_element("a")
+    assert opened and set(opened) == {url}
+    assert result == {"success": False, "error": "no browser"}
+
+
+def rendered_tab(webnav, url, text):
+    """A tab showing a page whose snapshot is already cached"""
+    key = (1, 1, url)
+    cache = webnav.PageSnapshotCache()
+    cache.put(key, {"info": {"url": url, "title": "Page A"}, "text": {"text": text, "totalLength": len(text)}})
+    return SimpleNamespace(lasturl=url, loaded_url=url, last_text=None, snapshot_cache=cache,
+                           load_watcher=SimpleNamespace(snapshot_key=lambda: key), is_open=lambda: True)
+
+
+def test_cached_snapshot_of_the_previous_page_is_not_returned(webnav, navigator, site):
+    navigator.current = rendered_tab(webnav, "https://example.com/a", "Text of page A")
+    assert navigator.get_page_text()["text"] == "Text of page A"
+    url = site("article.html", ARTICLE)
+    navigator.settings["static_fetch"] = True
+    opened = []
+    navigator.start_navigation = lambda url: (opened.append(url), (None, {"error": "no browser"}))[1]
+    assert "Static article" in navigator.get_answer(url, "openlink")
+    assert navigator.get_page_text() == {"error": "no browser"}
+    assert navigator.get_page_bundle(["text"]) == {"error": "no browser"}
+    assert navigator.search_page_text("page") == {"error": "no browser"}
+    assert navigator.get_tables() == {"error": "no browser"}
+    assert set(opened) == {url}
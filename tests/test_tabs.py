@@ -0,0 +1,23 @@
+class Tab:
+    def __init__(self):
+        self.id = 0
+        self.busy = False
+
+    def is_open(self):
+        return True
+
+
+def test_current_tab_does_not_count_toward_max_tabs(webnav):
+    pool = webnav.BrowserPool(Tab, 1)
+    current = Tab()
+    pool.add(current)
+    tab = pool.acquire(0, exclude=current)
+    assert tab is not current
+    pool.release(tab)
+    assert pool.acquire(0, exclude=current) is tab
+
+
+def test_openlink_on_unknown_tab_returns_text(navigator):
+    result = navigator.openlink("https://example.com/", tab=7)
+    assert isinstance(result, str)
+    assert "Unknown tab: 7" in result
@@ -0,0 +1,86 @@
+import json
+import shutil
+import subprocess
+
+import pytest
+
+# Runs the page buffer in node, answering one take call per input line
+BUFFER_SERVER_JS = """
+const readline = require('readline');
+const lines = readline.createInterface({ input: process.stdin });
+lines.on('line', line => {
+    const request = JSON.parse(line);
+    const result = request.store !== undefined
+        ? __webnavBuffer.store(request.store, request.chunk)
+        : __webnavBuffer.take(request.id, request.offset, request.size);
+    process.stdout.write(JSON.stringify(result) + '\\n');
+});
+"""
+
+
+@pytest.fixture
+def page_buffer(webnav):
+    if shutil.which("node") is None:
+        pytest.skip("node is needed to run the page buffer")
+    process = subprocess.Popen(["node", "-e", webnav.BUFFER_JS + BUFFER_SERVER_JS], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, text=True, encoding="utf-8")
+
+    def call(request):
+        process.stdin.write(json.dumps(request) + "\n")
+        process.stdin.flush()
+        return json.loads(process.stdout.readline())
+
+    yield call
+    process.stdin.close()
+    process.wait()
+
+
+@pytest.mark.parametrize("text", [
+    "a" * 9 + "😀" * 30 + "b",
+    "😀" * 40,
+    "x😀y" * 25 + "end"
+])
+def test_buffered_transfer_keeps_characters_outside_the_bmp(webnav, navigator, page_buffer, monkeypatch, text):
+    monkeypatch.setattr(webnav, "TRANSFER_CHUNK_SIZE", 8)
+    handle = page_buffer({"store": text, "chunk": 8})
+    assert handle.startswith(webnav.BUFFER_PREFIX)
+
+    def execute(script, timeout, world, arguments=None, *args, **kwargs):
+        if "release" in script:
+            return True
+        return page_buffer({key: arguments[key] for key in ("id", "offset", "size")})
+
+    navigator.execute_javascript_sync = execute
+    chunks = list(navigator.iter_transfer(handle, webnav.SCRIPT_WORLD))
+    assert "".join(chunks) == text
+    assert all(chunk.encode("utf-16-le", "strict") for chunk in chunks)
+
+
+def test_shared_result_buffer_is_released_by_the_last_reader(webnav, navigator, page_buffer, monkeypatch):
+    monkeypatch.setattr(webnav, "TRANSFER_CHUNK_SIZE", 8)
+    handle = page_buffer({"store": json.dumps({"text": "a long snapshot result"}), "chunk": 8})
+    dispatcher = webnav.JavaScriptDispatcher(None)
+    request = webnav.JavaScriptRequest(webnav.LIBRARY_CALL_JS, webnav.SCRIPT_WORLD, {}, webnav.PRIORITY_EXTRACTION)
+    # The snapshot call was coalesced, two callers got the same handle
+    request.readers = 2
+    released = []
+
+    def execute(script, timeout, world, arguments=None, priority=None, coalesce=False, holder=None):
+        if script == webnav.LIBRARY_CALL_JS:
+            holder["request"] = request
+            return handle
+        if "release" in script:
+            released.append(arguments["id"])
+            return True
+        return page_buffer({key: arguments[key] for key in ("id", "offset", "size")})
+
+    navigator.execute_javascript_sync = execute
+    navigator.current = type("Tab", (), {"dispatcher": dispatcher})()
+    first = navigator.iter_library("snapshot")
+    second = navigator.iter_library("snapshot")
+    # The second caller finishes while the first one is still reading
+    start = next(first)
+    assert json.loads("".join(second)) == {"text": "a long snapshot result"}
+    assert released == []
+    assert json.loads(start + "".join(first)) == {"text": "a long snapshot result"}
+    assert released == [handle[len(webnav.BUFFER_PREFIX):].split(":")[0]]
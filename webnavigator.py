@@ -1,12 +1,34 @@
-from time import sleep
-from urllib.parse import urljoin
-from gi.repository import GLib
+from time import monotonic, sleep
+from urllib.parse import urljoin, urlsplit, urlunsplit, urldefrag, parse_qsl, urlencode
+from urllib.robotparser import RobotFileParser
+from html.parser import HTMLParser
+from html import unescape
+from difflib import SequenceMatcher
+from array import array
+from collections import Counter, OrderedDict, deque
+from bisect import bisect_left
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from gi.repository import Gio, GLib, WebKit
 from .extensions import NewelleExtension
 from .handlers import ExtraSettings
 from .ui.widgets import BrowserWidget
 from .utility.website_scraper import WebsiteScraper 
 import threading 
 import json
+import csv
+import io
+import heapq
+import itertools
+import http.client
+import hashlib
+import os
+import gzip
+import zlib
+import re
+import sqlite3
+import shutil
+import math
+import unicodedata
 from .tools import create_io_tool
 
 RELIABLE_PROMPT = """
@@ -14,11 +36,18 @@ RELIABLE_PROMPT = """
 You are an expert web-scraping and navigation agent. Your task is to extract accurate, verifiable information from webpages using the most efficient tools available.
 
 **Navigation & Interaction Strategy**
-1.  **Assess First:** Use `get_page_outline` or `get_page_info` to understand the page structure before deep scraping.
+1.  **Assess First:** Use `get_page_outline` or `get_page_info` to understand the page structure before deep scraping. Use `get_page_bundle` to get several of these views in a single call.
 2.  **Efficient Extraction:** Use reduced content tools (`get_page_text`, `get_page_links`, `get_main_content`, `get_page_headings`) to minimize token usage whenever possible.
 3.  **Targeted Search:** Use `search_page_text` if you are looking for specific keywords.
+    Long pages opened with `openlink` are cut, use `read_more` with the given cursor only if the part you need is further down.
+    To cover many pages of a site, use `crawl` once and then `search_page_text` with scope "all" instead of opening the pages one by one.
 4.  **Interaction:** Use `click_element`, `fill_input`, and `submit_form` to navigate through interactive sites or fill out forms. Use `scroll_page` to see content beyond the initial viewport.
-5.  **Data Extraction:** Use `get_tables` for structured data or `get_images` for visual information.
+    Use `wait_for_page` when content is loaded dynamically or after an interaction that changes page.
+    Use `harvest_scroll` to collect feeds, comments or listings that load more items while scrolling.
+    Use `run_actions` to chain several interactions, waits and a final extraction in a single call.
+    After an interaction on the same page, pass `diff=true` to `openlink` or `get_page_text` to read only what changed.
+5.  **Data Extraction:** Use `get_tables` for structured data or `get_images` for visual information. Read large tables with `get_table_rows`, only as far as needed.
+6.  **Parallel Reading:** Use `open_links` to read several pages at once, then pass the returned tab id as `tab` to the other tools to inspect one of them.
 
 **Capabilities**  
 - **Deep Navigation:** You can follow links, interact with buttons, and fill forms to locate answers across multiple pages.
@@ -52,22 +81,3205 @@ Please ensure your output contains:
 Do not include any additional commentary or details. Use only the information provided in the chat history and the web page source code.
  """
 
+# Isolated script world used by the extension, keeps its helpers away from the page scripts
+SCRIPT_WORLD = "webnavigator"
+MESSAGE_HANDLER = "webnavigator"
+
+# Load states in the order they are reached by a navigation
+LOAD_STATES = ("started", "committed", "domcontentloaded", "load", "networkidle")
+
+# Injected at document start, reports the page side load events and DOM changes to the extension
+PAGE_EVENTS_JS = """
+(function() {
+    if (window.__webnavPage) return;
+    const page = window.__webnavPage = { dirty: true };
+    const post = (message) => {
+        try {
+            window.webkit.messageHandlers.webnavigator.postMessage(JSON.stringify(message));
+        } catch (e) {}
+    };
+    const postState = (state) => post({ type: 'load', state: state, url: window.location.href });
+    document.addEventListener('DOMContentLoaded', () => postState('domcontentloaded'), { once: true });
+
+    // Network idle: no resource finished loading for 500ms after the load event
+    let idleTimer = null;
+    let observer = null;
+    const armIdle = () => {
+        clearTimeout(idleTimer);
+        idleTimer = setTimeout(() => {
+            if (observer) observer.disconnect();
+            postState('networkidle');
+        }, 500);
+    };
+    window.addEventListener('load', () => {
+        try {
+            observer = new PerformanceObserver(() => armIdle());
+            observer.observe({ type: 'resource' });
+        } catch (e) {}
+        armIdle();
+    }, { once: true });
+
+    // DOM generation: report only the first change after each snapshot.
+    // Tabs, accordions and "show more" buttons often only toggle these attributes,
+    // style is left out because animations and carousels change it all the time
+    new MutationObserver(() => {
+        if (page.dirty) return;
+        page.dirty = true;
+        post({ type: 'mutation' });
+    }).observe(document, {
+        childList: true, subtree: true, characterData: true,
+        attributes: true, attributeFilter: ['class', 'hidden', 'open', 'aria-hidden', 'aria-expanded']
+    });
+})();
+"""
+
+# Extractors shared by the snapshot, each returns the full data for one view of the page
+EXTRACTORS_JS = """
+const __webnavExtractors = {
+    info() {
+        return {
+            url: window.location.href,
+            title: document.title,
+            metaDescription: document.querySelector('meta[name="description"]')?.content || '',
+            metaKeywords: document.querySelector('meta[name="keywords"]')?.content || '',
+            canonical: document.querySelector('link[rel="canonical"]')?.href || '',
+            language: document.documentElement.lang || '',
+            charset: document.characterSet,
+            viewport: document.querySelector('meta[name="viewport"]')?.content || ''
+        };
+    },
+
+    text() {
+        // The rendered text of the live body leaves out scripts and styles and keeps the line breaks
+        const text = document.body.innerText.split('\\n')
+            .map(line => line.replace(/\\s+/g, ' ').trim())
+            .filter(line => line)
+            .join('\\n');
+        return {
+            text,
+            totalLength: text.length
+        };
+    },
+
+    links() {
+        const links = document.querySelectorAll('a[href]');
+        const result = [];
+        const seen = new Set();
+        for (const a of links) {
+            const href = a.href;
+            const text = a.innerText.trim().substring(0, 80);
+            // Skip empty links, anchors, and duplicates
+            if (!text || href.startsWith('javascript:') || seen.has(href)) continue;
+            seen.add(href);
+            result.push({ text, href });
+        }
+        return { totalLinks: links.length, links: result };
+    },
+
+    headings() {
+        const headings = [];
+        document.querySelectorAll('h1, h2, h3, h4, h5, h6').forEach(h => {
+            const text = h.innerText.trim();
+            if (text) {
+                headings.push({ level: h.tagName, text: text.substring(0, 150) });
+            }
+        });
+        return { headings };
+    },
+
+    outline() {
+        return {
+            metaDescription: document.querySelector('meta[name="description"]')?.content?.substring(0, 200) || '',
+            structure: {
+                hasNav: !!document.querySelector('nav, [role="navigation"]'),
+                hasSearch: !!document.querySelector('input[type="search"], [role="search"]'),
+                hasMain: !!document.querySelector('main, [role="main"]'),
+                hasSidebar: !!document.querySelector('aside, [role="complementary"]'),
+                hasFooter: !!document.querySelector('footer')
+            },
+            counts: {
+                headings: document.querySelectorAll('h1, h2, h3, h4, h5, h6').length,
+                links: document.querySelectorAll('a[href]').length,
+                forms: document.querySelectorAll('form').length,
+                buttons: document.querySelectorAll('button, input[type="submit"]').length,
+                inputs: document.querySelectorAll('input, textarea, select').length,
+                images: document.querySelectorAll('img').length,
+                tables: document.querySelectorAll('table').length
+            },
+            firstHeading: document.querySelector('h1')?.innerText?.substring(0, 100) || ''
+        };
+    },
+
+    interactive() {
+        const result = { buttons: [], inputs: [], forms: [] };
+        document.querySelectorAll('button, input[type="submit"], input[type="button"], [role="button"]').forEach((btn, idx) => {
+            if (idx < 15) {
+                result.buttons.push({
+                    text: (btn.innerText || btn.value || btn.title || 'button').substring(0, 50),
+                    id: btn.id || null,
+                    class: btn.className?.substring(0, 50) || null,
+                    type: btn.type || null
+                });
+            }
+        });
+        document.querySelectorAll('input:not([type="hidden"]):not([type="submit"]):not([type="button"]), textarea, select').forEach((inp, idx) => {
+            if (idx < 20) {
+                const label = inp.labels?.[0]?.innerText || inp.placeholder || inp.name || '';
+                result.inputs.push({
+                    type: inp.type || inp.tagName.toLowerCase(),
+                    name: inp.name || null,
+                    id: inp.id || null,
+                    label: label.substring(0, 50),
+                    required: inp.required || false
+                });
+            }
+        });
+        document.querySelectorAll('form').forEach((form, idx) => {
+            if (idx < 10) {
+                result.forms.push({
+                    id: form.id || null,
+                    action: form.action || null,
+                    method: form.method || 'get',
+                    inputCount: form.querySelectorAll('input, textarea, select').length
+                });
+            }
+        });
+        return result;
+    },
+
+    main() {
+        // Try to find main content area
+        const mainSelectors = ['main', 'article', '[role="main"]', '.content', '#content', '.post', '.article', '.entry-content'];
+        let mainContent = null;
+        for (const sel of mainSelectors) {
+            mainContent = document.querySelector(sel);
+            if (mainContent) break;
+        }
+        if (!mainContent) {
+            mainContent = document.body;
+        }
+        // Clone and clean
+        const clone = mainContent.cloneNode(true);
+        clone.querySelectorAll('script, style, noscript, nav, header, footer, aside').forEach(el => el.remove());
+        return {
+            content: clone.innerText.replace(/\\s+/g, ' ').trim(),
+            selector: mainContent.tagName + (mainContent.id ? '#' + mainContent.id : '')
+        };
+    },
+
+    images() {
+        // Blocked or lazy images are described from their attributes
+        const images = [];
+        document.querySelectorAll('img').forEach(img => {
+            images.push({
+                src: img.currentSrc || img.src || img.dataset.src || '',
+                alt: img.alt?.substring(0, 100) || '',
+                width: img.naturalWidth || Number(img.getAttribute('width')) || img.width,
+                height: img.naturalHeight || Number(img.getAttribute('height')) || img.height,
+                loaded: img.complete && img.naturalWidth > 0
+            });
+        });
+        return { totalImages: images.length, images };
+    }
+};
+"""
+
+# Default character budget of each part of a page bundle
+BUNDLE_BUDGETS = {
+    "info": 1000,
+    "outline": 1500,
+    "headings": 3000,
+    "links": 3000,
+    "text": 2000,
+    "main": 3000,
+    "interactive": 3000,
+    "tables": 4000,
+    "images": 2000
+}
+
+# Shrinks a value until its JSON encoding fits in a character budget
+FIT_JS = """
+const __webnavFit = (value, budget) => {
+    const size = JSON.stringify(value).length;
+    if (size <= budget) return value;
+    if (typeof value === 'string') {
+        return value.substring(0, Math.max(0, budget - (size - value.length) - 3)) + '...';
+    }
+    if (Array.isArray(value)) {
+        let low = 0, high = value.length;
+        while (low < high) {
+            const mid = Math.ceil((low + high) / 2);
+            if (JSON.stringify(value.slice(0, mid)).length <= budget) low = mid; else high = mid - 1;
+        }
+        return value.slice(0, low);
+    }
+    if (value && typeof value === 'object') {
+        const result = Object.assign({}, value);
+        for (let i = 0; i < 20; i++) {
+            const overflow = JSON.stringify(result).length - budget;
+            if (overflow <= 0) break;
+            let largest = null, largestSize = 0;
+            for (const key of Object.keys(result)) {
+                const keySize = JSON.stringify(result[key]).length;
+                if (keySize > largestSize) { largest = key; largestSize = keySize; }
+            }
+            if (largest === null) break;
+            const shrunk = __webnavFit(result[largest], Math.max(0, largestSize - overflow));
+            if (JSON.stringify(shrunk).length >= largestSize) break;
+            result[largest] = shrunk;
+        }
+        return result;
+    }
+    return value;
+};
+"""
+
+
+# Actions of the library, each one takes a single object of arguments decoded from JSON
+ACTIONS_JS = """
+const __webnavActions = {
+    // Runs every extractor once and marks the DOM as clean for the mutation observer
+    snapshot() {
+        const snapshot = {};
+        for (const name of Object.keys(__webnavExtractors)) {
+            try {
+                snapshot[name] = __webnavExtractors[name]();
+            } catch (e) {
+                snapshot[name] = { error: String(e) };
+            }
+        }
+        // Without the page events script DOM changes can't be tracked and the snapshot is not cached
+        snapshot.tracked = !!window.__webnavPage;
+        if (snapshot.tracked) window.__webnavPage.dirty = false;
+        return snapshot;
+    },
+
+    bundle({ budgets }) {
+        const result = { url: window.location.href, parts: {}, truncated: [] };
+        for (const name of Object.keys(budgets)) {
+            let part;
+            try {
+                part = __webnavExtractors[name]();
+            } catch (e) {
+                part = { error: String(e) };
+            }
+            const fitted = __webnavFit(part, budgets[name]);
+            if (fitted !== part) result.truncated.push(name);
+            result.parts[name] = fitted;
+        }
+        return result;
+    },
+
+    exists({ selector }) {
+        return !!document.querySelector(selector);
+    },
+
+    resources() {
+        const entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+        let transferSize = 0, bodySize = 0;
+        for (const entry of entries) {
+            transferSize += entry.transferSize || 0;
+            bodySize += entry.encodedBodySize || 0;
+        }
+        return { requests: entries.length, transferSize, bodySize };
+    },
+
+    // Every table as a grid, cells spanning several rows or columns are repeated in each of them
+    table_grid({ maxCell }) {
+        const tables = [];
+        document.querySelectorAll('table').forEach((table, index) => {
+            const rows = Array.from(table.rows);
+            const grid = rows.map(() => []);
+            let headerRows = 0;
+            rows.forEach((tr, r) => {
+                let column = 0;
+                let header = tr.cells.length > 0;
+                for (const cell of tr.cells) {
+                    while (grid[r][column] !== undefined) column++;
+                    // textContent avoids a layout per cell on large tables
+                    const text = cell.textContent.replace(/\\s+/g, ' ').trim().substring(0, maxCell);
+                    const rowSpan = cell.rowSpan === 0 ? rows.length - r : Math.min(Math.max(cell.rowSpan, 1), rows.length - r);
+                    const colSpan = Math.min(Math.max(cell.colSpan, 1), 1000);
+                    for (let i = 0; i < rowSpan; i++) {
+                        for (let j = 0; j < colSpan; j++) grid[r + i][column + j] = text;
+                    }
+                    column += colSpan;
+                    if (cell.tagName !== 'TH') header = false;
+                }
+                // Header rows are the leading rows in a thead or made only of th cells
+                if (r === headerRows && (header || tr.parentElement.tagName === 'THEAD')) headerRows++;
+            });
+            // Spreading one argument per row would overflow the argument limit on large tables
+            const width = grid.reduce((max, row) => Math.max(max, row.length), 0);
+            tables.push({
+                index,
+                id: table.id || null,
+                caption: table.caption?.textContent.replace(/\\s+/g, ' ').trim() || null,
+                headerRows: Math.min(headerRows, rows.length),
+                width,
+                rows: grid.map(row => Array.from({ length: width }, (_, i) => row[i] ?? ''))
+            });
+        });
+        return { tables };
+    },
+
+    click({ selector }) {
+        const el = document.querySelector(selector);
+        if (el) {
+            const tagName = el.tagName;
+            const href = el.href;
+            const text = el.innerText?.substring(0, 50) || '';
+            el.click();
+            return { success: true, clicked: tagName, href: href || null, text: text };
+        }
+        return { success: false, error: 'Element not found: ' + selector };
+    },
+
+    fill({ selector, value }) {
+        const el = document.querySelector(selector);
+        if (el) {
+            el.value = value;
+            el.dispatchEvent(new Event('input', { bubbles: true }));
+            el.dispatchEvent(new Event('change', { bubbles: true }));
+            return { success: true, filled: el.tagName, name: el.name || el.id };
+        }
+        return { success: false, error: 'Element not found: ' + selector };
+    },
+
+    submit({ selector }) {
+        const form = document.querySelector(selector);
+        if (form) {
+            form.submit();
+            return { success: true, submitted: true };
+        }
+        return { success: false, error: 'Form not found: ' + selector };
+    },
+
+    scroll({ direction, amount }) {
+        amount = Number(amount) || 0;
+        let scrolled = false;
+        if (direction === 'down') {
+            window.scrollBy(0, amount);
+            scrolled = true;
+        } else if (direction === 'up') {
+            window.scrollBy(0, -amount);
+            scrolled = true;
+        } else if (direction === 'top') {
+            window.scrollTo(0, 0);
+            scrolled = true;
+        } else if (direction === 'bottom') {
+            window.scrollTo(0, document.body.scrollHeight);
+            scrolled = true;
+        }
+        return {
+            success: scrolled,
+            scrollY: window.scrollY,
+            scrollHeight: document.body.scrollHeight,
+            viewportHeight: window.innerHeight
+        };
+    },
+
+    // Run consecutive in-page steps, stopping at the first one that fails
+    async sequence({ steps }) {
+        const results = [];
+        for (const step of steps) {
+            const started = performance.now();
+            let result;
+            try {
+                if (step.action === 'wait_for_selector') {
+                    const deadline = started + step.timeout;
+                    while (!document.querySelector(step.selector)) {
+                        if (performance.now() >= deadline) throw new Error('Selector not found: ' + step.selector);
+                        await new Promise(resolve => setTimeout(resolve, 100));
+                    }
+                    result = { success: true };
+                } else if (['click', 'fill', 'submit', 'scroll'].includes(step.action)) {
+                    result = await __webnavActions[step.action](step);
+                } else {
+                    throw new Error('Unknown action: ' + step.action);
+                }
+            } catch (e) {
+                result = { success: false, error: String(e && e.message || e) };
+            }
+            results.push({ action: step.action, ...result, elapsedMs: Math.round(performance.now() - started) });
+            if (!result.success) break;
+        }
+        return { results };
+    },
+
+    // Scroll to the bottom until the page stops growing, collecting only the inserted elements
+    async harvest({ maxItems, maxChars, maxMs, idleMs, stepMs }) {
+        const seen = new Set();
+        const taken = new WeakSet();
+        const batches = [];
+        let batch = [];
+        let items = 0, chars = 0;
+        const isTaken = (node) => {
+            for (let parent = node; parent; parent = parent.parentElement) {
+                if (taken.has(parent)) return true;
+            }
+            return false;
+        };
+        const take = (node) => {
+            if (items >= maxItems || node.nodeType !== Node.ELEMENT_NODE || !node.isConnected || isTaken(node)) return;
+            const text = (node.innerText || '').replace(/\\s+/g, ' ').trim();
+            if (text.length < 2) return;
+            // Pages of results inserted at once are split in their items
+            if (text.length > 2000 && node.children.length >= 3) {
+                for (const child of node.children) take(child);
+                return;
+            }
+            taken.add(node);
+            if (seen.has(text)) return;
+            seen.add(text);
+            batch.push(text);
+            items++;
+            chars += text.length;
+        };
+        const observer = new MutationObserver(records => {
+            for (const record of records) {
+                for (const node of record.addedNodes) take(node);
+            }
+        });
+        observer.observe(document.body, { childList: true, subtree: true });
+        const start = performance.now();
+        let lastGrowth = start;
+        let height = document.documentElement.scrollHeight;
+        let rounds = 0;
+        let reason = 'idle';
+        try {
+            while (true) {
+                window.scrollTo(0, document.documentElement.scrollHeight);
+                rounds++;
+                await new Promise(resolve => setTimeout(resolve, stepMs));
+                const now = performance.now();
+                if (batch.length || document.documentElement.scrollHeight > height) {
+                    lastGrowth = now;
+                    height = document.documentElement.scrollHeight;
+                }
+                if (batch.length) {
+                    batches.push(batch);
+                    batch = [];
+                }
+                if (items >= maxItems) { reason = 'items'; break; }
+                if (chars >= maxChars) { reason = 'chars'; break; }
+                if (now - start >= maxMs) { reason = 'time'; break; }
+                if (now - lastGrowth >= idleMs) break;
+            }
+        } finally {
+            observer.disconnect();
+        }
+        if (batch.length) batches.push(batch);
+        return {
+            url: window.location.href,
+            stopReason: reason,
+            itemCount: items,
+            chars: chars,
+            rounds: rounds,
+            elapsedMs: Math.round(performance.now() - start),
+            scrollHeight: document.documentElement.scrollHeight,
+            batches: batches
+        };
+    }
+};
+"""
+
+# Installed once per page as a user script in the extension world, page scripts can't see it
+# Results longer than a chunk stay in the page and are pulled by the extension in chunks of this size
+TRANSFER_CHUNK_SIZE = 256 * 1024
+BUFFER_PREFIX = "@webnav-buffer:"
+
+# Page side storage of long results, read back with take() and freed with release()
+BUFFER_JS = """
+const __webnavBuffer = {
+    next: 0,
+    items: new Map(),
+    store(text, chunk) {
+        chunk = Number(chunk) || 0;
+        if (!chunk || text.length <= chunk) return text;
+        const id = String(++this.next);
+        this.items.set(id, text);
+        // Results nobody came back for don't pile up
+        if (this.items.size > 8) this.items.delete(this.items.keys().next().value);
+        return '""" + BUFFER_PREFIX + """' + id + ':' + text.length;
+    },
+    // Offsets count UTF-16 code units, the end of the chunk is sent with it so the reader doesn't count them
+    take(id, offset, size) {
+        const text = this.items.get(id);
+        if (text === undefined) throw new Error('Unknown buffer: ' + id);
+        offset = Number(offset);
+        let end = Math.min(text.length, offset + Number(size));
+        // A chunk never ends between the two halves of a surrogate pair
+        const last = text.charCodeAt(end - 1);
+        if (end < text.length && end - 1 > offset && last >= 0xD800 && last <= 0xDBFF) end--;
+        return end + ':' + text.substring(offset, end);
+    },
+    release(id) {
+        return this.items.delete(id);
+    }
+};
+"""
+
+LIBRARY_JS = "(function() {\nif (window.__webnav) return;\n" + EXTRACTORS_JS + FIT_JS + ACTIONS_JS + BUFFER_JS + """
+window.__webnav = {
+    buffer: __webnavBuffer,
+    call: async (name, args, chunk) => {
+        if (!Object.hasOwn(__webnavActions, name)) throw new Error('Unknown action: ' + name);
+        return __webnavBuffer.store(JSON.stringify(await __webnavActions[name](JSON.parse(args))), chunk);
+    }
+};
+})();
+"""
+
+# Steps of run_actions executed in the page by the sequence action, the others are run by the navigator
+PAGE_STEPS = {"click", "fill", "submit", "scroll", "wait_for_selector"}
+# Steps that can unload the page, a batch of in-page steps ends after them
+NAVIGATING_STEPS = {"click", "submit"}
+
+# Function body run for every library call, name, args and chunk are passed as arguments
+LIBRARY_MISSING = "__webnav_missing__"
+LIBRARY_CALL_JS = "if (!window.__webnav) return '" + LIBRARY_MISSING + "'; return window.__webnav.call(name, args, chunk);"
+PAGE_HTML_JS = "if (!window.__webnav) return '" + LIBRARY_MISSING + "'; return window.__webnav.buffer.store(document.documentElement.outerHTML, chunk);"
+
+# Custom code runs in the page world, its long results are buffered under a symbol of the page window
+EVAL_BLOCKED = "__webnav_eval_blocked__"
+PAGE_BUFFER_JS = "(window[Symbol.for('webnavigator.buffer')] ??= (function() {" + BUFFER_JS + "return __webnavBuffer; })())"
+PAGE_EVAL_JS = "const buffer = " + PAGE_BUFFER_JS + """;
+let value;
+try {
+    value = (0, eval)(code);
+} catch (e) {
+    // Pages forbidding eval in their CSP get the code evaluated directly
+    if (e instanceof EvalError) return '""" + EVAL_BLOCKED + """';
+    throw e;
+}
+return buffer.store(String(value), chunk);
+"""
+
+# Function bodies reading back a buffered result, keyed by script world
+BUFFER_TAKE_JS = {
+    SCRIPT_WORLD: "return window.__webnav.buffer.take(id, offset, size);",
+    None: "return " + PAGE_BUFFER_JS + ".take(id, offset, size);"
+}
+BUFFER_RELEASE_JS = {
+    SCRIPT_WORLD: "return window.__webnav.buffer.release(id);",
+    None: "return " + PAGE_BUFFER_JS + ".release(id);"
+}
+
+# Library actions that don't change the page, concurrent identical calls share one run
+LIBRARY_READ_ONLY = {"snapshot", "bundle", "exists", "resources", "table_grid"}
+
+
+def json_size(value) -> int:
+    """Length of the compact JSON encoding of a value, as produced by JSON.stringify"""
+    return len(json.dumps(value, separators=(",", ":"), ensure_ascii=False))
+
+
+def fit_to_budget(value, budget: int):
+    """Shrink a JSON serializable value until its encoding fits in budget characters, mirrors FIT_JS"""
+    size = json_size(value)
+    if size <= budget:
+        return value
+    if isinstance(value, str):
+        return value[:max(0, budget - (size - len(value)) - 3)] + "..."
+    if isinstance(value, list):
+        low, high = 0, len(value)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if json_size(value[:mid]) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        return value[:low]
+    if isinstance(value, dict):
+        result = dict(value)
+        for _ in range(20):
+            overflow = json_size(result) - budget
+            if overflow <= 0:
+                break
+            sizes = {key: json_size(item) for key, item in result.items()}
+            if not sizes:
+                break
+            largest = max(sizes, key=sizes.get)
+            shrunk = fit_to_budget(result[largest], max(0, sizes[largest] - overflow))
+            if json_size(shrunk) >= sizes[largest]:
+                break
+            result[largest] = shrunk
+        return result
+    return value
+
+
+class PageSnapshotCache:
+    """
+    Python side copy of the last structured snapshot of a page.
+
+    The snapshot is valid as long as the navigation and the DOM generation
+    reported by the PageLoadWatcher don't change.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.capture_lock = threading.Lock()
+        self.key = None
+        self.snapshot = None
+        self.derived = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> dict | None:
+        with self.lock:
+            if key is not None and key == self.key:
+                self.hits += 1
+                return self.snapshot
+            self.misses += 1
+            return None
+
+    def put(self, key, snapshot: dict):
+        with self.lock:
+            self.key = key
+            self.snapshot = snapshot
+            self.derived = {}
+
+    def derive(self, key, name: str, build):
+        """Get data computed from the snapshot of a key, built once per snapshot"""
+        with self.lock:
+            if key is not None and key == self.key and name in self.derived:
+                return self.derived[name]
+        # Built without the lock, slow builds don't hold back the snapshot readers
+        value = build()
+        with self.lock:
+            if key is not None and key == self.key:
+                value = self.derived.setdefault(name, value)
+        return value
+
+    def invalidate(self):
+        with self.lock:
+            self.key = None
+            self.snapshot = None
+            self.derived = {}
+
+
+# Priorities of the JavaScript dispatcher, lower values run first
+PRIORITY_NAVIGATION = 0
+PRIORITY_ACTION = 1
+PRIORITY_EXTRACTION = 2
+
+
+class JavaScriptRequest:
+    """A script or main thread call waiting in the JavaScriptDispatcher queue"""
+
+    def __init__(self, script, world: str | None, arguments: dict | None, priority: int):
+        self.script = script
+        self.world = world
+        self.arguments = arguments
+        self.priority = priority
+        self.callbacks = []
+        self.cancellable = Gio.Cancellable()
+        self.cancelled = False
+        self.started = False
+        self.enqueued_at = monotonic()
+        self.started_at = None
+        # Callers the result was given to that didn't finish reading it
+        self.readers = 0
+
+    def key(self) -> tuple:
+        return (self.script, self.world, tuple(sorted((self.arguments or {}).items())))
+
+
+class JavaScriptDispatcher:
+    """
+    Run scripts in a webview from any thread.
+
+    Pending requests are kept in a priority queue drained by a single idle
+    callback on the main thread, identical read-only requests are coalesced
+    and requests whose caller gave up are cancelled.
+    """
+
+    def __init__(self, webview):
+        self.webview = webview
+        self.lock = threading.Lock()
+        self.queue = []
+        self.pending = {}
+        self.sequence = itertools.count()
+        self.scheduled = False
+        self.stats = {
+            "submitted": 0,
+            "coalesced": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "max_queue_depth": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "total_run_ms": 0.0
+        }
+
+    def submit(self, script, callback, world: str | None = None, arguments: dict | None = None,
+               priority: int = PRIORITY_EXTRACTION, coalesce: bool = False) -> JavaScriptRequest:
+        """
+        Queue a script, or a callable to run on the main thread.
+
+        Args:
+            script (str | callable): JavaScript code, run as a function body if arguments are given
+            callback (callable): receives (result, error) on the main thread, never called if cancelled
+            world (str | None): Script world to run the code in, None for the page world
+            arguments (dict | None): String arguments, see WebNavigator.run_javascript
+            priority (int): one of the PRIORITY_* constants
+            coalesce (bool): share the result with an identical request still in the queue
+
+        Returns:
+            JavaScriptRequest: handle that can be passed to cancel()
+        """
+        request = JavaScriptRequest(script, world, arguments, priority)
+        with self.lock:
+            self.stats["submitted"] += 1
+            if coalesce and not callable(script):
+                existing = self.pending.get(request.key())
+                if existing is not None and not existing.cancelled:
+                    existing.callbacks.append(callback)
+                    self.stats["coalesced"] += 1
+                    return existing
+                self.pending[request.key()] = request
+            request.callbacks.append(callback)
+            heapq.heappush(self.queue, (priority, next(self.sequence), request))
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self.queue))
+            if not self.scheduled:
+                self.scheduled = True
+                GLib.idle_add(self._drain)
+        return request
+
+    def cancel(self, request: JavaScriptRequest, callback=None):
+        """Drop a callback of a request, the request itself is cancelled once nobody waits for it"""
+        with self.lock:
+            if callback is not None and callback in request.callbacks:
+                request.callbacks.remove(callback)
+            if request.callbacks and callback is not None:
+                return
+            request.cancelled = True
+            self.stats["cancelled"] += 1
+            if self.pending.get(request.key()) is request:
+                del self.pending[request.key()]
+        # Cancellables are thread safe, a running script stops reporting its result
+        request.cancellable.cancel()
+
+    def finish_reading(self, request: JavaScriptRequest) -> bool:
+        """Count a caller done with the result of a request, True for the last one"""
+        with self.lock:
+            request.readers -= 1
+            return request.readers <= 0
+
+    def queue_depth(self) -> int:
+        with self.lock:
+            return len(self.queue)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["queue_depth"] = len(self.queue)
+        started = stats["completed"] + stats["failed"]
+        stats["avg_wait_ms"] = round(stats.pop("total_wait_ms") / max(1, started), 2)
+        stats["avg_run_ms"] = round(stats.pop("total_run_ms") / max(1, started), 2)
+        stats["max_wait_ms"] = round(stats["max_wait_ms"], 2)
+        return stats
+
+    def _drain(self):
+        with self.lock:
+            requests = [heapq.heappop(self.queue)[2] for _ in range(len(self.queue))]
+            self.scheduled = False
+        for request in requests:
+            with self.lock:
+                if self.pending.get(request.key()) is request:
+                    del self.pending[request.key()]
+                if request.cancelled:
+                    continue
+                request.started = True
+                request.started_at = monotonic()
+                wait_ms = (request.started_at - request.enqueued_at) * 1000
+                self.stats["total_wait_ms"] += wait_ms
+                self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], wait_ms)
+            if callable(request.script):
+                try:
+                    self._finish(request, request.script(), None)
+                except Exception as e:
+                    self._finish(request, None, str(e))
+            elif request.arguments is None:
+                self.webview.evaluate_javascript(
+                    request.script,
+                    -1,
+                    request.world,
+                    None,
+                    request.cancellable,
+                    self._on_javascript_finished,
+                    request
+                )
+            else:
+                self.webview.call_async_javascript_function(
+                    request.script,
+                    -1,
+                    GLib.Variant("a{sv}", {key: GLib.Variant("s", value) for key, value in request.arguments.items()}),
+                    request.world,
+                    None,
+                    request.cancellable,
+                    self._on_javascript_finished,
+                    request
+                )
+        return False  # Don't repeat
+
+    def _on_javascript_finished(self, webview, result, request):
+        try:
+            if request.arguments is None:
+                js_result = webview.evaluate_javascript_finish(result)
+            else:
+                js_result = webview.call_async_javascript_function_finish(result)
+            if js_result:
+                self._finish(request, js_result.to_string(), None)
+            else:
+                self._finish(request, None, "Failed to get JavaScript result")
+        except Exception as e:
+            self._finish(request, None, str(e))
+
+    def _finish(self, request: JavaScriptRequest, value, error):
+        with self.lock:
+            if request.cancelled:
+                return
+            self.stats["failed" if error else "completed"] += 1
+            self.stats["total_run_ms"] += (monotonic() - request.started_at) * 1000
+            callbacks = list(request.callbacks)
+            request.readers = len(callbacks)
+        for callback in callbacks:
+            callback(value, error)
+
+
+class PageLoadWatcher:
+    """
+    Track the load state of a browser tab using WebKit navigation events.
+
+    Signal handlers run on the GTK main thread, tool threads block on wait()
+    with a deadline instead of polling or sleeping.
+    """
+
+    def __init__(self, driver: BrowserWidget):
+        self.driver = driver
+        self.cond = threading.Condition()
+        self.navigation = 0
+        self.generation = 0
+        self.state = -1
+        self.error = None
+        self.url = ""
+        self.started_at = monotonic()
+        webview = driver.webview
+        webview.connect("load-changed", self._on_load_changed)
+        webview.connect("load-failed", self._on_load_failed)
+        manager = webview.get_user_content_manager()
+        manager.add_script(WebKit.UserScript.new_for_world(
+            PAGE_EVENTS_JS,
+            WebKit.UserContentInjectedFrames.TOP_FRAME,
+            WebKit.UserScriptInjectionTime.START,
+            SCRIPT_WORLD,
+            None,
+            None
+        ))
+        manager.connect("script-message-received::" + MESSAGE_HANDLER, self._on_script_message)
+        manager.register_script_message_handler(MESSAGE_HANDLER, SCRIPT_WORLD)
+
+    def begin_navigation(self) -> int:
+        """Start tracking a new navigation, waiters of the previous one are released"""
+        with self.cond:
+            self.navigation += 1
+            self.generation += 1
+            self.state = -1
+            self.error = None
+            self.started_at = monotonic()
+            self.cond.notify_all()
+            return self.navigation
+
+    def snapshot_key(self) -> tuple:
+        """Key identifying the current document and DOM version"""
+        with self.cond:
+            return (self.navigation, self.generation, self.url)
+
+    def _set_state(self, state: str, url: str | None = None):
+        with self.cond:
+            index = LOAD_STATES.index(state)
+            # Ignore page events until the current navigation has started
+            if self.state < 0 and state != "started":
+                return
+            if index > self.state:
+                self.state = index
+            if url:
+                self.url = url
+            self.cond.notify_all()
+
+    def _on_load_changed(self, webview, load_event):
+        if load_event == WebKit.LoadEvent.STARTED:
+            # Navigations started by the page itself (links, forms) are tracked too
+            with self.cond:
+                if self.state >= 0:
+                    self.navigation += 1
+                    self.error = None
+                    self.started_at = monotonic()
+                self.generation += 1
+                self.state = -1
+            self._set_state("started", webview.get_uri())
+        elif load_event == WebKit.LoadEvent.COMMITTED:
+            self._set_state("committed", webview.get_uri())
+        elif load_event == WebKit.LoadEvent.FINISHED:
+            self._set_state("load", webview.get_uri())
+
+    def _on_load_failed(self, webview, load_event, failing_uri, error):
+        with self.cond:
+            self.error = error.message if error is not None else "Load failed"
+            self.cond.notify_all()
+        return False
+
+    def _on_script_message(self, manager, value):
+        try:
+            message = json.loads(value.to_string())
+        except Exception:
+            return
+        if message.get("type") == "load" and message.get("state") in LOAD_STATES:
+            with self.cond:
+                # Until the new document is committed, messages can only come from the previous one
+                if self.state < LOAD_STATES.index("committed"):
+                    return
+            self._set_state(message["state"], message.get("url"))
+        elif message.get("type") == "mutation":
+            with self.cond:
+                self.generation += 1
+
+    def wait(self, state: str = "load", timeout: float = 30, navigation: int | None = None, follow: bool = True) -> dict:
+        """
+        Wait until the navigation reaches the given load state.
+
+        Args:
+            state (str): one of LOAD_STATES
+            timeout (float): deadline in seconds
+            navigation (int | None): navigation id returned by begin_navigation,
+                                     None waits for the next navigation started after the call
+            follow (bool): keep waiting on navigations that replace the awaited one
+
+        Returns:
+            dict: reached state, url, elapsed time and whether the wait timed out
+        """
+        target = LOAD_STATES.index(state)
+        deadline = monotonic() + timeout
+        with self.cond:
+            if navigation is None:
+                navigation = self.navigation + 1
+            while True:
+                if self.navigation > navigation:
+                    # Redirects made by the page replace the navigation we were waiting for
+                    if not follow:
+                        outcome = "superseded"
+                        break
+                    navigation = self.navigation
+                if self.navigation == navigation:
+                    # A failed load never reaches the later states
+                    if self.error is not None and self.state >= LOAD_STATES.index("load"):
+                        outcome = "failed"
+                        break
+                    if self.state >= target:
+                        outcome = "ok"
+                        break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    outcome = "timeout"
+                    break
+                self.cond.wait(remaining)
+            return {
+                "success": outcome == "ok",
+                "outcome": outcome,
+                "state": LOAD_STATES[self.state] if self.state >= 0 and self.navigation == navigation else None,
+                "url": self.url,
+                "error": self.error,
+                "elapsed_ms": int((monotonic() - self.started_at) * 1000)
+            }
+
+
+class BrowserTab:
+    """A browser tab used by the navigator, with its own load state, script queue and snapshot"""
+
+    def __init__(self, tab, driver: BrowserWidget):
+        self.id = 0
+        self.tab = tab
+        self.driver = driver
+        self.lasturl = ""
+        # Page the browser shows, lasturl is ahead of it when a page was read without rendering it
+        self.loaded_url = ""
+        self.busy = False
+        self.content_filter = None
+        self.dispatcher = JavaScriptDispatcher(driver.webview)
+        self.load_watcher = PageLoadWatcher(driver)
+        self.snapshot_cache = PageSnapshotCache()
+        self.last_text = None
+        driver.webview.get_user_content_manager().add_script(WebKit.UserScript.new_for_world(
+            LIBRARY_JS,
+            WebKit.UserContentInjectedFrames.TOP_FRAME,
+            WebKit.UserScriptInjectionTime.START,
+            SCRIPT_WORLD,
+            None,
+            None
+        ))
+
+    def is_open(self) -> bool:
+        return self.driver.get_display() is not None
+
+    def get_stats(self) -> dict:
+        return {
+            "url": self.lasturl,
+            "busy": self.busy,
+            "javascript": self.dispatcher.get_stats(),
+            "snapshot": {"hits": self.snapshot_cache.hits, "misses": self.snapshot_cache.misses}
+        }
+
+
+class BrowserPool:
+    """
+    Bounded set of browser tabs.
+
+    Tabs are handed out with acquire() and given back with release(), new
+    tabs are created on demand until max_tabs is reached.
+    """
+
+    def __init__(self, create_tab, max_tabs: int):
+        self.create_tab = create_tab
+        self.max_tabs = max_tabs
+        self.cond = threading.Condition()
+        self.tabs = []
+        self.creating = 0
+        self.ids = itertools.count(1)
+
+    def add(self, tab: BrowserTab):
+        with self.cond:
+            if tab not in self.tabs:
+                tab.id = next(self.ids)
+                self.tabs.append(tab)
+                self.cond.notify_all()
+
+    def get(self, tab_id: int) -> BrowserTab | None:
+        with self.cond:
+            for tab in self.tabs:
+                if tab.id == tab_id:
+                    return tab
+        return None
+
+    def list(self) -> list[BrowserTab]:
+        with self.cond:
+            return list(self.tabs)
+
+    def acquire(self, timeout: float, exclude: BrowserTab | None = None) -> BrowserTab:
+        """
+        Get a free tab, creating one if the pool is not full, waiting at most timeout seconds.
+        The excluded tab is never handed out and doesn't count toward max_tabs.
+        """
+        deadline = monotonic() + timeout
+        with self.cond:
+            while True:
+                self.tabs = [tab for tab in self.tabs if tab.is_open()]
+                for tab in self.tabs:
+                    if not tab.busy and tab is not exclude:
+                        tab.busy = True
+                        return tab
+                if len(self.tabs) - (exclude in self.tabs) + self.creating < self.max_tabs:
+                    self.creating += 1
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise Exception("No free browser tab")
+                self.cond.wait(remaining)
+        tab = None
+        try:
+            tab = self.create_tab()
+        finally:
+            with self.cond:
+                self.creating -= 1
+                if tab is not None:
+                    tab.id = next(self.ids)
+                    tab.busy = True
+                    self.tabs.append(tab)
+                self.cond.notify_all()
+        if tab is None:
+            raise Exception("Could not open a browser tab")
+        return tab
+
+    def release(self, tab: BrowserTab):
+        with self.cond:
+            tab.busy = False
+            self.cond.notify_all()
+
+# Ad and tracker hosts blocked by the scrape mode
+TRACKER_HOSTS = (
+    "doubleclick.net", "googlesyndication.com", "google-analytics.com", "googletagmanager.com",
+    "googleadservices.com", "adservice.google.com", "facebook.net", "scorecardresearch.com",
+    "quantserve.com", "taboola.com", "outbrain.com", "criteo.com", "criteo.net", "amazon-adsystem.com",
+    "adnxs.com", "hotjar.com", "segment.io", "segment.com", "mixpanel.com", "nr-data.net",
+    "chartbeat.com", "chartbeat.net", "moatads.com", "pubmatic.com", "rubiconproject.com",
+    "casalemedia.com", "openx.net", "yieldmo.com"
+)
+
+
+def build_block_rules(exempt_domains: list[str]) -> str:
+    """
+    Content blocker rules of the scrape mode: images, fonts, media, ad and
+    tracker requests and third party frames, except on the exempt sites.
+    """
+    condition = {"unless-domain": ["*" + domain for domain in exempt_domains]} if exempt_domains else {}
+    rules = [
+        {"trigger": {"url-filter": ".*", "resource-type": ["image", "font", "media", "svg-document"], **condition},
+         "action": {"type": "block"}},
+        {"trigger": {"url-filter": ".*", "resource-type": ["document"], "load-type": ["third-party"],
+                     "load-context": ["child-frame"], **condition},
+         "action": {"type": "block"}}
+    ]
+    # Content blocker regexes have no alternation, every host needs its own rule
+    for host in TRACKER_HOSTS:
+        rules.append({"trigger": {"url-filter": r"^https?://([^/]+\.)?" + host.replace(".", r"\.") + "[:/]", **condition},
+                      "action": {"type": "block"}})
+    return json.dumps(rules)
+
+
+class ResourceBlocker:
+    """
+    Compile content filters with WebKit and apply them to browser tabs.
+    Compiled filters are kept on disk, the same rules are only compiled once.
+    All the methods must be called on the main thread.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.store = WebKit.UserContentFilterStore.new(path)
+        self.filters = {}
+        self.ready = {}
+        self.error = None
+
+    @staticmethod
+    def identifier(rules: str) -> str:
+        return "webnavigator-" + hashlib.sha1(rules.encode()).hexdigest()[:16]
+
+    def prepare(self, rules: str) -> threading.Event:
+        """
+        Load the filter of some rules from the disk, or compile it if it is not there.
+
+        Returns:
+            threading.Event: set once the filter is ready or failed to compile
+        """
+        identifier = self.identifier(rules)
+        event = self.ready.get(identifier)
+        if event is None:
+            event = self.ready[identifier] = threading.Event()
+            self.store.load(identifier, None, self._on_loaded, (identifier, rules))
+        return event
+
+    def apply(self, tab: "BrowserTab", rules: str) -> bool:
+        """Set the filter of some rules on a tab, the tab is left unfiltered while it is not ready"""
+        content_filter = self.filters.get(self.identifier(rules))
+        if content_filter is None:
+            self.prepare(rules)
+        self._set_filter(tab, content_filter)
+        return content_filter is not None
+
+    def remove(self, tab: "BrowserTab"):
+        self._set_filter(tab, None)
+
+    def _set_filter(self, tab: "BrowserTab", content_filter):
+        if tab.content_filter is content_filter:
+            return
+        manager = tab.driver.webview.get_user_content_manager()
+        if tab.content_filter is not None:
+            manager.remove_filter(tab.content_filter)
+        if content_filter is not None:
+            manager.add_filter(content_filter)
+        tab.content_filter = content_filter
+
+    def _on_loaded(self, store, result, data):
+        identifier, rules = data
+        try:
+            self.filters[identifier] = store.load_finish(result)
+        except Exception:
+            # Never compiled, or compiled by another WebKit version
+            store.save(identifier, GLib.Bytes.new(rules.encode()), None, self._on_saved, identifier)
+            return
+        self.ready[identifier].set()
+
+    def _on_saved(self, store, result, identifier):
+        try:
+            self.filters[identifier] = store.save_finish(result)
+        except Exception as e:
+            self.error = str(e)
+        self.ready[identifier].set()
+
+
+HTTP_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15"
+
+# Markers of pages that render their content with JavaScript
+JS_SHELL_MARKERS = ('id="root"', "id='root'", 'id="app"', "id='app'", "id=\"__next\"", "__NEXT_DATA__", "window.__NUXT__", "ng-version", "data-reactroot")
+
+
+class HTTPResult:
+    """Response of the KeepAliveHTTPClient"""
+
+    def __init__(self, url: str, status: int, headers: dict, body: bytes, truncated: bool):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.truncated = truncated
+
+    def content_type(self) -> str:
+        return self.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    def text(self) -> str:
+        """Decode the body using the declared or the sniffed charset"""
+        match = re.search(r"charset=[\"']?([\w-]+)", self.headers.get("content-type", ""))
+        if match is None:
+            match = re.search(rb"<meta[^>]+charset=[\"']?([\w-]+)", self.body[:2048], re.IGNORECASE)
+        charset = match.group(1) if match is not None else "utf-8"
+        if isinstance(charset, bytes):
+            charset = charset.decode("ascii")
+        try:
+            return self.body.decode(charset, errors="replace")
+        except LookupError:
+            return self.body.decode("utf-8", errors="replace")
+
+
+class KeepAliveHTTPClient:
+    """
+    Small thread safe HTTP client keeping idle connections open per host,
+    so consecutive requests to the same site skip the TCP and TLS handshakes.
+    """
+
+    def __init__(self, max_idle_per_host: int = 4, timeout: float = 15):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.stats = {"requests": 0, "reused_connections": 0, "bytes": 0}
+
+    def _connect(self, key: tuple, timeout: float):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _acquire(self, key: tuple, timeout: float):
+        with self.lock:
+            pool = self.idle.get(key)
+            if pool:
+                self.stats["reused_connections"] += 1
+                connection = pool.pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+        return self._connect(key, timeout), False
+
+    def _release(self, key: tuple, connection):
+        with self.lock:
+            pool = self.idle.setdefault(key, [])
+            if len(pool) < self.max_idle_per_host:
+                pool.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """Close every idle connection"""
+        with self.lock:
+            pools = list(self.idle.values())
+            self.idle = {}
+        for pool in pools:
+            for connection in pool:
+                connection.close()
+
+    def get(self, url: str, headers: dict | None = None, max_bytes: int = 10 * 1024 * 1024,
+            timeout: float | None = None, max_redirects: int = 5) -> HTTPResult:
+        """
+        Fetch a URL following redirects.
+
+        Args:
+            url (str): http or https URL
+            headers (dict | None): additional request headers
+            max_bytes (int): bodies longer than this are truncated
+            timeout (float | None): socket timeout in seconds
+            max_redirects (int): maximum number of redirects to follow
+
+        Returns:
+            HTTPResult: the final response
+        """
+        timeout = timeout or self.timeout
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                raise ValueError(f"Unsupported URL: {url}")
+            key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+            path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+            request_headers = {
+                "Host": parts.netloc,
+                "User-Agent": HTTP_USER_AGENT,
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Encoding": "gzip, deflate",
+                "Connection": "keep-alive"
+            }
+            request_headers.update(headers or {})
+            status, response_headers, body, truncated = self._request(key, path, request_headers, max_bytes, timeout)
+            location = response_headers.get("location")
+            if status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            return HTTPResult(url, status, response_headers, body, truncated)
+        raise Exception(f"Too many redirects: {url}")
+
+    def _request(self, key: tuple, path: str, headers: dict, max_bytes: int, timeout: float) -> tuple:
+        with self.lock:
+            self.stats["requests"] += 1
+        connection, reused = self._acquire(key, timeout)
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, ConnectionError, OSError):
+            connection.close()
+            # The server may have dropped an idle connection, retry once on a new one
+            if not reused:
+                raise
+            connection = self._connect(key, timeout)
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+        try:
+            body = response.read(max_bytes + 1)
+            truncated = len(body) > max_bytes
+            body = body[:max_bytes]
+            response_headers = {name.lower(): value for name, value in response.getheaders()}
+        except Exception:
+            connection.close()
+            raise
+        with self.lock:
+            self.stats["bytes"] += len(body)
+        if truncated or response.will_close or not response.isclosed():
+            connection.close()
+        else:
+            self._release(key, connection)
+        encoding = response_headers.get("content-encoding", "").lower()
+        if not truncated:
+            if encoding == "gzip":
+                body = gzip.decompress(body)
+            elif encoding == "deflate":
+                body = zlib.decompress(body, -zlib.MAX_WBITS) if body[:1] != b"\x78" else zlib.decompress(body)
+        return response.status, response_headers, body, truncated
+
+
+def domain_matches(url: str, domains: list[str]) -> bool:
+    """Check if the host of a URL is one of the domains or one of their subdomains"""
+    host = (urlsplit(url).hostname or "").lower()
+    return any(host == domain or host.endswith("." + domain) for domain in domains)
+
+
+def parse_domains(value: str | None) -> list[str]:
+    """Parse a comma or space separated list of domains from a setting"""
+    return [domain.strip().lower().lstrip(".") for domain in re.split(r"[,\s]+", value or "") if domain.strip()]
+
+
+def needs_browser(html: str, markdown: str) -> bool:
+    """Guess whether a statically fetched page needs JavaScript to show its content"""
+    text = markdown.strip()
+    if len(text) < 200:
+        return True
+    lower = html.lower()
+    # Pages whose only message is asking to enable JavaScript
+    if "<noscript" in lower and len(text) < 1000 and "javascript" in text.lower():
+        return True
+    # Application shells with a mount point and little server rendered text
+    if len(text) < 2000 and any(marker in html for marker in JS_SHELL_MARKERS):
+        return True
+    return False
+
+
+class LinkExtractor(HTMLParser):
+    """Collect the links of an HTML document with their anchor text"""
+
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.links = []
+        self.current = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "base":
+            href = dict(attrs).get("href")
+            if href:
+                self.base_url = urljoin(self.base_url, href)
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.current = {"href": urljoin(self.base_url, href.strip()), "text": ""}
+
+    def handle_data(self, data):
+        if self.current is not None:
+            self.current["text"] += data
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self.current is not None:
+            self.current["text"] = " ".join(self.current["text"].split())[:80]
+            self.links.append(self.current)
+            self.current = None
+
+
+def extract_links(html: str, base_url: str) -> list[dict]:
+    """Get the links of an HTML document as {text, href} dicts"""
+    parser = LinkExtractor(base_url)
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass
+    return parser.links
+
+
+class MarkdownStream(LinkExtractor):
+    """
+    Convert HTML to markdown while it is fed.
+
+    Every block is queued as soon as it ends, so that the caller can
+    consume the markdown while the page is still being read and stop
+    early. Only the unparsed tail of the input and the current block are
+    kept in memory. Links are collected like LinkExtractor does.
+    """
+    SKIP = {"script", "style", "noscript", "template", "svg", "head", "iframe", "canvas", "select", "button"}
+    BLOCKS = {"p", "div", "section", "article", "main", "header", "footer", "nav", "aside", "ul", "ol", "li", "dl", "dt", "dd",
+              "table", "tr", "blockquote", "pre", "figure", "figcaption", "form", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "br"}
+    EMPHASIS = {"strong": "**", "b": "**", "em": "*", "i": "*", "code": "`"}
+    # Skipped elements whose end tag is optional or often missing, with the start tags that end them
+    IMPLIED_END = {"head": BLOCKS | {"body"}, "button": {"body", "button"}, "select": {"body", "select"}}
+
+    def __init__(self, base_url: str):
+        super().__init__(base_url)
+        self.blocks = deque()
+        self.parts = []
+        self.prefix = ""
+        # Marker of the list item, kept until the first block inside the item is written
+        self.item = ""
+        # Open skipped elements, with the number of blocks open inside each of them
+        self.skipped = []
+        self.preformatted = 0
+        self.lists = []
+        self.row = None
+        self.table = None
+        # Tables holding the table being read, with their current row and cell
+        self.outer_tables = []
+        self.anchor = None
+
+    def handle_starttag(self, tag, attrs):
+        super().handle_starttag(tag, attrs)
+        while self.skipped and tag in self.IMPLIED_END.get(self.skipped[-1][0], ()):
+            self.skipped.pop()
+        if tag == "body":
+            self.skipped.clear()
+        if tag in self.SKIP:
+            self.skipped.append([tag, 0])
+            return
+        if self.skipped:
+            if tag in self.BLOCKS:
+                self.skipped[-1][1] += 1
+            return
+        if tag in self.BLOCKS:
+            self._flush()
+        if tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            self.prefix = "#" * int(tag[1]) + " "
+        elif tag in ("ul", "ol"):
+            self.lists.append(0 if tag == "ol" else None)
+        elif tag == "li":
+            indent = "  " * max(0, len(self.lists) - 1)
+            if self.lists and self.lists[-1] is not None:
+                self.lists[-1] += 1
+                self.item = indent + f"{self.lists[-1]}. "
+            else:
+                self.item = indent + "- "
+        elif tag == "blockquote":
+            self.prefix = "> "
+        elif tag == "pre":
+            self.preformatted += 1
+        elif tag == "table":
+            if self.table is not None:
+                self.outer_tables.append((self.table, self.row, self.parts))
+                self.row = None
+                self.parts = []
+            self.table = []
+        elif tag == "tr" and self.table is not None:
+            self._end_row()
+            self.row = []
+        elif tag in ("td", "th") and self.row is not None:
+            self.parts = []
+        elif tag == "hr":
+            self.blocks.append("---")
+        elif tag == "a" and self.current is not None:
+            self.anchor = len(self.parts)
+        elif tag in self.EMPHASIS and not self.preformatted:
+            self.parts.append(self.EMPHASIS[tag])
+
+    def handle_endtag(self, tag):
+        link = self.current if tag == "a" else None
+        super().handle_endtag(tag)
+        if tag in self.SKIP:
+            names = [name for name, _ in self.skipped]
+            if tag in names:
+                del self.skipped[len(names) - 1 - names[::-1].index(tag):]
+            return
+        if self.skipped and tag in self.BLOCKS:
+            if self.skipped[-1][1] > 0:
+                self.skipped[-1][1] -= 1
+                return
+            # The end of the block holding them ends the skipped elements left open
+            while self.skipped and self.skipped[-1][0] in self.IMPLIED_END and self.skipped[-1][1] == 0:
+                self.skipped.pop()
+        if self.skipped:
+            return
+        if tag == "a" and link is not None and self.anchor is not None:
+            text = " ".join("".join(self.parts[self.anchor:]).split())
+            self.parts[self.anchor:] = [f"[{text}]({link['href']})" if text else ""]
+            self.anchor = None
+        elif tag in self.EMPHASIS and not self.preformatted:
+            self.parts.append(self.EMPHASIS[tag])
+        elif tag in ("td", "th") and self.row is not None:
+            self.row.append(" ".join("".join(self.parts).split()).replace("|", "\\|"))
+            self.parts = []
+        elif tag == "tr":
+            self._end_row()
+        elif tag == "table" and self.table is not None:
+            self._end_row()
+            rows, self.table = self.table, None
+            if self.outer_tables:
+                # A nested table goes in the cell holding it as plain text
+                self.table, self.row, self.parts = self.outer_tables.pop()
+                self.parts.append(" " + "; ".join(", ".join(cell for cell in row if cell) for row in rows) + " ")
+            elif rows:
+                lines = ["| " + " | ".join(row) + " |" for row in rows]
+                lines.insert(1, "|" + " --- |" * len(rows[0]))
+                self.blocks.append("\n".join(lines))
+        elif tag == "pre":
+            text = "".join(self.parts).strip("\n")
+            self.parts = []
+            self.preformatted = max(0, self.preformatted - 1)
+            if text:
+                self.blocks.append("```\n" + text + "\n```")
+        elif tag in ("ul", "ol") and self.lists:
+            self._flush()
+            self.item = ""
+            self.lists.pop()
+        elif tag == "li":
+            self._flush()
+            self.item = ""
+        elif tag in self.BLOCKS:
+            self._flush()
+
+    def handle_data(self, data):
+        super().handle_data(data)
+        if not self.skipped:
+            self.parts.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+    def _end_row(self):
+        if self.row and self.table is not None:
+            self.table.append(self.row)
+        self.row = None
+
+    def _flush(self):
+        """End the current block"""
+        if self.preformatted or self.row is not None:
+            return
+        text = " ".join("".join(self.parts).split())
+        # Emphasis markers around nothing are dropped
+        if text.strip("*` "):
+            self.blocks.append(self.item + self.prefix + text)
+            self.item = ""
+        self.parts = []
+        self.anchor = None
+        self.prefix = ""
+
+
+def stream_markdown(chunks, base_url: str, limit: int = 0, parser: MarkdownStream | None = None):
+    """
+    Yield the markdown blocks of an HTML document read in chunks.
+
+    Args:
+        chunks: iterable of consecutive pieces of the HTML
+        base_url: URL of the document, to resolve the links
+        limit: stop reading the document once this many characters were produced, 0 reads everything
+        parser: parser to use, to read the links it collected afterwards
+    """
+    parser = parser or MarkdownStream(base_url)
+    size = 0
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            while parser.blocks:
+                block = parser.blocks.popleft()
+                yield block
+                size += len(block) + 2
+                if limit and size >= limit:
+                    return
+        parser.close()
+        yield from parser.blocks
+    finally:
+        # Stops the producer early, freeing what it holds
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+# Links that are never worth downloading ahead of time
+PREFETCH_SKIP = re.compile(r"(login|logout|signin|signup|register|cart|checkout|account)|\.(pdf|zip|gz|tar|exe|dmg|iso|jpe?g|png|gif|svg|webp|mp[34]|avi|mov)$", re.IGNORECASE)
+
+
+def rank_links(links: list[dict], base_url: str, query: str, limit: int) -> list[str]:
+    """
+    Rank the links the agent is likely to open next.
+    Earlier links, anchors sharing words with the query and links to the same site score higher.
+    """
+    query_words = {word for word in re.findall(r"\w+", query.lower()) if len(word) > 2}
+    base_host = urlsplit(base_url).hostname
+    base = urldefrag(base_url)[0]
+    scored = {}
+    for index, link in enumerate(links):
+        url = urldefrag(link.get("href", ""))[0]
+        if not url.startswith("http") or url == base or url in scored or PREFETCH_SKIP.search(url):
+            continue
+        words = {word for word in re.findall(r"\w+", link.get("text", "").lower()) if len(word) > 2}
+        score = 1 / (1 + index / 10)
+        if query_words:
+            score += 2 * len(words & query_words) / len(query_words)
+        if urlsplit(url).hostname == base_host:
+            score += 0.5
+        scored[url] = score
+    return sorted(scored, key=scored.get, reverse=True)[:limit]
+
+
+class LinkPrefetcher:
+    """
+    Download and clean in the background the links an agent is likely to open next.
+
+    Work is bounded by a number of workers and a byte budget for the cache,
+    scheduling new links or cancel() drops the downloads that didn't start yet.
+    """
+
+    def __init__(self, fetch, max_workers: int = 2, max_bytes: int = 4 * 1024 * 1024):
+        self.fetch = fetch
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.generation = 0
+        self.queue = deque()
+        self.in_flight = set()
+        self.workers = 0
+        self.stats = {"scheduled": 0, "completed": 0, "discarded": 0, "cancelled": 0, "hits": 0, "misses": 0}
+
+    def schedule(self, urls: list[str]):
+        """Replace the pending downloads with new links"""
+        with self.lock:
+            self._cancel()
+            for url in urls:
+                if url not in self.cache and url not in self.in_flight:
+                    self.queue.append((self.generation, url))
+                    self.stats["scheduled"] += 1
+            while self.workers < min(self.max_workers, len(self.queue)):
+                self.workers += 1
+                threading.Thread(target=self._worker, daemon=True).start()
+
+    def cancel(self):
+        """Drop the downloads that didn't start, running ones are discarded when they finish"""
+        with self.lock:
+            self._cancel()
+
+    def _cancel(self):
+        self.generation += 1
+        self.stats["cancelled"] += len(self.queue)
+        self.queue.clear()
+
+    def get(self, url: str) -> str | None:
+        """Get a prefetched page, counting hits and misses"""
+        with self.lock:
+            content = self.cache.pop(urldefrag(url)[0], None)
+            if content is None:
+                self.stats["misses"] += 1
+                return None
+            self.cache_bytes -= len(content)
+            self.stats["hits"] += 1
+            return content
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {**self.stats, "cached": len(self.cache), "cached_bytes": self.cache_bytes, "pending": len(self.queue)}
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.workers -= 1
+                    return
+                generation, url = self.queue.popleft()
+                self.in_flight.add(url)
+            try:
+                content = self.fetch(url)
+            except Exception:
+                content = None
+            with self.lock:
+                self.in_flight.discard(url)
+                if content is None or generation != self.generation or len(content) > self.max_bytes:
+                    self.stats["discarded"] += 1
+                    continue
+                self.stats["completed"] += 1
+                self.cache[url] = content
+                self.cache_bytes += len(content)
+                # Oldest prefetched pages go first when the budget is exceeded
+                while self.cache_bytes > self.max_bytes:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cache_bytes -= len(evicted)
+
+
+# Query parameters that only track the visitor, dropped from crawled URLs
+TRACKING_PARAMS = re.compile(r"utm_\w+|fbclid|gclid|dclid|msclkid|yclid|mc_cid|mc_eid|_ga|_hsenc|_hsmi|ref_src", re.IGNORECASE)
+# Links to files that are not web pages
+SKIPPED_EXTENSIONS = re.compile(r"\.(pdf|zip|gz|tar|rar|7z|exe|dmg|iso|jpe?g|png|gif|webp|svg|ico|mp[34]|webm|avi|mov|ogg|wav|css|js|woff2?|ttf)$", re.IGNORECASE)
+FEED_LINK_RE = re.compile(r"<link\b[^>]*type=[\"']application/(?:rss|atom)\+xml[\"'][^>]*>", re.IGNORECASE)
+
+
+def canonical_url(url: str) -> str:
+    """Normalize a URL so the same page is crawled once: no fragment, lowercase host, sorted query without tracking parameters"""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    default_port = {"http": 80, "https": 443}.get(parts.scheme.lower())
+    if parts.port is not None and parts.port != default_port:
+        host += f":{parts.port}"
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.fullmatch(name))
+    return urlunsplit((parts.scheme.lower(), host, parts.path or "/", urlencode(query), ""))
+
+
+def feed_links(document: str, base_url: str) -> tuple[list[str], list[str]]:
+    """
+    Get the URLs listed by a sitemap, an RSS or an Atom feed
+
+    Returns:
+        the page URLs and the URLs of the nested sitemaps of a sitemap index
+    """
+    locations = [urljoin(base_url, unescape(url).strip()) for url in re.findall(r"<loc>\s*(.*?)\s*</loc>", document, re.DOTALL)]
+    if re.search(r"<sitemapindex\b", document):
+        return [], locations
+    if not locations:
+        # RSS items have a link element, Atom entries a link with an href
+        locations = [urljoin(base_url, unescape(url).strip()) for url in re.findall(r"<link>\s*(.*?)\s*</link>", document, re.DOTALL)]
+        for tag in re.findall(r"<link\b[^>]*>", document):
+            href = re.search(r"href=[\"']([^\"']+)", tag)
+            if href and not re.search(r"rel=[\"'](?!alternate)", tag):
+                locations.append(urljoin(base_url, unescape(href.group(1))))
+    return locations, []
+
+
+class SiteCrawler:
+    """
+    Breadth first crawl of a site without the browser.
+
+    Pages are downloaded by a bounded number of workers, requests to the
+    same host are spaced by a politeness delay (or the Crawl-delay of its
+    robots.txt), URLs are canonicalized and pages with the same content as
+    a page already read are skipped. URLs listed in the sitemap, or in the
+    feeds of the start page when there is no sitemap, are read before the
+    links found in the pages.
+    """
+    MAX_SITEMAPS = 5
+    MAX_DELAY = 10
+
+    def __init__(self, fetch_page, fetch_text, max_pages: int = 20, max_depth: int = 2, same_site: bool = True,
+                 include: list[str] | None = None, exclude: list[str] | None = None,
+                 max_workers: int = 4, delay: float = 0.5, max_seconds: float = 60):
+        self.fetch_page = fetch_page
+        self.fetch_text = fetch_text
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.same_site = same_site
+        self.include = [re.compile(pattern) for pattern in include or []]
+        self.exclude = [re.compile(pattern) for pattern in exclude or []]
+        self.max_workers = max_workers
+        self.delay = delay
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self.next_request = {}
+        self.robots = {}
+        self.site = None
+        self.seen = set()
+        self.hashes = {}
+        self.queue = deque()
+        self.source = "links"
+
+    def crawl(self, start_url: str):
+        """
+        Crawl from a URL, yielding the result of every URL read
+
+        Yields:
+            dict: url, depth and either the html and cleaned content of the page,
+                  duplicate_of with the URL of a page with the same content, or error
+        """
+        deadline = monotonic() + self.max_seconds
+        start = canonical_url(start_url)
+        self.site = urlsplit(start).hostname.removeprefix("www.")
+        self.seen.add(start)
+        self.queue.append((start, 0))
+        if self.max_depth > 0:
+            self._add_listed(self._sitemap_urls(start), "sitemap")
+        executor = ThreadPoolExecutor(self.max_workers)
+        running = {}
+        attempts = 0
+        stored = 0
+        try:
+            while self.queue or running:
+                # Failed and duplicate pages don't count, but the attempts are bounded too
+                while self.queue and len(running) < self.max_workers and stored + len(running) < self.max_pages and attempts < 3 * self.max_pages:
+                    url, depth = self.queue.popleft()
+                    if not self._robots(url).can_fetch("*", url):
+                        yield {"url": url, "depth": depth, "error": "Disallowed by robots.txt"}
+                        continue
+                    attempts += 1
+                    running[executor.submit(self._fetch, url)] = (url, depth)
+                if not running:
+                    break
+                done, _ = wait(running, timeout=max(0, deadline - monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    yield {"stopped": "time"}
+                    return
+                for future in done:
+                    url, depth = running.pop(future)
+                    try:
+                        final_url, html, cleaned = future.result()
+                    except Exception as e:
+                        yield {"url": url, "depth": depth, "error": str(e)}
+                        continue
+                    final_url = canonical_url(final_url)
+                    self.seen.add(final_url)
+                    digest = content_hash(cleaned)
+                    if digest in self.hashes:
+                        yield {"url": final_url, "depth": depth, "duplicate_of": self.hashes[digest]}
+                        continue
+                    self.hashes[digest] = final_url
+                    stored += 1
+                    if depth == 0 and self.source == "links" and self.max_depth > 0:
+                        self._add_listed(self._feed_urls(html, final_url), "feed")
+                    if depth < self.max_depth:
+                        for link in extract_links(html, final_url):
+                            self._add(link["href"], depth + 1)
+                    yield {"url": final_url, "depth": depth, "html": html, "cleaned": cleaned}
+            if self.queue and stored >= self.max_pages:
+                yield {"stopped": "max_pages"}
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def allowed(self, url: str) -> bool:
+        """Check if a URL is in the scope of the crawl"""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname or SKIPPED_EXTENSIONS.search(parts.path):
+            return False
+        if self.same_site and not domain_matches(url, [self.site]):
+            return False
+        if self.include and not any(pattern.search(url) for pattern in self.include):
+            return False
+        return not any(pattern.search(url) for pattern in self.exclude)
+
+    def _add(self, url: str, depth: int):
+        url = canonical_url(url)
+        if url not in self.seen and self.allowed(url):
+            self.seen.add(url)
+            self.queue.append((url, depth))
+
+    def _add_listed(self, urls: list[str], source: str):
+        if urls:
+            self.source = source
+        for url in urls:
+            self._add(url, 1)
+
+    def _fetch(self, url: str) -> tuple[str, str, str]:
+        # Requests to a host wait for their turn, the workers keep serving the other hosts
+        host = urlsplit(url).netloc
+        delay = min(float(self._robots(url).crawl_delay("*") or self.delay), self.MAX_DELAY)
+        with self.lock:
+            now = monotonic()
+            start = max(now, self.next_request.get(host, now))
+            self.next_request[host] = start + delay
+        sleep(start - now)
+        return self.fetch_page(url)
+
+    def _robots(self, url: str) -> RobotFileParser:
+        """Get the robots.txt rules of the host of a URL, downloaded once"""
+        parts = urlsplit(url)
+        with self.lock:
+            robots = self.robots.get(parts.netloc)
+        if robots is not None:
+            return robots
+        robots = RobotFileParser()
+        try:
+            robots.parse(self.fetch_text(urlunsplit((parts.scheme, parts.netloc, "/robots.txt", "", ""))).splitlines())
+        except Exception:
+            robots.parse([])
+        with self.lock:
+            return self.robots.setdefault(parts.netloc, robots)
+
+    def _sitemap_urls(self, start: str) -> list[str]:
+        """Get the page URLs of the sitemaps of the site, declared in robots.txt or at the default location"""
+        parts = urlsplit(start)
+        pending = list(self._robots(start).site_maps() or [urlunsplit((parts.scheme, parts.netloc, "/sitemap.xml", "", ""))])
+        urls = []
+        for _ in range(self.MAX_SITEMAPS):
+            if not pending:
+                break
+            sitemap = pending.pop(0)
+            try:
+                pages, nested = feed_links(self.fetch_text(sitemap), sitemap)
+            except Exception:
+                continue
+            urls.extend(pages)
+            pending.extend(nested)
+        return urls
+
+    def _feed_urls(self, html: str, base_url: str) -> list[str]:
+        """Get the entries of the first RSS or Atom feed linked by a page"""
+        for tag in FEED_LINK_RE.findall(html):
+            href = re.search(r"href=[\"']([^\"']+)", tag)
+            if href is None:
+                continue
+            feed = urljoin(base_url, unescape(href.group(1)))
+            try:
+                return feed_links(self.fetch_text(feed), feed)[0]
+            except Exception:
+                continue
+        return []
+
+
+def split_blocks(text: str) -> list[str]:
+    """Split markdown in blocks separated by blank lines"""
+    return [block.strip() for block in re.split(r"\n\s*\n", text) if block.strip()]
+
+
+def split_chunks(text: str, size: int = 1024) -> list[str]:
+    """
+    Split markdown in chunks of about size characters.
+
+    Chunks end at headings and paragraph boundaries, so an edit to one
+    section of a page leaves the chunks of the other sections unchanged.
+    """
+    chunks = []
+    current = []
+    length = 0
+    for block in split_blocks(text):
+        if current and (block.startswith("#") or length + len(block) > size):
+            chunks.append("\n\n".join(current))
+            current = []
+            length = 0
+        while len(block) > size:
+            chunks.append(block[:size])
+            block = block[size:]
+        current.append(block)
+        length += len(block) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()
+
+
+def simhash(text: str) -> int:
+    """
+    64 bit simhash of the word shingles of a text.
+
+    Numbers are replaced by one placeholder, so texts that only differ in
+    dates or counters get the same hash. Shingles are hashed with blake2b,
+    the hashes are the same in every process.
+    """
+    words = [re.sub(r"\d+", "0", word) for word in tokenize(text)]
+    shingles = Counter(" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2)))
+    # Every shingle votes on every bit with its number of occurrences
+    votes = [0] * 64
+    for shingle, count in shingles.items():
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8", "replace"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            votes[bit] += count if value >> bit & 1 else -count
+    return sum(1 << bit for bit in range(64) if votes[bit] > 0)
+
+
+class BoilerplateFilter:
+    """
+    Learn the blocks repeated across the pages of a site and strip them.
+
+    Blocks are compared by simhash and looked up by bands of the hash.
+    Repeated blocks and blocks that only differ in numbers, like a date or
+    a counter, match. Any other edit usually gives a hash too far away, so
+    such blocks are kept. The first page a block was seen on keeps it, the
+    other pages of the same domain lose it. Headings and blocks of a
+    couple of words are always kept.
+    """
+    BANDS = 4
+    MAX_DISTANCE = 3
+    MIN_WORDS = 3
+
+    def __init__(self, max_domains: int = 64, max_blocks: int = 4096):
+        self.max_domains = max_domains
+        self.max_blocks = max_blocks
+        self.lock = threading.Lock()
+        self.domains = OrderedDict()
+        self.stats = {"pages": 0, "blocks": 0, "stripped": 0, "stripped_chars": 0}
+
+    def strip(self, url: str, markdown: str) -> str:
+        """Remove from a page the blocks another page of its site already had"""
+        domain = (urlsplit(url).hostname or "").removeprefix("www.")
+        url = urldefrag(url)[0]
+        blocks = split_blocks(markdown)
+        kept = []
+        removed = 0
+        with self.lock:
+            site = self.domains.pop(domain, None) or {"owners": OrderedDict(), "bands": {}}
+            self.domains[domain] = site
+            while len(self.domains) > self.max_domains:
+                self.domains.popitem(last=False)
+            self.stats["pages"] += 1
+            for block in blocks:
+                if block.startswith("#") or len(block.split()) < self.MIN_WORDS:
+                    kept.append(block)
+                    continue
+                self.stats["blocks"] += 1
+                fingerprint = simhash(block)
+                owner = self._find(site, fingerprint)
+                if owner is None:
+                    self._add(site, fingerprint, url)
+                elif site["owners"][owner] != url:
+                    removed += 1
+                    self.stats["stripped"] += 1
+                    self.stats["stripped_chars"] += len(block)
+                    continue
+                kept.append(block)
+        if not removed:
+            return markdown
+        return "\n\n".join(kept) + f"\n\n[{removed} blocks repeated from other pages of {domain} removed]"
+
+    def _bands(self, fingerprint: int):
+        width = 64 // self.BANDS
+        return [(band, fingerprint >> (band * width) & ((1 << width) - 1)) for band in range(self.BANDS)]
+
+    def _find(self, site: dict, fingerprint: int) -> int | None:
+        """Get a known fingerprint close to the given one"""
+        for key in self._bands(fingerprint):
+            for known in site["bands"].get(key, ()):
+                if (known ^ fingerprint).bit_count() <= self.MAX_DISTANCE:
+                    return known
+        return None
+
+    def _add(self, site: dict, fingerprint: int, url: str):
+        site["owners"][fingerprint] = url
+        for key in self._bands(fingerprint):
+            site["bands"].setdefault(key, []).append(fingerprint)
+        if len(site["owners"]) > self.max_blocks:
+            oldest, _ = site["owners"].popitem(last=False)
+            for key in self._bands(oldest):
+                site["bands"][key].remove(oldest)
+
+
+def diff_blocks(previous: list[str], current: list[str]) -> dict:
+    """
+    Compare two versions of a page block by block.
+
+    Blocks are matched by a fingerprint of their text with whitespace
+    collapsed, a block replaced in place is reported as changed.
+
+    Returns:
+        dict: added, removed and changed blocks with their fingerprint id,
+              the number of unchanged blocks and a one line summary
+    """
+    def fingerprint(block):
+        return content_hash(" ".join(block.split()))[:10]
+
+    before = [fingerprint(block) for block in previous]
+    after = [fingerprint(block) for block in current]
+    added, removed, changed = [], [], []
+    unchanged = 0
+    for operation, i1, i2, j1, j2 in SequenceMatcher(None, before, after, autojunk=False).get_opcodes():
+        if operation == "equal":
+            unchanged += i2 - i1
+            continue
+        pairs = min(i2 - i1, j2 - j1) if operation == "replace" else 0
+        for offset in range(pairs):
+            changed.append({"id": after[j1 + offset], "before": previous[i1 + offset], "after": current[j1 + offset]})
+        removed += [{"id": before[i], "text": previous[i]} for i in range(i1 + pairs, i2)]
+        added += [{"id": after[j], "text": current[j]} for j in range(j1 + pairs, j2)]
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "unchanged": unchanged,
+        "summary": f"{len(added)} blocks added, {len(removed)} removed, {len(changed)} changed, {unchanged} unchanged"
+    }
+
+
+def format_diff(diff: dict, max_removed: int = 200) -> str:
+    """Render a block diff as markdown, removed blocks are shortened"""
+    sections = ["Changes since the last read: " + diff["summary"]]
+    if diff["added"]:
+        sections.append("## Added\n\n" + "\n\n".join(block["text"] for block in diff["added"]))
+    if diff["changed"]:
+        sections.append("## Changed\n\n" + "\n\n".join(block["after"] for block in diff["changed"]))
+    if diff["removed"]:
+        sections.append("## Removed\n\n" + "\n\n".join(
+            block["text"][:max_removed] + ("..." if len(block["text"]) > max_removed else "") for block in diff["removed"]))
+    return "\n\n".join(sections)
+
+
+def next_window(text: str, start: int, budget: int) -> int:
+    """
+    Get the end of a window of text starting at start.
+
+    Windows end before a heading, or at a paragraph, line or word boundary
+    in the second half of the budget, in this order of preference.
+    """
+    end = start + budget
+    if budget <= 0 or end >= len(text):
+        return len(text)
+    middle = start + budget // 2
+    for separator in ("\n#", "\n\n", "\n", " "):
+        position = text.rfind(separator, middle, end)
+        if position != -1:
+            return position + 1
+    return end
+
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+
+class PageStore:
+    """
+    Cleaned content of the visited pages, keyed by URL without fragment.
+
+    Every URL keeps the hash of its content and the store version of its
+    last change, storing the same content again is not a change.
+
+    Content is bounded by a memory budget: least recently used pages are
+    compressed once plain text takes more than half of it, and compressed
+    pages are moved to a temporary SQLite database (or dropped, without
+    spill) once the whole budget is used. Pages are loaded back on access.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, spill: bool = True):
+        self.lock = threading.Lock()
+        self.pages = OrderedDict()
+        self.version = 0
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.database = None
+        self.plain_bytes = 0
+        self.compressed_bytes = 0
+        self.stats = {"hits": 0, "compressed_hits": 0, "disk_hits": 0, "misses": 0, "compressed": 0, "spilled": 0, "dropped": 0}
+
+    def __setitem__(self, url: str, content: str):
+        url = urldefrag(url)[0]
+        digest = content_hash(content)
+        with self.lock:
+            entry = self.pages.get(url)
+            if entry is not None and entry["hash"] == digest:
+                self.pages.move_to_end(url)
+                return
+            if entry is not None:
+                self._discard(url, entry)
+            self.version += 1
+            self.pages[url] = {"hash": digest, "version": self.version, "content": content, "data": None, "codec": None, "size": len(content)}
+            self.plain_bytes += len(content)
+            self._enforce_budget()
+
+    def __getitem__(self, url: str) -> str:
+        content = self.get(url)
+        if content is None:
+            raise KeyError(url)
+        return content
+
+    def __contains__(self, url: str) -> bool:
+        return urldefrag(url)[0] in self.pages
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def get(self, url: str, default=None):
+        url = urldefrag(url)[0]
+        with self.lock:
+            entry = self.pages.get(url)
+            if entry is None:
+                self.stats["misses"] += 1
+                return default
+            self.pages.move_to_end(url)
+            content = self._load(url, entry, count=True)
+            if content is None:
+                return default
+            self._enforce_budget()
+            return content
+
+    def page_hash(self, url: str) -> str | None:
+        entry = self.pages.get(urldefrag(url)[0])
+        return None if entry is None else entry["hash"]
+
+    def changed_since(self, version: int) -> list[tuple[str, str, str]]:
+        """Get (url, hash, content) of the pages changed after a store version"""
+        with self.lock:
+            changed = []
+            for url, entry in list(self.pages.items()):
+                if entry["version"] > version and (content := self._load(url, entry, keep=False)) is not None:
+                    changed.append((url, entry["hash"], content))
+            return changed
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            hits = self.stats["hits"] + self.stats["compressed_hits"] + self.stats["disk_hits"]
+            return {
+                **self.stats,
+                "pages": len(self.pages),
+                "resident_bytes": self.plain_bytes + self.compressed_bytes,
+                "plain_bytes": self.plain_bytes,
+                "compressed_bytes": self.compressed_bytes,
+                "hit_ratio": round(hits / max(1, hits + self.stats["misses"]), 3),
+                "codec": "zstd" if zstd is not None else "zlib",
+            }
+
+    def close(self):
+        with self.lock:
+            if self.database is not None:
+                self.database.close()
+                self.database = None
+
+    def _load(self, url: str, entry: dict, count: bool = False, keep: bool = True) -> str | None:
+        """Get the content of a page, making it plain text again when keep is set"""
+        if entry["content"] is not None:
+            if count:
+                self.stats["hits"] += 1
+            return entry["content"]
+        if entry["data"] is not None:
+            data, codec = entry["data"], entry["codec"]
+            kind = "compressed_hits"
+        else:
+            row = self.database.execute("SELECT data, codec FROM pages WHERE url = ?", (url,)).fetchone() if self.database is not None else None
+            if row is None:
+                # Dropped without spill
+                del self.pages[url]
+                if count:
+                    self.stats["misses"] += 1
+                return None
+            data, codec = row
+            kind = "disk_hits"
+        content = (zstd.decompress(data) if codec == "zstd" else zlib.decompress(data)).decode("utf-8")
+        if count:
+            self.stats[kind] += 1
+        if keep:
+            self._discard(url, entry)
+            entry.update(content=content, data=None, codec=None)
+            self.plain_bytes += len(content)
+        return content
+
+    def _discard(self, url: str, entry: dict):
+        """Forget where the content of an entry is stored"""
+        if entry["content"] is not None:
+            self.plain_bytes -= len(entry["content"])
+        elif entry["data"] is not None:
+            self.compressed_bytes -= len(entry["data"])
+        elif self.database is not None:
+            self.database.execute("DELETE FROM pages WHERE url = ?", (url,))
+
+    def _enforce_budget(self):
+        # Compress the least recently used pages
+        if self.plain_bytes > self.max_bytes // 2:
+            for url, entry in self.pages.items():
+                if self.plain_bytes <= self.max_bytes // 2:
+                    break
+                if entry["content"] is None:
+                    continue
+                raw = entry["content"].encode("utf-8")
+                if zstd is not None:
+                    data, codec = zstd.compress(raw), "zstd"
+                else:
+                    data, codec = zlib.compress(raw, 6), "zlib"
+                self.plain_bytes -= len(entry["content"])
+                self.compressed_bytes += len(data)
+                entry.update(content=None, data=data, codec=codec)
+                self.stats["compressed"] += 1
+        # Then move them out of memory
+        if self.plain_bytes + self.compressed_bytes > self.max_bytes:
+            for url in list(self.pages):
+                if self.plain_bytes + self.compressed_bytes <= self.max_bytes:
+                    break
+                entry = self.pages[url]
+                if entry["data"] is None:
+                    continue
+                self.compressed_bytes -= len(entry["data"])
+                if self.spill:
+                    self._spill(url, entry)
+                else:
+                    del self.pages[url]
+                    self.stats["dropped"] += 1
+
+    def _spill(self, url: str, entry: dict):
+        if self.database is None:
+            # An empty name opens a private temporary database, deleted when closed
+            self.database = sqlite3.connect("", check_same_thread=False)
+            self.database.execute("CREATE TABLE pages (url TEXT PRIMARY KEY, data BLOB, codec TEXT)")
+        self.database.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", (url, entry["data"], entry["codec"]))
+        entry.update(data=None, codec=None)
+        self.stats["spilled"] += 1
+
+
+def page_documents(url: str, content: str) -> dict[str, str]:
+    """Split a page in the documents given to the indexes, keyed by their hash"""
+    documents = {}
+    for chunk in split_chunks(content):
+        document = "text:Source: " + url + "\n\n" + chunk.strip()
+        documents[content_hash(document)] = document
+    return documents
+
+
+class RagIndexState:
+    """
+    Track the chunks of the page store and which of them are embedded.
+
+    Only the hashes of the chunks are kept, their text is split again from
+    the page store when it is needed, or read from the index snapshot for
+    pages of previous sessions. The keyword index is kept up to date on
+    every sync. Embedders compare the current chunks with the ones they
+    hold when they are queried, so nothing is queued for them. Chunks of
+    superseded page versions that can't be removed from the RAG index are
+    tombstoned, so that query results can be filtered.
+    """
+    CACHED_PAGES = 8
+
+    def __init__(self):
+        self.synced_version = 0
+        self.index_version = 0
+        self.pages = {}
+        self.owners = {}
+        self.tombstones = set()
+        self.embedded = set()
+        self.keyword_index = None
+        self.store = None
+        self.fallback = None
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+
+    def sync(self, store: PageStore):
+        """Update the chunks to the pages changed in the page store since the last sync"""
+        self.store = store
+        if store.version == self.synced_version:
+            return
+        added = []
+        removed = []
+        for url, page_hash, content in store.changed_since(self.synced_version):
+            previous = self.pages.get(url)
+            if previous is not None and previous[0] == page_hash:
+                continue
+            documents = page_documents(url, content)
+            old = set(previous[1]) if previous is not None else set()
+            for digest, document in documents.items():
+                if digest not in old:
+                    self.owners[digest] = url
+                    self.tombstones.discard(digest)
+                    added.append((digest, document))
+            for digest in old.difference(documents):
+                del self.owners[digest]
+                if digest in self.embedded:
+                    self.tombstones.add(digest)
+                removed.append(digest)
+            self.pages[url] = (page_hash, tuple(documents))
+            self._cache(url, page_hash, documents)
+        self.synced_version = store.version
+        if added or removed:
+            self.index_version += 1
+        if self.keyword_index is not None:
+            for digest in removed:
+                self.keyword_index.remove(digest)
+            for digest, document in added:
+                self.keyword_index.add(digest, document)
+
+    def document(self, digest: str) -> str | None:
+        """Get the text of a current chunk, None if its page is no longer available"""
+        url = self.owners.get(digest)
+        if url is None:
+            return None
+        page_hash = self.pages[url][0]
+        with self.lock:
+            cached = self.cache.get(url)
+            if cached is not None and cached[0] == page_hash:
+                self.cache.move_to_end(url)
+                return cached[1].get(digest)
+        if self.store is not None and self.store.page_hash(url) == page_hash:
+            content = self.store.get(url)
+            if content is not None:
+                documents = page_documents(url, content)
+                self._cache(url, page_hash, documents)
+                return documents.get(digest)
+        return self.fallback(digest) if self.fallback is not None else None
+
+    def _cache(self, url: str, page_hash: str, documents: dict):
+        # Results of a query often come from the same few pages
+        with self.lock:
+            self.cache[url] = (page_hash, documents)
+            self.cache.move_to_end(url)
+            while len(self.cache) > self.CACHED_PAGES:
+                self.cache.popitem(last=False)
+
+    def forget(self, url: str):
+        """Drop a page that is no longer available from the chunks"""
+        for digest in self.pages.pop(url)[1]:
+            if self.owners.pop(digest, None) is not None and self.keyword_index is not None:
+                self.keyword_index.remove(digest)
+            self.embedded.discard(digest)
+        self.cache.pop(url, None)
+        self.index_version += 1
+
+    def get_keyword_index(self) -> "KeywordIndex":
+        """Get the keyword index, indexing the chunks already known when it is created"""
+        if self.keyword_index is None:
+            self.keyword_index = KeywordIndex(self.document)
+            for digest in list(self.owners):
+                document = self.document(digest)
+                if document is not None:
+                    self.keyword_index.add(digest, document)
+        return self.keyword_index
+
+    @staticmethod
+    def result_key(result: str) -> str:
+        """Hash of the document a query result comes from, results don't have the text: prefix"""
+        return content_hash("text:" + result.removeprefix("text:").strip())
+
+    def is_current(self, result: str) -> bool:
+        """Check that a query result doesn't come from a superseded page version"""
+        return self.result_key(result) not in self.tombstones
+
+
+INDEX_FORMAT = 1
+
+
+WORD_RE = re.compile(r"\w+")
+
+
+def fold_text(text: str) -> str:
+    """Lowercase text and strip its diacritics"""
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> list[str]:
+    return WORD_RE.findall(fold_text(text))
+
+
+class KeywordIndex:
+    """
+    BM25 full text index of the page chunks.
+
+    Postings of every term are compact arrays of document numbers and term
+    frequencies. Only the keys of the documents are kept, their text is
+    loaded for the best results. Removed documents are skipped until they
+    are most of the index, then the postings are rebuilt.
+    """
+    K1 = 1.2
+    B = 0.75
+    PHRASE_BOOST = 1.5
+
+    def __init__(self, load):
+        self.load = load
+        self.keys = []
+        self.lengths = array("I")
+        self.numbers = {}
+        self.postings = {}
+        self.total_length = 0
+        self.removed = 0
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def add(self, key: str, text: str):
+        if key in self.numbers:
+            return
+        number = len(self.keys)
+        counts = Counter(tokenize(text))
+        for term, count in counts.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array("I"), array("H"))
+            postings[0].append(number)
+            postings[1].append(min(count, 65535))
+        self.numbers[key] = number
+        self.keys.append(key)
+        length = sum(counts.values())
+        self.lengths.append(length)
+        self.total_length += length
+
+    def remove(self, key: str):
+        number = self.numbers.pop(key, None)
+        if number is None:
+            return
+        self.total_length -= self.lengths[number]
+        self.keys[number] = None
+        self.removed += 1
+        if self.removed > 1024 and self.removed > len(self.numbers):
+            self._rebuild()
+
+    def search(self, query: str, limit: int = 5) -> list[tuple[str, str]]:
+        """
+        Rank the documents for a query
+
+        Args:
+            query: words to search, documents containing them in order rank higher
+            limit: maximum number of results
+
+        Returns:
+            (key, text) of the best documents
+        """
+        terms = tokenize(query)
+        if not terms or not self.numbers:
+            return []
+        count = len(self.numbers)
+        average = self.total_length / count or 1
+        scores = {}
+        for term in set(terms):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            # Document frequencies are counted on the live documents, removing one doesn't need its text
+            live = [(number, tf) for number, tf in zip(*postings) if self.keys[number] is not None]
+            frequency = len(live)
+            idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for number, tf in live:
+                norm = self.K1 * (1 - self.B + self.B * self.lengths[number] / average)
+                scores[number] = scores.get(number, 0) + idf * tf * (self.K1 + 1) / (tf + norm)
+        best = heapq.nlargest(limit * 2, scores, key=scores.get)
+        texts = {number: self.load(self.keys[number]) for number in best}
+        best = [number for number in best if texts[number] is not None]
+        # Boost the documents that contain the query as a phrase
+        if len(terms) > 1:
+            phrase = " ".join(terms)
+            for number in best:
+                if phrase in " ".join(tokenize(texts[number])):
+                    scores[number] *= self.PHRASE_BOOST
+            best.sort(key=scores.get, reverse=True)
+        return [(self.keys[number], texts[number]) for number in best[:limit]]
+
+    def _rebuild(self):
+        keys = list(self.numbers)
+        self.__init__(self.load)
+        for key in keys:
+            text = self.load(key)
+            if text is not None:
+                self.add(key, text)
+
+
+class TextIndex:
+    """
+    Positions of the words of a text, to search it without scanning it.
+
+    Words are folded like the keyword index and mapped back to their
+    offsets in the original text. Matches are windows of words containing
+    the query terms, ranked by the weight of the terms they contain and by
+    the quoted phrases and whole query phrase they contain.
+    """
+    WINDOW = 24
+
+    def __init__(self, text: str):
+        self.text = text
+        self.starts = array("I")
+        self.ends = array("I")
+        self.positions = {}
+        # Folding ASCII text keeps the offsets, other text is folded word by word
+        folded = text.lower() if text.isascii() else None
+        for number, match in enumerate(WORD_RE.finditer(folded if folded is not None else text)):
+            word = match.group() if folded is not None else fold_text(match.group())
+            self.starts.append(match.start())
+            self.ends.append(match.end())
+            positions = self.positions.get(word)
+            if positions is None:
+                positions = self.positions[word] = array("I")
+            positions.append(number)
+
+    def search(self, query: str, limit: int = 10, context: int = 100) -> tuple[list[dict], int]:
+        """
+        Search the text
+
+        Args:
+            query: words to search, text in double quotes must match as a phrase
+            limit: maximum number of matches
+            context: characters of text around every match
+
+        Returns:
+            the best matches in order of relevance and the number of matching windows
+        """
+        phrases = [words for words in (tokenize(phrase) for phrase in re.findall(r'"([^"]+)"', query)) if words]
+        terms = tokenize(re.sub(r'"[^"]*"', " ", query))
+        words = set(terms).union(*phrases)
+        if not words:
+            return [], 0
+        count = len(self.starts) or 1
+        weights = {word: math.log(1 + count / (1 + len(self.positions.get(word, ())))) for word in words}
+        if len(terms) > 1:
+            phrases.append(terms)
+        occurrences = [self._phrase(phrase) for phrase in phrases]
+        anchors = sorted(set().union(*(self.positions.get(word, ()) for word in words)))
+        windows = []
+        for anchor in anchors:
+            end = anchor + self.WINDOW
+            score = 0
+            last = anchor
+            for word in words:
+                positions = self.positions.get(word)
+                if positions is None:
+                    continue
+                index = bisect_left(positions, anchor)
+                if index < len(positions) and positions[index] < end:
+                    score += weights[word]
+                    last = max(last, positions[index])
+            for phrase, starts in zip(phrases, occurrences):
+                index = bisect_left(starts, anchor)
+                if index < len(starts) and starts[index] < end:
+                    score += 2 * sum(weights[word] for word in phrase)
+                    last = max(last, starts[index] + len(phrase) - 1)
+                elif phrase is not terms:
+                    # Quoted phrases are required
+                    score = 0
+                    break
+            if score > 0:
+                windows.append((score, anchor, last))
+        # Best windows first, skipping the ones overlapping a better window
+        matches = []
+        taken = []
+        for score, first, last in sorted(windows, key=lambda window: (-window[0], window[1])):
+            if any(first <= other_last and other_first <= last for other_first, other_last in taken):
+                continue
+            taken.append((first, last))
+            start = max(0, self.starts[first] - context)
+            end = min(len(self.text), self.ends[last] + context)
+            snippet = re.sub(r"\s+", " ", self.text[start:end])
+            matches.append({
+                "position": self.starts[first],
+                "score": round(score, 3),
+                "context": ("..." if start > 0 else "") + snippet + ("..." if end < len(self.text) else "")
+            })
+            if len(matches) >= limit:
+                break
+        return matches, len(windows)
+
+    def _phrase(self, phrase: list[str]) -> list[int]:
+        """Get the word numbers where a phrase starts"""
+        starts = []
+        following = [set(self.positions.get(word, ())) for word in phrase[1:]]
+        for position in self.positions.get(phrase[0], ()):
+            if all(position + offset + 1 in positions for offset, positions in enumerate(following)):
+                starts.append(position)
+        return starts
+
+
+def csv_line(values: list[str]) -> str:
+    """Encode values as a line of CSV"""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue()
+
+
+MONTHS = "jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec"
+NUMBER_RE = re.compile(r"[-+]?[$€£¥]?\s?(\d{1,3}([,\s]\d{3})+|\d+)([.,]\d+)?\s?%?")
+DATE_RE = re.compile(
+    r"\d{4}-\d{1,2}-\d{1,2}([T ]\d{1,2}:\d{2}(:\d{2})?)?|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}"
+    rf"|({MONTHS})[a-z]*\.? \d{{1,2}},? \d{{4}}|\d{{1,2}} ({MONTHS})[a-z]*\.? \d{{4}}",
+    re.IGNORECASE
+)
+
+
+def cell_type(value: str) -> str:
+    """Type of the value of a table cell: empty, integer, number, date, boolean or text"""
+    if not value:
+        return "empty"
+    number = NUMBER_RE.fullmatch(value)
+    if number:
+        return "number" if number.group(3) else "integer"
+    if DATE_RE.fullmatch(value):
+        return "date"
+    if value.lower() in ("yes", "no", "true", "false"):
+        return "boolean"
+    return "text"
+
+
+def column_type(values: list[str]) -> str:
+    """Type of most of the non empty values of a column, text when they are mixed"""
+    counts = Counter(cell_type(value) for value in values)
+    counts.pop("empty", None)
+    total = sum(counts.values())
+    if not total:
+        return "empty"
+    # Integers in a column of decimals are numbers
+    if counts["number"] and counts["number"] + counts["integer"] >= 0.9 * total:
+        return "number"
+    kind, count = counts.most_common(1)[0]
+    return kind if count >= 0.9 * total else "text"
+
+
+class TableIndex:
+    """
+    Tables of a page as grids of cells, read in pages of rows.
+
+    Cells spanning several rows or columns are repeated in each of them, so
+    every row has a value for every column. Columns are named after the
+    header rows and typed after the values of the other rows.
+    """
+
+    def __init__(self, tables: list[dict]):
+        self.tables = []
+        for table in tables:
+            header, body = table["rows"][:table["headerRows"]], table["rows"][table["headerRows"]:]
+            columns = []
+            for column in range(table["width"]):
+                # Header cells spanning several columns name all of them
+                names = list(dict.fromkeys(row[column] for row in header if row[column]))
+                columns.append(" / ".join(names) or f"column {column + 1}")
+            self.tables.append({
+                "index": table["index"],
+                "id": table["id"],
+                "caption": table["caption"],
+                "columns": columns,
+                "types": [column_type([row[column] for row in body]) for column in range(table["width"])],
+                "rows": body
+            })
+
+    def summary(self, preview: int = 3) -> list[dict]:
+        """Get the shape of every table, with its first rows"""
+        return [{
+            "index": table["index"],
+            "id": table["id"],
+            "caption": table["caption"],
+            "rowCount": len(table["rows"]),
+            "columns": table["columns"],
+            "types": table["types"],
+            "preview": table["rows"][:preview]
+        } for table in self.tables]
+
+    def rows(self, table: int, offset: int = 0, limit: int = 50, format: str = "csv", max_chars: int = 8000) -> dict:
+        """
+        Get consecutive rows of a table
+
+        Args:
+            table: index of the table on the page
+            offset: number of rows to skip
+            limit: maximum number of rows
+            format: csv for a CSV text with a header line, columns for a list of values for every column
+            max_chars: the rows are cut before the result gets longer than this
+
+        Returns:
+            the rows, the total number of rows and the offset of the next rows, None at the end of the table
+        """
+        if not 0 <= table < len(self.tables):
+            raise ValueError(f"Table {table} not found, the page has {len(self.tables)} tables")
+        data = self.tables[table]
+        rows = data["rows"]
+        offset = max(0, offset)
+        end = min(len(rows), offset + max(1, limit))
+        if format not in ("csv", "columns"):
+            raise ValueError(f"Unknown format {format}, use csv or columns")
+        # At least one row is returned, so the reading always moves on
+        size = json_size(data["columns"]) + json_size(data["types"])
+        count = 0
+        for row in rows[offset:end]:
+            size += len(csv_line(row)) if format == "csv" else json_size(row)
+            if count and size > max_chars:
+                break
+            count += 1
+        selected = rows[offset:offset + count]
+        result = {
+            "table": table,
+            "columns": data["columns"],
+            "types": data["types"],
+            "offset": offset,
+            "rowCount": count,
+            "totalRows": len(rows),
+            "nextOffset": offset + count if offset + count < len(rows) else None
+        }
+        if format == "csv":
+            result["csv"] = "".join(csv_line(row) for row in [data["columns"], *selected])
+        else:
+            result["values"] = [[row[column] for row in selected] for column in range(len(data["columns"]))]
+        return result
+
+
+class IndexSnapshot:
+    """
+    Embeddings of the indexed chunks, saved on disk across sessions.
+
+    Vectors are appended to a float32 file that is read back as a memory
+    map, chunk texts, page hashes and removals are appended to a JSON lines
+    log. A snapshot made with another format or embedding model is
+    discarded and rebuilt from the pages that are indexed again. Once the
+    snapshot is larger than max_bytes, the pages of earlier sessions are
+    forgotten, oldest first.
+    """
+
+    def __init__(self, path: str, embedding, np, max_bytes: int = 0):
+        self.path = path
+        self.embedding = embedding
+        self.np = np
+        self.max_bytes = max_bytes
+        self.error = None
+        self.lock = threading.Lock()
+        self.header_path = os.path.join(path, "index.json")
+        self.vectors_path = os.path.join(path, "embeddings.f32")
+        self.log_path = os.path.join(path, "chunks.jsonl")
+        self.model = self.fingerprint()
+        self._reset_memory()
+
+    def _reset_memory(self):
+        self.dimension = 0
+        self.rows = {}
+        self.texts = []
+        self.pages = {}
+        self.removed = 0
+        self.matrix = None
+        self.alive = None
+
+    def fingerprint(self) -> str:
+        """Identify the embedding model, vectors of different models can't be compared"""
+        handler = type(self.embedding)
+        model = ""
+        try:
+            model = str(self.embedding.get_setting("model"))
+        except Exception:
+            pass
+        return handler.__module__ + "." + handler.__name__ + ":" + model
+
+    def load(self, state: RagIndexState) -> bool:
+        """
+        Load the snapshot and the chunks it contains in the index state
+
+        Args:
+            state: empty index state to fill
+
+        Returns:
+            True if a snapshot was loaded
+        """
+        with self.lock:
+            try:
+                with open(self.header_path) as f:
+                    header = json.load(f)
+                if header.get("format") != INDEX_FORMAT or header.get("model") != self.model:
+                    raise ValueError("snapshot made with another format or model")
+                rows, texts, pages = {}, [], {}
+                with open(self.log_path, encoding="utf-8") as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if "chunk" in record:
+                            rows[record["chunk"]] = len(texts)
+                            texts.append(record["text"])
+                        elif "removed" in record:
+                            texts[rows.pop(record["removed"])] = None
+                        elif "page" in record:
+                            # Pages are kept in the order they were last updated
+                            pages.pop(record["page"], None)
+                            pages[record["page"]] = (record["hash"], record["chunks"])
+                dimension = header["dimension"]
+                if os.path.getsize(self.vectors_path) != len(texts) * dimension * 4:
+                    raise ValueError("embeddings don't match the chunks")
+            except FileNotFoundError:
+                return False
+            except (OSError, ValueError, KeyError, IndexError) as e:
+                self.error = "rebuilt: " + str(e)
+                self._clear()
+                return False
+            self.dimension = dimension
+            self.rows = rows
+            self.texts = texts
+            self.removed = sum(text is None for text in texts)
+            self._map()
+            for url, (page_hash, chunks) in pages.items():
+                documents = tuple(digest for digest in chunks if digest in rows)
+                state.pages[url] = (page_hash, documents)
+                state.owners.update(dict.fromkeys(documents, url))
+                self.pages[url] = page_hash
+            # Pages of previous sessions are not in the page store, their chunks are read from the snapshot
+            state.fallback = self.document
+            return True
+
+    def update(self, state: RagIndexState, candidates: dict | None = None):
+        """
+        Embed the chunks of the index state missing from the snapshot and append the changes
+
+        Args:
+            state: synced index state
+            candidates: chunks to embed by hash, all the missing chunks if None
+        """
+        with self.lock:
+            if candidates is None:
+                candidates = {digest: state.document(digest) for digest in state.owners if digest not in self.rows}
+            new = [(digest, document[len("text:"):]) for digest, document in candidates.items()
+                   if digest not in self.rows and document is not None]
+            records = []
+            if new:
+                vectors = self._embed([text for _, text in new])
+                if self.dimension == 0:
+                    self.dimension = vectors.shape[1]
+                    os.makedirs(self.path, exist_ok=True)
+                    with open(self.header_path, "w") as f:
+                        json.dump({"format": INDEX_FORMAT, "model": self.model, "dimension": self.dimension}, f)
+                elif vectors.shape[1] != self.dimension:
+                    raise ValueError("the embedding size changed")
+                with open(self.vectors_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                for digest, text in new:
+                    self.rows[digest] = len(self.texts)
+                    self.texts.append(text)
+                    records.append({"chunk": digest, "text": text})
+            evicted = self._evict(state)
+            for digest in [digest for digest in self.rows if digest not in state.owners]:
+                self.texts[self.rows.pop(digest)] = None
+                self.removed += 1
+                records.append({"removed": digest})
+            for url, (page_hash, documents) in state.pages.items():
+                if self.pages.get(url) != page_hash:
+                    self.pages.pop(url, None)
+                    self.pages[url] = page_hash
+                    records.append({"page": url, "hash": page_hash, "chunks": list(documents)})
+            if not records:
+                return
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(record) + "\n" for record in records)
+            self._map()
+            # Rewrite the files once most of the rows are removed chunks, or to free the space of evicted pages
+            if evicted or (self.removed > 256 and self.removed > len(self.rows)):
+                self._compact(state)
+
+    def size(self) -> int:
+        """Bytes of the live vectors and chunk texts"""
+        return sum(self.dimension * 4 + len(self.texts[row]) for row in self.rows.values())
+
+    def _evict(self, state: RagIndexState) -> bool:
+        # Pages of the current session are still needed, only the ones of earlier sessions are forgotten
+        if not self.max_bytes:
+            return False
+        size = self.size()
+        if size <= self.max_bytes:
+            return False
+        for url in list(self.pages):
+            if size <= self.max_bytes * 3 // 4:
+                break
+            if url not in state.pages or (state.store is not None and state.store.page_hash(url) is not None):
+                continue
+            for digest in state.pages[url][1]:
+                row = self.rows.get(digest)
+                if row is not None:
+                    size -= self.dimension * 4 + len(self.texts[row])
+            state.forget(url)
+            del self.pages[url]
+        return True
+
+    def document(self, digest: str) -> str | None:
+        """Get an indexed chunk as a document"""
+        with self.lock:
+            row = self.rows.get(digest)
+            return None if row is None else "text:" + self.texts[row]
+
+    def query(self, query: str, limit: int = 5, among: set | None = None) -> list[str]:
+        """Get the chunks most similar to the query, only among some chunk hashes if given"""
+        with self.lock:
+            if self.matrix is None or not self.rows:
+                return []
+            alive = self.alive
+            if among is not None:
+                alive = self.np.zeros(len(self.texts), dtype=bool)
+                alive[[self.rows[digest] for digest in among if digest in self.rows]] = True
+            vector = self._embed([query])[0]
+            scores = self.np.where(alive, self.matrix @ vector, -self.np.inf)
+            limit = min(limit, int(alive.sum()))
+            if limit == 0:
+                return []
+            best = self.np.argpartition(-scores, limit - 1)[:limit]
+            return [self.texts[row] for row in best[self.np.argsort(-scores[best])]]
+
+    def _embed(self, texts: list[str]):
+        vectors = self.np.asarray(self.embedding.get_embedding(texts), dtype=self.np.float32)
+        norms = self.np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / self.np.maximum(norms, 1e-12)
+
+    def _map(self):
+        if not self.texts:
+            self.matrix = None
+            return
+        self.matrix = self.np.memmap(self.vectors_path, dtype=self.np.float32, mode="r", shape=(len(self.texts), self.dimension))
+        self.alive = self.np.array([text is not None for text in self.texts])
+
+    def _compact(self, state: RagIndexState):
+        live = sorted(self.rows.items(), key=lambda item: item[1])
+        vectors = self.np.array(self.matrix[[row for _, row in live]]) if live else None
+        self.matrix = None
+        with open(self.vectors_path + ".tmp", "wb") as f:
+            if vectors is not None:
+                f.write(vectors.tobytes())
+        with open(self.log_path + ".tmp", "w", encoding="utf-8") as f:
+            for digest, row in live:
+                f.write(json.dumps({"chunk": digest, "text": self.texts[row]}) + "\n")
+            for url, (page_hash, documents) in state.pages.items():
+                f.write(json.dumps({"page": url, "hash": page_hash, "chunks": list(documents)}) + "\n")
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.log_path + ".tmp", self.log_path)
+        self.texts = [self.texts[row] for _, row in live]
+        self.rows = {digest: row for row, (digest, _) in enumerate(live)}
+        self.pages = {url: page_hash for url, page_hash in self.pages.items() if url in state.pages}
+        self.pages.update((url, page_hash) for url, (page_hash, _) in state.pages.items())
+        self.removed = 0
+        self._map()
+
+    def _clear(self):
+        self._reset_memory()
+        for path in (self.header_path, self.vectors_path, self.log_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class SummaryCache:
+    """
+    Summaries of old pages, keyed by page content hash and query fingerprint.
+
+    Missing summaries are generated on a bounded thread pool, a summary
+    requested while it is being generated waits for the same job.
+    """
+
+    def __init__(self, max_entries: int = 128, max_workers: int = 3):
+        self.max_entries = max_entries
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="webnav-summary")
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.stats = {"hits": 0, "misses": 0, "joined": 0, "failed": 0, "evicted": 0}
+
+    def submit(self, key: tuple, generate) -> Future:
+        """Get the summary for a key, calling generate() on the pool if it is not cached"""
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.stats["hits"] += 1
+                future = Future()
+                future.set_result(self.cache[key])
+                return future
+            if key in self.pending:
+                self.stats["joined"] += 1
+                return self.pending[key]
+            self.stats["misses"] += 1
+            future = self.executor.submit(self._generate, key, generate)
+            self.pending[key] = future
+            return future
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {**self.stats, "cached": len(self.cache), "pending": len(self.pending)}
+
+    def _generate(self, key: tuple, generate) -> str:
+        try:
+            summary = generate()
+        except Exception:
+            with self.lock:
+                self.pending.pop(key, None)
+                self.stats["failed"] += 1
+            raise
+        with self.lock:
+            self.pending.pop(key, None)
+            self.cache[key] = summary
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+                self.stats["evicted"] += 1
+        return summary
+
+
+class HistoryState:
+    """
+    Messages of the chat history already handled by preprocess_history.
+
+    The history only grows at the end between turns, so only the messages
+    after the last scanned one are searched for pages and user queries.
+    If the last scanned message changed the history is scanned again.
+    """
+
+    def __init__(self):
+        self.length = 0
+        self.boundary = None
+        self.boundary_hash = ""
+        self.query = ""
+        self.pages = {}
+        self.rewrites = {}
+        self.mode = None
+
+    def start(self, history: list) -> int:
+        """Get the index of the first message to scan"""
+        if 0 < self.length < len(history):
+            msg = history[self.length - 1]
+            if msg is self.boundary or content_hash(msg["Message"]) == self.boundary_hash:
+                return self.length
+        self.__init__()
+        return 0
+
+    def finish(self, history: list):
+        """Remember the messages scanned, the last one can still change"""
+        self.length = len(history) - 1
+        if self.length > 0:
+            self.boundary = history[self.length - 1]
+            self.boundary_hash = content_hash(self.boundary["Message"])
+
+
 class WebNavigator (NewelleExtension):
     id = "webnavigator2"
     name = "Web Navigator 2"
-    driver : BrowserWidget | None = None
-    old_pages = {}
-    indexed_pages = []
+    current: BrowserTab | None = None
+    pool: BrowserPool | None = None
+    tab_local = threading.local()
+    detached_url = ""
+    page_store: PageStore | None = None
+    rag_state: RagIndexState | None = None
     rag_index = None
-    lasturl = ""
+    index_snapshot: IndexSnapshot | None = None
+    snapshot_loaded = False
+    snapshot_error: str | None = None
+    http_client: KeepAliveHTTPClient | None = None
+    static_stats: dict | None = None
+    prefetcher: LinkPrefetcher | None = None
+    resource_blocker: ResourceBlocker | None = None
+    load_stats: dict | None = None
+    summary_cache: SummaryCache | None = None
+    page_cursors: dict | None = None
+    boilerplate: BoilerplateFilter | None = None
+    history_state: HistoryState | None = None
+    context_cache: tuple | None = None
+    last_query = ""
   
     def get_extra_settings(self) -> list:
         # Define extensions settings
         return [
            # ExtraSettings.ToggleSetting("headless", "Headless Mode", "Run in headless mode - don't show browser window", False),
+            ExtraSettings.ToggleSetting("strip_boilerplate", "Remove Repeated Site Blocks", "Remove from a page the menus, banners and footers already seen on another page of the same site", False),
+            ExtraSettings.SpinSetting("page_budget", "Page Result Size", "Maximum characters of a page returned by openlink, the rest is read with read_more. 0 returns the whole page", 20000, 0, 500000),
             ExtraSettings.ToggleSetting("page_summary", "Generate Page Summary", "Generate a summary of old pages using the secondary LLM", False),
+            ExtraSettings.ToggleSetting("background_summary", "Summarize Pages in Background", "Start the summary of a page as soon as it is opened, so it is ready for the next message", False),
             ExtraSettings.ToggleSetting("remove_old_pages", "Remove Old Pages", "Remove old pages from the history", False),
             ExtraSettings.ToggleSetting("retrieve_information", "Use Document Analyzer", "Use the document analyzer to find information in old web pages", False),
+            ExtraSettings.ComboSetting("retrieval_backend", "Retrieval Backend", "How old web pages are searched: embeddings, a local keyword index, or keywords first and embeddings on the best matches", {"Document Analyzer": "rag", "Keyword Index": "bm25", "Hybrid": "hybrid"}, "rag"),
+            ExtraSettings.ComboSetting("wait_state", "Page Load State", "Load state to wait for before reading an opened page", {"DOM Content Loaded": "domcontentloaded", "Load Finished": "load", "Network Idle": "networkidle"}, "load"),
+            ExtraSettings.SpinSetting("load_timeout", "Page Load Timeout", "Maximum seconds to wait for a page to load", 20, 1, 120),
+            ExtraSettings.ToggleSetting("stream_cleaning", "Streaming Page Cleaner", "Convert pages to markdown while they are read, using less memory on very large pages", False),
+            ExtraSettings.SpinSetting("max_page_chars", "Maximum Page Size", "Characters of a page kept by the streaming cleaner, the rest of the page is not read. 0 reads whole pages", 1000000, 0, 10000000),
+            ExtraSettings.ToggleSetting("static_fetch", "Fast Static Pages", "Download pages directly without rendering them, falling back to the browser for pages that need JavaScript", False),
+            ExtraSettings.EntrySetting("browser_domains", "Browser Only Domains", "Comma separated domains that are always opened in the browser", ""),
+            ExtraSettings.SpinSetting("max_tabs", "Maximum Tabs", "Maximum number of browser tabs used to open pages at the same time", 3, 1, 10),
+            ExtraSettings.ToggleSetting("prefetch_links", "Prefetch Links", "Download in the background the links the agent is likely to open next", False),
+            ExtraSettings.ToggleSetting("scrape_mode", "Scrape Mode", "Block images, fonts, media, ads, trackers and third party frames to load pages faster", False),
+            ExtraSettings.EntrySetting("scrape_mode_exempt", "Scrape Mode Exempt Domains", "Comma separated domains loaded with every resource in scrape mode", ""),
+            ExtraSettings.ToggleSetting("index_snapshot", "Keep Index Across Sessions", "Save the embeddings and the text of indexed pages in the cache folder, so they are not embedded again. Turning it off deletes them", True),
+            ExtraSettings.SpinSetting("index_snapshot_mb", "Index Size Limit", "Megabytes of disk used by the saved index, pages of earlier sessions are forgotten oldest first", 256, 16, 4096),
+            ExtraSettings.SpinSetting("page_store_mb", "Page Memory Budget", "Megabytes of visited pages kept in memory, older pages are compressed and moved to disk", 64, 8, 1024),
+            ExtraSettings.ToggleSetting("page_store_spill", "Move Old Pages to Disk", "Keep the pages over the memory budget in a temporary database instead of forgetting them", True),
         ]
  
     def get_additional_prompts(self) -> list:
@@ -85,47 +3297,235 @@ class WebNavigator (NewelleExtension):
             }
         ]
 
-    def openlink(self, url: str):
-        return self.get_answer(url, "openlink")
+    def openlink(self, url: str, tab=None, max_chars=None, max_tokens=None, diff=False):
+        return str(self.on_tab(tab, self.get_answer, url, "openlink", self.get_page_budget(max_chars, max_tokens), str(diff).lower() in ("true", "1")))
+
+    def get_page_budget(self, max_chars=None, max_tokens=None) -> int:
+        """Get the characters of a page window, about 4 characters per token"""
+        if max_chars not in (None, ""):
+            return int(max_chars)
+        if max_tokens not in (None, ""):
+            return int(max_tokens) * 4
+        return int(self.get_setting("page_budget") or 0)
+
+    def read_more(self, cursor: str, max_chars=None, max_tokens=None) -> str:
+        """Get the window of an opened page that starts at a cursor"""
+        digest, _, offset = str(cursor).strip().partition(":")
+        url = self.page_cursors.get(digest) if self.page_cursors is not None else None
+        if url is None or not offset.isdigit():
+            return "Webnav Error: unknown cursor " + str(cursor)
+        page_hash = self.old_pages.page_hash(url)
+        cleaned = self.old_pages.get(url)
+        if cleaned is None or page_hash is None or not page_hash.startswith(digest):
+            return "Webnav Error: the page changed or is no longer cached, open " + url + " again"
+        return self.page_window(url, cleaned, int(offset), self.get_page_budget(max_chars, max_tokens))
+
+    def page_window(self, url: str, cleaned: str, start: int, budget: int) -> str:
+        """Build the tool output for a window of a page, with the cursor of the next window"""
+        end = next_window(cleaned, start, budget)
+        result = "Webnav Result: " + cleaned[start:end]
+        if start > 0 or end < len(cleaned):
+            result = result.rstrip()
+            result += f"\n\n[Characters {start}-{end} of {len(cleaned)} from {url}"
+            if end < len(cleaned):
+                digest = content_hash(cleaned)[:12]
+                if self.page_cursors is None:
+                    self.page_cursors = {}
+                self.page_cursors[digest] = url
+                result += f". Call read_more with cursor \"{digest}:{end}\" to continue"
+            result += "]"
+        return result
+
+    # ============ Tabs ============
+
+    def active_tab(self) -> BrowserTab | None:
+        """Tab the tools of this thread run against, the current tab unless on_tab selected another"""
+        tab = getattr(self.tab_local, "tab", None)
+        return tab if tab is not None else self.current
+
+    @property
+    def driver(self) -> BrowserWidget | None:
+        tab = self.active_tab()
+        return tab.driver if tab is not None else None
+
+    @property
+    def dispatcher(self) -> JavaScriptDispatcher | None:
+        tab = self.active_tab()
+        return tab.dispatcher if tab is not None else None
+
+    @property
+    def load_watcher(self) -> PageLoadWatcher | None:
+        tab = self.active_tab()
+        return tab.load_watcher if tab is not None else None
+
+    @property
+    def snapshot_cache(self) -> PageSnapshotCache | None:
+        tab = self.active_tab()
+        return tab.snapshot_cache if tab is not None else None
+
+    @property
+    def lasturl(self) -> str:
+        tab = self.active_tab()
+        return tab.lasturl if tab is not None else self.detached_url
+
+    @lasturl.setter
+    def lasturl(self, url: str):
+        tab = self.active_tab()
+        if tab is not None:
+            tab.lasturl = url
+        else:
+            self.detached_url = url
+
+    @property
+    def old_pages(self) -> PageStore:
+        """Visited pages of this navigator"""
+        if self.page_store is None:
+            self.page_store = PageStore()
+        self.page_store.max_bytes = int(self.get_setting("page_store_mb") or 64) * 1024 * 1024
+        self.page_store.spill = bool(self.get_setting("page_store_spill"))
+        return self.page_store
+
+    def get_pool(self) -> BrowserPool:
+        if self.pool is None:
+            self.pool = BrowserPool(self.create_tab_sync, int(self.get_setting("max_tabs") or 3))
+        return self.pool
+
+    def create_tab(self) -> BrowserTab | None:
+        """Open a new browser tab, must be called on the main thread"""
+        tab = self.ui_controller.new_browser_tab(self.settings.get_string("initial-browser-page"), new=True)
+        if tab is None:
+            return None
+        return BrowserTab(tab, tab.get_child())
+
+    def create_tab_sync(self) -> BrowserTab | None:
+        """Open a new browser tab from a tool thread"""
+        done = threading.Event()
+        holder = {"tab": None}
+        def create():
+            try:
+                holder["tab"] = self.create_tab()
+            finally:
+                done.set()
+            return False
+        GLib.idle_add(create)
+        done.wait()
+        return holder["tab"]
+
+    def on_tab(self, tab_id, function, *args):
+        """Run a tool against the tab with the given id, or against the current tab if no id is given"""
+        if tab_id in (None, ""):
+            return function(*args)
+        tab = self.get_pool().get(int(tab_id))
+        if tab is None:
+            return {"error": f"Unknown tab: {tab_id}"}
+        return self.run_on_tab(tab, function, *args)
+
+    def run_on_tab(self, tab: BrowserTab, function, *args):
+        """Run a function with tab as the active tab of the calling thread"""
+        previous = getattr(self.tab_local, "tab", None)
+        self.tab_local.tab = tab
+        try:
+            return function(*args)
+        finally:
+            self.tab_local.tab = previous
+
+    def open_links(self, urls: list | str) -> str:
+        """Open several links at the same time, each one in its own tab"""
+        if isinstance(urls, str):
+            urls = json.loads(urls) if urls.strip().startswith("[") else [u.strip() for u in urls.split(",")]
+        urls = [url if url.startswith("http") else urljoin(self.lasturl, url) for url in urls if url]
+        pool = self.get_pool()
+        results = [""] * len(urls)
+
+        def open_in_tab(index: int, url: str):
+            try:
+                tab = pool.acquire(self.get_load_timeout(), exclude=self.current)
+            except Exception as e:
+                results[index] = f"Webnav Error: {url}: {e}"
+                return
+            self.tab_local.tab = tab
+            try:
+                results[index] = f"[tab {tab.id}] " + (self.get_answer(url, "openlink") or "")
+            except Exception as e:
+                results[index] = f"[tab {tab.id}] Webnav Error: {url}: {e}"
+            finally:
+                self.tab_local.tab = None
+                pool.release(tab)
+
+        threads = [threading.Thread(target=open_in_tab, args=(index, url)) for index, url in enumerate(urls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return "\n\n".join(results)
+
+    def list_tabs(self) -> dict:
+        """List the open browser tabs"""
+        current = self.current
+        return {"tabs": [{"tab": tab.id, "url": tab.lasturl, "current": tab is current, "busy": tab.busy}
+                         for tab in self.get_pool().list()]}
 
     def get_tools(self) -> list:
         return [
             # Navigation tools
-            create_io_tool("openlink", "Open a link and get full page content", self.openlink, tools_group="Web Navigation"),
-            create_io_tool("click_element", "Click an element by CSS selector", 
-                          lambda selector: str(self.click_element(selector)), tools_group="Web Navigation"),
+            create_io_tool("openlink", "Open a link and get the page content. Long pages are cut at max_chars (or max_tokens) and end with a cursor to pass to read_more. With diff=true a page read before returns only the blocks that changed (tab: optional tab id)", self.openlink, tools_group="Web Navigation"),
+            create_io_tool("crawl", "Read up to max_pages pages of a site in one call, following links up to max_depth from start_url (or its sitemap), and save them for search_page_text with scope \"all\". "
+                          "include and exclude are comma separated regular expressions matched against the URLs", 
+                          lambda start_url, max_pages=20, max_depth=2, same_site=True, include="", exclude="", max_seconds=60: str(self.crawl(start_url, max_pages, max_depth, same_site, include, exclude, max_seconds)), tools_group="Web Navigation"),
+            create_io_tool("read_more", "Read the next part of a page opened with openlink, using the cursor at the end of the previous part", 
+                          lambda cursor, max_chars=None, max_tokens=None: self.read_more(cursor, max_chars, max_tokens), tools_group="Web Navigation"),
+            create_io_tool("open_links", "Open several links at the same time in separate tabs and get their content", 
+                          lambda urls: self.open_links(urls), tools_group="Web Navigation"),
+            create_io_tool("list_tabs", "List the open browser tabs with their id and url", 
+                          lambda: str(self.list_tabs()), tools_group="Web Navigation"),
+            create_io_tool("click_element", "Click an element by CSS selector (wait_for: optional load state to wait for if the click navigates)", 
+                          lambda selector, wait_for="", tab=None: str(self.on_tab(tab, self.click_element, selector, wait_for)), tools_group="Web Navigation"),
             create_io_tool("fill_input", "Fill an input field (selector, value)", 
-                          lambda selector, value: str(self.fill_input(selector, value)), tools_group="Web Navigation"),
-            create_io_tool("submit_form", "Submit a form by CSS selector", 
-                          lambda selector: str(self.submit_form(selector)), tools_group="Web Navigation"),
+                          lambda selector, value, tab=None: str(self.on_tab(tab, self.fill_input, selector, value)), tools_group="Web Navigation"),
+            create_io_tool("submit_form", "Submit a form by CSS selector (wait_for: optional load state to wait for after submitting)", 
+                          lambda selector, wait_for="", tab=None: str(self.on_tab(tab, self.submit_form, selector, wait_for)), tools_group="Web Navigation"),
             create_io_tool("scroll_page", "Scroll the page (direction: up/down/top/bottom, amount: pixels for up/down)", 
-                          lambda direction="down", amount=500: str(self.scroll_page(direction, amount)), tools_group="Web Navigation"),
+                          lambda direction="down", amount=500, tab=None: str(self.on_tab(tab, self.scroll_page, direction, amount)), tools_group="Web Navigation"),
+            create_io_tool("harvest_scroll", "Scroll an infinite scrolling page until it stops loading content and get only the new items, in batches (max_items, max_chars and max_seconds limit the harvest)", 
+                          lambda max_items=200, max_chars=50000, max_seconds=20, tab=None: str(self.on_tab(tab, self.harvest_scroll, max_items, max_chars, max_seconds)), tools_group="Web Navigation"),
+            create_io_tool("run_actions", "Run several steps in one call and stop at the first failure. steps is a list of objects with an action: "
+                          "click (selector), fill (selector, value), submit (selector), scroll (direction, amount), wait_for_selector (selector), "
+                          "wait_for_navigation (state), extract (parts, like get_page_bundle). Every step accepts a timeout in seconds", 
+                          lambda steps, tab=None: str(self.on_tab(tab, self.run_actions, steps)), tools_group="Web Navigation"),
+            create_io_tool("wait_for_page", "Wait for the page to reach a load state (committed, domcontentloaded, load, networkidle) and optionally for a CSS selector to appear", 
+                          lambda state="load", selector="", timeout=10, tab=None: str(self.on_tab(tab, self.wait_for_page, state, selector, timeout)), tools_group="Web Navigation"),
             
-            # Reduced content tools (low token usage)
-            create_io_tool("get_page_text", "Get plain text content of the page (max_chars limits output)", 
-                          lambda max_chars=2000: str(self.get_page_text(max_chars)), tools_group="Web Navigation"),
+            # Reduced content tools (low token usage), tab selects a tab opened by open_links
+            create_io_tool("get_page_text", "Get plain text content of the page (max_chars limits output, diff=true returns only the lines changed since the last call)", 
+                          lambda max_chars=2000, diff=False, tab=None: str(self.on_tab(tab, self.get_page_text, max_chars, diff)), tools_group="Web Navigation"),
             create_io_tool("get_page_links", "Get all links on the page (max_links limits output)", 
-                          lambda max_links=30: str(self.get_page_links(max_links)), tools_group="Web Navigation"),
+                          lambda max_links=30, tab=None: str(self.on_tab(tab, self.get_page_links, max_links)), tools_group="Web Navigation"),
             create_io_tool("get_page_headings", "Get all headings (h1-h6) from the page", 
-                          lambda: str(self.get_page_headings()), tools_group="Web Navigation"),
+                          lambda tab=None: str(self.on_tab(tab, self.get_page_headings)), tools_group="Web Navigation"),
             create_io_tool("get_page_outline", "Get a minimal structural outline of the page", 
-                          lambda: str(self.get_page_outline()), tools_group="Web Navigation"),
+                          lambda tab=None: str(self.on_tab(tab, self.get_page_outline)), tools_group="Web Navigation"),
             create_io_tool("get_interactive_elements", "Get buttons, inputs, and forms on the page", 
-                          lambda: str(self.get_interactive_elements()), tools_group="Web Navigation"),
+                          lambda tab=None: str(self.on_tab(tab, self.get_interactive_elements)), tools_group="Web Navigation"),
             create_io_tool("get_main_content", "Extract main content area only (max_chars limits output)", 
-                          lambda max_chars=3000: str(self.get_main_content(max_chars)), tools_group="Web Navigation"),
-            create_io_tool("search_page_text", "Search for text on the page and get surrounding context", 
-                          lambda query: str(self.search_page_text(query)), tools_group="Web Navigation"),
-            create_io_tool("get_tables", "Extract table data from the page", 
-                          lambda: str(self.get_tables()), tools_group="Web Navigation"),
+                          lambda max_chars=3000, tab=None: str(self.on_tab(tab, self.get_main_content, max_chars)), tools_group="Web Navigation"),
+            create_io_tool("search_page_text", "Search for words on the page and get the surrounding context, best matches first. Put text in double quotes to match it exactly. Use scope \"all\" to search every page opened so far", 
+                          lambda query, scope="page", max_results=10, tab=None: str(self.on_tab(tab, self.search_page_text, query, scope, max_results)), tools_group="Web Navigation"),
+            create_io_tool("get_tables", "Get the tables of the page with their columns, column types, row count and first rows (max_tables limits output)", 
+                          lambda max_tables=20, tab=None: str(self.on_tab(tab, self.get_tables, max_tables)), tools_group="Web Navigation"),
+            create_io_tool("get_table_rows", "Read the rows of a table returned by get_tables from offset, at most limit rows (format: csv or columns). Pass nextOffset as offset to read the following rows", 
+                          lambda table=0, offset=0, limit=50, format="csv", max_chars=8000, tab=None: str(self.on_tab(tab, self.get_table_rows, table, offset, limit, format, max_chars)), tools_group="Web Navigation"),
             create_io_tool("get_images", "Get images with alt text from the page", 
-                          lambda max_images=20: str(self.get_images(max_images)), tools_group="Web Navigation"),
+                          lambda max_images=20, tab=None: str(self.on_tab(tab, self.get_images, max_images)), tools_group="Web Navigation"),
             
             # Page info tools
             create_io_tool("get_page_info", "Get basic page info (url, title, meta description)", 
-                          lambda: str(self.get_page_info()), tools_group="Web Navigation"),
+                          lambda tab=None: str(self.on_tab(tab, self.get_page_info)), tools_group="Web Navigation"),
+            create_io_tool("get_page_bundle", "Get several page views in one call (parts: list of " + ", ".join(BUNDLE_BUDGETS) + "; budgets: optional max characters for each part)", 
+                          lambda parts=None, budgets=None, tab=None: str(self.on_tab(tab, self.get_page_bundle, parts, budgets)), tools_group="Web Navigation"),
             create_io_tool("execute_js", "Execute custom JavaScript and return result", 
-                          lambda js_code: str(self.execute_custom_js(js_code)), tools_group="Web Navigation"),
+                          lambda js_code, tab=None: str(self.on_tab(tab, self.execute_custom_js, js_code)), tools_group="Web Navigation"),
+            create_io_tool("get_navigator_stats", "Get performance counters of the web navigator", 
+                          lambda: str(self.get_stats()), tools_group="Web Navigation"),
         ]
 
     def get_replace_codeblocks_langs(self) -> list:
@@ -133,91 +3533,556 @@ class WebNavigator (NewelleExtension):
         return []
 
     def get_context(self, query: str):
-        if self.rag is None:
+        backend = self.get_setting("retrieval_backend") or "rag"
+        if self.rag is None and backend == "rag":
             return ""
-        documents = []
-        for url, content in self.old_pages.items():
-            documents.append("text:" + content)
+        if self.rag_state is None:
+            self.rag_state = RagIndexState()
+        snapshot = self.get_index_snapshot() if self.rag is not None and backend != "bm25" else None
+        # Only the pages changed since the last query are chunked again
+        self.rag_state.sync(self.old_pages)
+        if backend == "bm25" or self.rag is None:
+            return "\n".join(document[len("text:"):] for _, document in self.rag_state.get_keyword_index().search(query, 5))
+        candidates = None
+        if backend == "hybrid":
+            # Only the best keyword matches are embedded
+            candidates = dict(self.rag_state.get_keyword_index().search(query, 20))
+        if snapshot is not None:
+            try:
+                snapshot.update(self.rag_state, candidates)
+                return "\n".join(snapshot.query(query, among=None if candidates is None else set(candidates)))
+            except Exception as e:
+                # Keep working with the in memory index, the error is shown in the stats
+                self.snapshot_error = str(e)
+                self.index_snapshot = None
+                self.rag_state = RagIndexState()
+                return self.get_context(query)
+        # Chunks the RAG index doesn't have yet are embedded, whatever backend was used when they were read
+        state = self.rag_state
+        if candidates is None:
+            candidates = {digest: state.document(digest) for digest in state.owners.keys() - state.embedded}
+        added = {digest: document for digest, document in candidates.items() if digest not in state.embedded and document is not None}
         if self.rag_index is None:
-            self.rag_index = self.rag.build_index(documents, 1024)
-            self.indexed_pages += documents
-        else:
-            diff = []
-            for document in documents:
-                if document not in self.indexed_pages:
-                    diff.append(document)
-            self.rag_index.insert(diff)
-            self.indexed_pages += diff
+            if not added:
+                return ""
+            self.rag_index = self.rag.build_index(list(added.values()), 1024)
+        elif added:
+            self.rag_index.insert(list(added.values()))
+        state.embedded.update(added)
+        # Chunks of replaced page versions stay in the index, their tombstones filter them out
         content = self.rag_index.query(query)
-        return "\n".join(content)
+        return "\n".join(result for result in content if state.is_current(result))
+
+    def get_cached_context(self, query: str) -> str:
+        """Get the context for a query, reused until the index changes"""
+        if self.rag is None and (self.get_setting("retrieval_backend") or "rag") == "rag":
+            return ""
+        if self.rag_state is None:
+            self.rag_state = RagIndexState()
+        backend = self.get_setting("retrieval_backend")
+        if self.context_cache is not None and self.old_pages.version == self.rag_state.synced_version:
+            key, context = self.context_cache
+            if key == (query, backend, self.rag_state.index_version):
+                return context
+        context = self.get_context(query)
+        self.context_cache = ((query, backend, self.rag_state.index_version), context)
+        return context
+
+    def get_index_snapshot(self) -> IndexSnapshot | None:
+        """Load the index saved in a previous session, the first time it is needed"""
+        path = os.path.join(GLib.get_user_cache_dir(), "webnavigator", "index")
+        if not self.get_setting("index_snapshot"):
+            # Turning the snapshot off deletes the chunks saved in earlier sessions
+            if self.index_snapshot is not None:
+                self.index_snapshot = None
+                self.snapshot_loaded = False
+                self.rag_state = RagIndexState()
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            return None
+        if self.snapshot_loaded:
+            if self.index_snapshot is not None:
+                self.index_snapshot.max_bytes = self.get_snapshot_budget()
+            return self.index_snapshot
+        self.snapshot_loaded = True
+        embedding = getattr(self, "embedding", None) or getattr(self.rag, "embedding", None)
+        if embedding is None or not callable(getattr(embedding, "get_embedding", None)):
+            return None
+        try:
+            import numpy
+        except ImportError:
+            return None
+        self.index_snapshot = IndexSnapshot(path, embedding, numpy, self.get_snapshot_budget())
+        self.rag_state = RagIndexState()
+        self.index_snapshot.load(self.rag_state)
+        return self.index_snapshot
     
+    def get_snapshot_budget(self) -> int:
+        return int(self.get_setting("index_snapshot_mb") or 256) * 1024 * 1024
+
     def preprocess_history(self, history: list, prompts: list) -> tuple[list, list]:
         # Preprocess the history before it is sent to the LLM
-        query = ""
-        for msg in history:
+        if self.history_state is None:
+            self.history_state = HistoryState()
+        state = self.history_state
+        start = state.start(history)
+        # Only the messages added since the last turn are scanned
+        for index in range(start, len(history)):
+            msg = history[index]
             if msg["User"] == "User":
-                query = msg["Message"]
-        # Find old web pages
-        for msg in history.copy()[:-1]:
-            if "Webnav Result: " in msg["Message"]:
-                # Remove pages if the remove_old_pages setting is enabled
-                if self.get_setting("remove_old_pages"):
-                    msg["Message"] = "Old Web Page content"
-                # Otherwise generate a page summery 
-                elif self.get_setting("page_summary"):
-                    txt = self.llm.generate_text(msg["Message"], history, [SUMMARY_PROMPT])
-                    msg["Message"] = txt
-                else:
-                    msg["Message"] = ""
+                state.query = msg["Message"]
+            # Find old web pages
+            if index < len(history) - 1 and "Webnav Result: " in msg["Message"]:
+                state.pages[index] = msg["Message"]
+        state.finish(history)
+        query = state.query
+        self.last_query = query
+        # Remove pages if the remove_old_pages setting is enabled, otherwise generate a page summary
+        if self.get_setting("remove_old_pages"):
+            mode = ("remove", "")
+        elif self.get_setting("page_summary"):
+            mode = ("summary", query)
+        else:
+            mode = ("empty", "")
+        if mode != state.mode:
+            state.rewrites.clear()
+            state.mode = mode
+        summaries = []
+        for index, page in state.pages.items():
+            if index in state.rewrites:
+                history[index]["Message"] = state.rewrites[index]
+            elif mode[0] == "remove":
+                state.rewrites[index] = history[index]["Message"] = "Old Web Page content"
+            elif mode[0] == "summary":
+                summaries.append((index, self.summarize_page(page, query, [dict(m) for m in history])))
+            else:
+                state.rewrites[index] = history[index]["Message"] = ""
+        # Summaries are generated concurrently, cached ones are ready
+        for index, summary in summaries:
+            try:
+                state.rewrites[index] = history[index]["Message"] = summary.result()
+            except Exception:
+                history[index]["Message"] = "Old Web Page content"
         # Use RAG to get relevant context from old web pages
         if self.get_setting("retrieve_information"):
-            context = self.get_context(query)
+            context = self.get_cached_context(query)
             prompts.append("Context from previous websites:\n\n" + context)
         return history, prompts
 
-    def get_answer(self, codeblock: str, lang: str) -> str | None:
+    def summarize_page(self, message: str, query: str, history: list) -> Future:
+        """Summarize an old page result for a query, reusing the summaries already made"""
+        if self.summary_cache is None:
+            self.summary_cache = SummaryCache()
+        key = (content_hash(message), content_hash(SUMMARY_PROMPT + "\n" + query))
+        return self.summary_cache.submit(key, lambda: self.llm.generate_text(message, history, [SUMMARY_PROMPT]))
+
+    def strip_boilerplate(self, url: str, cleaned: str) -> str:
+        """Remove the blocks of a page repeated on other pages of its site, if enabled"""
+        if not self.get_setting("strip_boilerplate"):
+            return cleaned
+        if self.boilerplate is None:
+            self.boilerplate = BoilerplateFilter()
+        return self.boilerplate.strip(url, cleaned)
+
+    def page_result(self, url: str, cleaned: str, lang: str, budget: int | None = None, previous: str | None = None) -> str | None:
+        """Build the tool output of an opened page, or of its changes since the previous version if given"""
+        if lang != "openlink":
+            return None
+        budget = self.get_page_budget() if budget is None else budget
+        if previous is not None:
+            changes = format_diff(diff_blocks(split_blocks(previous), split_blocks(cleaned)))
+            if budget and len(changes) > budget:
+                changes = changes[:next_window(changes, 0, budget)].rstrip() + "\n\n[Changes cut, open the page without diff to read all of it]"
+            return "Webnav Result: " + changes
+        result = self.page_window(url, cleaned, 0, budget)
+        # The page will be summarized in the next message, start now for the current query
+        if self.get_setting("page_summary") and self.get_setting("background_summary") and not self.get_setting("remove_old_pages"):
+            query = self.last_query
+            self.summarize_page(result, query, [{"User": "User", "Message": query}])
+        return result
+
+    def get_answer(self, codeblock: str, lang: str, budget: int | None = None, diff: bool = False) -> str | None:
+        url = codeblock if codeblock.startswith("http") else urljoin(self.lasturl, codeblock)
+        # Pages downloaded ahead of time are served without navigating, page tools open them when needed
+        if self.prefetcher is not None:
+            cleaned = self.prefetcher.get(url)
+            if cleaned is not None:
+                self.lasturl = url
+                cleaned = self.strip_boilerplate(url, cleaned)
+                previous = self.old_pages.get(url) if diff else None
+                self.old_pages[url] = cleaned
+                return self.page_result(url, cleaned, lang, budget, previous)
+            self.prefetcher.cancel()
+        # Try to read the page without rendering it
+        if self.get_setting("static_fetch"):
+            fetched = self.fetch_static_html(url)
+            if fetched is not None:
+                html, cleaned = fetched
+                self.lasturl = url
+                cleaned = self.strip_boilerplate(url, cleaned)
+                previous = self.old_pages.get(url) if diff else None
+                self.old_pages[url] = cleaned
+                self.prefetch_links(extract_links(html, url), url)
+                return self.page_result(url, cleaned, lang, budget, previous)
         # Open the page and get its content
-        # Create a semaphore to wait for the page content
+        tab, navigation = self.start_navigation(codeblock)
+        if "error" in navigation:
+            return "Webnav Error: " + navigation["error"] if lang == "openlink" else None
+        codeblock = navigation["url"]
+        # Wait for page loading, a page that does not finish in time is read as it is
+        load = tab.load_watcher.wait(self.get_setting("wait_state"), self.get_load_timeout(), navigation["id"])
+        self.record_load(tab, load)
+        if load["outcome"] == "timeout":
+            # The page is read as it is, later loads would change it under the agent
+            tab.dispatcher.submit(lambda: tab.driver.webview.stop_loading(), lambda result, error: None, priority=PRIORITY_NAVIGATION)
+        if self.get_setting("stream_cleaning"):
+            try:
+                cleaned, links = self.run_on_tab(tab, self.clean_streaming, codeblock, self.iter_page_html())
+            except Exception as e:
+                return "Webnav Error: " + str(e) if lang == "openlink" else None
+        else:
+            # Get page HTMl
+            html = tab.driver.get_page_html_sync()
+            # Clean the page content using Newelle's website scraper
+            sc = WebsiteScraper(codeblock)
+            sc.set_html(html)
+            cleaned = sc.clean_html_to_markdown(html, include_links=True)
+            links = extract_links(html, codeblock)
+        cleaned = self.strip_boilerplate(codeblock, cleaned)
+        previous = self.old_pages.get(codeblock) if diff else None
+        self.old_pages[codeblock] = cleaned
+        self.prefetch_links(links, codeblock)
+        result = self.page_result(codeblock, cleaned, lang, budget, previous)
+        if result is not None and load["outcome"] == "timeout":
+            result += f"\n\n[The page didn't finish loading in {self.get_load_timeout():g} seconds, its content may be incomplete]"
+        return result
+
+    def start_navigation(self, codeblock: str) -> tuple[BrowserTab | None, dict]:
+        """
+        Navigate the active tab to a page, opening the browser if needed.
+
+        Returns:
+            tuple[BrowserTab | None, dict]: the tab and the navigation, with its url and id or an error
+        """
+        # The first page loaded in scrape mode is filtered too
+        self.prepare_resource_blocking()
+        # Create a semaphore to wait for the navigation to start
         sem = threading.Semaphore(1)
-        self.html = None
+        navigation = {}
+        tab = self.active_tab()
         def to_sync(codeblock):
-            self.open_browser()
+            nonlocal tab
+            if tab is None or not tab.is_open():
+                self.open_browser()
+                tab = self.current
             if not codeblock.startswith("http"):
-                codeblock = urljoin(self.lasturl, codeblock)
-            self.lasturl = codeblock
-            self.driver.navigate_to(codeblock)
+                codeblock = urljoin(tab.lasturl, codeblock)
+            tab.lasturl = codeblock
+            tab.loaded_url = codeblock
+            navigation["url"] = codeblock
+            self.update_resource_blocking(tab)
+            navigation["id"] = tab.load_watcher.begin_navigation()
+            tab.driver.navigate_to(codeblock)
             sem.release()
+        def on_error(result, error):
+            if error is not None:
+                navigation["error"] = error
+                sem.release()
         sem.acquire()
-        # Get the page content on the main UI thread
-        GLib.idle_add(to_sync, codeblock)
+        # Start the navigation on the main UI thread, ahead of the queued extraction scripts
+        if tab is not None:
+            tab.dispatcher.submit(lambda: to_sync(codeblock), on_error, priority=PRIORITY_NAVIGATION)
+        else:
+            def start():
+                try:
+                    to_sync(codeblock)
+                except Exception as e:
+                    on_error(None, str(e))
+            GLib.idle_add(start)
         sem.acquire()
         sem.release()
-        # Sleep a bit to be sure that loading started 
-        sleep(1)
-        # Wait for page loadaing
-        self.driver.loading.acquire()
-        self.driver.loading.release()
-        # Get page HTMl
-        self.html = self.driver.get_page_html_sync()
-        # Clean the page content using Newelle's website scraper
-        sc = WebsiteScraper(codeblock)
-        sc.set_html(self.html)
-        cleaned = sc.clean_html_to_markdown(self.html, include_links=True)
-        self.old_pages[codeblock] = cleaned
-        if lang == "openlink":
-            return "Webnav Result: " + cleaned 
-        return None
+        return tab, navigation
+
+    def ensure_page_loaded(self):
+        """Open in the browser the page last read without rendering it, before a tool works on the page"""
+        tab = self.active_tab()
+        url = self.lasturl
+        if not url or (tab is not None and tab.is_open() and tab.loaded_url == url):
+            return
+        tab, navigation = self.start_navigation(url)
+        if "error" in navigation:
+            raise Exception(navigation["error"])
+        self.record_load(tab, tab.load_watcher.wait(self.get_setting("wait_state"), self.get_load_timeout(), navigation["id"]))
+
+    def is_scrape_mode(self, url: str) -> bool:
+        """Check if resources are blocked for a URL"""
+        return bool(self.get_setting("scrape_mode")) and not domain_matches(url, parse_domains(self.get_setting("scrape_mode_exempt")))
+
+    def get_block_rules(self) -> str:
+        """Get the content filter rules of scrape mode, creating the blocker on first use"""
+        if self.resource_blocker is None:
+            self.resource_blocker = ResourceBlocker(os.path.join(GLib.get_user_cache_dir(), "webnavigator", "content-filters"))
+        return build_block_rules(parse_domains(self.get_setting("scrape_mode_exempt")))
+
+    def prepare_resource_blocking(self):
+        """Wait for the scrape mode filter to be loaded or compiled, so the next page is loaded with it"""
+        if not self.get_setting("scrape_mode"):
+            return
+        holder = {}
+        started = threading.Event()
+        def prepare():
+            try:
+                rules = self.get_block_rules()
+                holder["ready"] = self.resource_blocker.prepare(rules)
+            finally:
+                started.set()
+            return False
+        GLib.idle_add(prepare)
+        started.wait()
+        if "ready" in holder:
+            holder["ready"].wait(self.get_load_timeout())
+
+    def update_resource_blocking(self, tab: BrowserTab):
+        """Add or remove the scrape mode filter of a tab to match the settings, on the main thread"""
+        if self.get_setting("scrape_mode"):
+            rules = self.get_block_rules()
+            self.resource_blocker.apply(tab, rules)
+        elif self.resource_blocker is not None:
+            self.resource_blocker.remove(tab)
+
+    def record_load(self, tab: BrowserTab, load: dict):
+        """
+        Add the load time and the transferred bytes of a page to the counters of its mode.
+        The bytes are read in the background after the page is read, so loads are not slowed down.
+        """
+        mode = "scrape" if tab.content_filter is not None and self.is_scrape_mode(tab.loaded_url) else "normal"
+        def on_resources(result, error):
+            # Runs on the main thread, like every other update of the counters
+            if self.load_stats is None:
+                self.load_stats = {}
+            stats = self.load_stats.setdefault(mode, {"pages": 0, "load_ms": 0, "requests": 0, "transfer_bytes": 0, "body_bytes": 0})
+            stats["pages"] += 1
+            stats["load_ms"] += load["elapsed_ms"]
+            try:
+                resources = json.loads(result)
+                stats["requests"] += resources["requests"]
+                stats["transfer_bytes"] += resources["transferSize"]
+                stats["body_bytes"] += resources["bodySize"]
+            except Exception:
+                pass
+        tab.dispatcher.submit(LIBRARY_CALL_JS, on_resources, SCRIPT_WORLD, {"name": "resources", "args": "{}", "chunk": "0"}, PRIORITY_EXTRACTION)
+
+    def get_http_client(self) -> KeepAliveHTTPClient:
+        if self.http_client is None:
+            self.http_client = KeepAliveHTTPClient(timeout=self.get_load_timeout())
+            self.static_stats = {"static": 0, "fallback": 0}
+        return self.http_client
+
+    def prefetch_links(self, links: list[dict], base_url: str):
+        """Start downloading the links the agent is likely to open next, if enabled"""
+        if not self.get_setting("prefetch_links") or not links:
+            return
+        if self.prefetcher is None:
+            self.prefetcher = LinkPrefetcher(self.fetch_static)
+        self.prefetcher.schedule(rank_links(links, base_url, self.last_query, 3))
+
+    def fetch_static(self, url: str) -> str | None:
+        """
+        Download and clean a page without the browser.
+
+        Returns:
+            str | None: the cleaned markdown, None if the page has to be opened in the browser
+        """
+        result = self.fetch_static_html(url)
+        return result[1] if result is not None else None
+
+    def fetch_static_html(self, url: str) -> tuple[str, str] | None:
+        """
+        Download and clean a page without the browser.
+
+        Returns:
+            tuple[str, str] | None: the HTML and the cleaned markdown,
+                                    None if the page has to be opened in the browser
+        """
+        if domain_matches(url, parse_domains(self.get_setting("browser_domains"))):
+            return None
+        client = self.get_http_client()
+        try:
+            response = client.get(url)
+        except Exception:
+            self.static_stats["fallback"] += 1
+            return None
+        if response.status != 200 or response.truncated or response.content_type() not in ("text/html", "application/xhtml+xml"):
+            self.static_stats["fallback"] += 1
+            return None
+        html = response.text()
+        cleaned = self.clean_html(response.url, html)
+        if needs_browser(html, cleaned):
+            self.static_stats["fallback"] += 1
+            return None
+        self.static_stats["static"] += 1
+        return html, cleaned
+
+    def clean_html(self, url: str, html: str) -> str:
+        """Convert downloaded HTML to markdown with the configured cleaner"""
+        if self.get_setting("stream_cleaning"):
+            cleaned, _ = self.clean_streaming(url, (html[i:i + TRANSFER_CHUNK_SIZE] for i in range(0, len(html), TRANSFER_CHUNK_SIZE)))
+            return cleaned
+        sc = WebsiteScraper(url)
+        sc.set_html(html)
+        return sc.clean_html_to_markdown(html, include_links=True)
+
+    def fetch_text(self, url: str) -> str:
+        """Download a text document like robots.txt, a sitemap or a feed"""
+        response = self.get_http_client().get(url, max_bytes=5 * 1024 * 1024)
+        if response.status != 200:
+            raise Exception(f"HTTP {response.status}")
+        # Sitemaps are often served compressed as files
+        if response.body[:2] == b"\x1f\x8b":
+            return gzip.decompress(response.body).decode("utf-8", errors="replace")
+        return response.text()
+
+    def fetch_crawled_page(self, url: str) -> tuple[str, str, str]:
+        """Download and clean a page for the crawler, raising when it can't be read without the browser"""
+        if domain_matches(url, parse_domains(self.get_setting("browser_domains"))):
+            raise Exception("Needs the browser, open it with openlink")
+        response = self.get_http_client().get(url)
+        if response.status != 200:
+            raise Exception(f"HTTP {response.status}")
+        if response.truncated or response.content_type() not in ("text/html", "application/xhtml+xml"):
+            raise Exception("Not a web page: " + (response.content_type() or "unknown type"))
+        html = response.text()
+        cleaned = self.clean_html(response.url, html)
+        if needs_browser(html, cleaned):
+            raise Exception("Needs the browser, open it with openlink")
+        return response.url, html, cleaned
+
+    def crawl(self, start_url: str, max_pages: int = 20, max_depth: int = 2, same_site=True,
+              include=None, exclude=None, max_seconds: float = 60) -> dict:
+        """
+        Read the pages of a site without the browser and add them to the visited pages.
+
+        Args:
+            start_url (str): first page of the crawl
+            max_pages (int): maximum number of pages read
+            max_depth (int): maximum number of links followed from the start page
+            same_site (bool): only read pages of the site of the start page and its subdomains
+            include: regular expressions, a URL is read only if it matches one of them
+            exclude: regular expressions, URLs matching one of them are not read
+            max_seconds (float): the crawl stops after this time
+
+        Returns:
+            dict: manifest of the pages read and of the ones that failed
+        """
+        patterns = lambda value: [pattern.strip() for pattern in (value.split(",") if isinstance(value, str) else value or []) if pattern.strip()]
+        try:
+            crawler = SiteCrawler(self.fetch_crawled_page, self.fetch_text, int(max_pages), int(max_depth),
+                                  str(same_site).lower() not in ("false", "0", "no"), patterns(include), patterns(exclude),
+                                  max_seconds=float(max_seconds))
+        except re.error as e:
+            return {"success": False, "error": f"Invalid pattern: {e}"}
+        started = monotonic()
+        pages, duplicates, errors = [], 0, []
+        stopped = "done"
+        # Created before the workers share it
+        self.get_http_client()
+        try:
+            for result in crawler.crawl(start_url):
+                if "stopped" in result:
+                    stopped = result["stopped"]
+                elif "error" in result:
+                    errors.append({"url": result["url"], "error": result["error"]})
+                elif "duplicate_of" in result:
+                    duplicates += 1
+                else:
+                    url = result["url"]
+                    cleaned = self.strip_boilerplate(url, result["cleaned"])
+                    self.old_pages[url] = cleaned
+                    title = next((line.lstrip("# ") for line in cleaned.splitlines() if line.startswith("#")), cleaned.strip()[:80])
+                    pages.append({"url": url, "depth": result["depth"], "title": title[:80], "chars": len(cleaned)})
+        except Exception as e:
+            return {"success": False, "error": str(e), "pages": pages}
+        # The new pages are indexed at once, not on the next query
+        if pages:
+            if self.rag_state is None:
+                self.rag_state = RagIndexState()
+            self.rag_state.sync(self.old_pages)
+        return fit_to_budget({
+            "success": True,
+            "start": canonical_url(start_url),
+            "source": crawler.source,
+            "stopped": stopped,
+            "pageCount": len(pages),
+            "duplicates": duplicates,
+            "failed": len(errors),
+            "elapsedMs": int((monotonic() - started) * 1000),
+            "note": "The pages are saved, search them with search_page_text and scope \"all\" or open them with openlink",
+            "pages": pages,
+            "errors": errors[:10]
+        }, 8000)
 
     def open_browser(self):
-        if self.driver is not None:
-            parent = self.driver.get_display()
-            if parent is not None:
-                return
-        self.tab = self.ui_controller.new_browser_tab(self.settings.get_string("initial-browser-page"), new=True)
+        tab = self.active_tab()
+        if tab is not None and tab.is_open():
+            return
+        tab = self.create_tab()
+        if tab is not None:
+            self.current = tab
+            self.get_pool().add(tab)
+
+    def get_load_timeout(self) -> float:
+        """Get the page load deadline in seconds"""
+        return float(self.get_setting("load_timeout") or 20)
+
+    def wait_for_page(self, state: str = "load", selector: str = "", timeout: float = 10) -> dict:
+        """Wait for the current page to reach a load state and optionally for a selector to be present"""
+        try:
+            self.ensure_page_loaded()
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        if self.load_watcher is None:
+            return {"success": False, "error": "No page is open"}
+        if state not in LOAD_STATES:
+            return {"success": False, "error": f"Unknown load state: {state}, use one of {', '.join(LOAD_STATES)}"}
+        deadline = monotonic() + float(timeout)
+        result = self.load_watcher.wait(state, float(timeout), self.load_watcher.navigation)
+        if not selector or not result["success"]:
+            return result
+        # Poll for the selector until the remaining time runs out
+        while True:
+            try:
+                if self.call_library("exists", {"selector": selector}):
+                    result["selector"] = selector
+                    return result
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+            if monotonic() >= deadline:
+                return {"success": False, "outcome": "timeout", "error": f"Selector not found: {selector}"}
+            sleep(0.1)
+
 
-        if self.tab is not None:
-            self.driver = self.tab.get_child()
+    def iter_page_html(self, timeout: int = 10000):
+        """Yield the HTML of the page in bounded chunks"""
+        arguments = {"chunk": str(TRANSFER_CHUNK_SIZE)}
+        result = self.execute_javascript_sync(PAGE_HTML_JS, timeout, SCRIPT_WORLD, arguments)
+        if result == LIBRARY_MISSING:
+            self.execute_javascript_sync(LIBRARY_JS, timeout, SCRIPT_WORLD, coalesce=True)
+            result = self.execute_javascript_sync(PAGE_HTML_JS, timeout, SCRIPT_WORLD, arguments)
+        yield from self.iter_transfer(result, SCRIPT_WORLD, timeout)
+
+    def clean_streaming(self, url: str, chunks) -> tuple[str, list[dict]]:
+        """
+        Convert HTML read in chunks to markdown with the streaming cleaner.
 
+        Returns:
+            tuple[str, list[dict]]: the markdown and the links of the page read
+        """
+        parser = MarkdownStream(url)
+        limit = int(self.get_setting("max_page_chars") or 0)
+        cleaned = "\n\n".join(stream_markdown(chunks, url, limit, parser))
+        if limit and len(cleaned) >= limit:
+            cleaned += "\n\n[Page cut after " + str(limit) + " characters]"
+        return cleaned, parser.links
 
     def get_html_from_url(self, url):
         self.open_browser()
@@ -225,60 +4090,48 @@ class WebNavigator (NewelleExtension):
         html = self.driver.get_page_html_sync()
         return html 
 
-    def run_javascript(self, script: str, callback):
+    def run_javascript(self, script: str, callback, world: str | None = None, arguments: dict | None = None,
+                       priority: int = PRIORITY_EXTRACTION, coalesce: bool = False) -> JavaScriptRequest:
         """
         Run JavaScript code in the browser and pass the output to the callback.
-        Uses GLib.idle_add to ensure execution on the main GTK thread.
+        The script is queued in the tab dispatcher, which runs it on the main GTK thread.
 
         Args:
             script (str): JavaScript code to execute
             callback (callable): Function to call with the result.
                                 The callback will receive two parameters: (result, error)
                                 where result is the JS result and error is None on success.
+            world (str | None): Script world to run the code in, None for the page world
+            arguments (dict | None): If given, the script is run as the body of an async function
+                                     with these string arguments as local variables
+            priority (int): one of the PRIORITY_* constants
+            coalesce (bool): share the result with an identical script already queued
+
+        Returns:
+            JavaScriptRequest: the queued request
         """
         self.open_browser()
+        return self.dispatcher.submit(script, callback, world, arguments, priority, coalesce)
 
-        def on_javascript_finished(webview, result, user_data):
-            try:
-                js_result = webview.evaluate_javascript_finish(result)
-                if js_result:
-                    result_value = js_result.to_string()
-                    callback(result_value, None)
-                else:
-                    callback(None, "Failed to get JavaScript result")
-            except Exception as e:
-                callback(None, str(e))
-
-        def schedule_on_main_thread():
-            self.driver.webview.evaluate_javascript(
-                script,
-                -1,
-                None,
-                None,
-                None,
-                on_javascript_finished,
-                None
-            )
-            return False  # Don't repeat
-
-        GLib.idle_add(schedule_on_main_thread)
-
-    def _escape_js_string(self, value: str) -> str:
-        """Escape a string for safe insertion into JavaScript code"""
-        return value.replace("\\", "\\\\").replace("'", "\\'").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r")
-
-    def execute_javascript_sync(self, script: str, timeout: int = 10000) -> str:
+    def execute_javascript_sync(self, script: str, timeout: int = 10000, world: str | None = None, arguments: dict | None = None,
+                                priority: int = PRIORITY_EXTRACTION, coalesce: bool = False, holder: dict | None = None) -> str:
         """
         Execute JavaScript code synchronously and return the result.
-        Uses threading.Semaphore for synchronization.
+        Uses threading.Semaphore for synchronization, a request that times out is cancelled.
 
         Args:
             script (str): JavaScript code to execute
             timeout (int): Timeout in milliseconds
+            world (str | None): Script world to run the code in, None for the page world
+            arguments (dict | None): String arguments, see run_javascript
+            priority (int): one of the PRIORITY_* constants
+            coalesce (bool): share the result with an identical script already queued
+            holder (dict | None): receives the request under "request", to count the callers sharing its result
 
         Returns:
             str: The result of the JavaScript execution
         """
+        self.ensure_page_loaded()
         sem = threading.Semaphore(0)
         result_holder = {"value": ""}
         error_holder = {"value": None}
@@ -288,503 +4141,558 @@ class WebNavigator (NewelleExtension):
             error_holder["value"] = err
             sem.release()
 
-        self.run_javascript(script, callback)
-        
+        request = self.run_javascript(script, callback, world, arguments, priority, coalesce)
+        if holder is not None:
+            holder["request"] = request
+
         if not sem.acquire(timeout=timeout / 1000):
-            error_holder["value"] = f"JavaScript execution timed out after {timeout}ms"
+            self.dispatcher.cancel(request, callback)
+            raise Exception(f"JavaScript execution timed out after {timeout}ms")
 
         if error_holder["value"]:
             raise Exception(error_holder["value"])
         return result_holder["value"]
 
+    def call_library(self, name: str, args: dict | None = None, timeout: int = 10000):
+        """
+        Call an action of the library installed in the page.
+
+        Args:
+            name (str): name of the action
+            args (dict | None): arguments of the action, passed to the page as JSON
+            timeout (int): Timeout in milliseconds
+
+        Returns:
+            The decoded JSON result of the action
+        """
+        return json.loads("".join(self.iter_library(name, args, timeout)))
+
+    def iter_library(self, name: str, args: dict | None = None, timeout: int = 10000):
+        """
+        Call an action of the library and yield its JSON encoded result in chunks.
+        Long results are pulled from the page in bounded chunks, so no single
+        large string is ever copied on the main thread.
+
+        Args:
+            name (str): name of the action
+            args (dict | None): arguments of the action, passed to the page as JSON
+            timeout (int): Timeout in milliseconds for each round trip
+
+        Yields:
+            str: consecutive pieces of the JSON encoded result
+        """
+        arguments = {"name": name, "args": json.dumps(args or {}), "chunk": str(TRANSFER_CHUNK_SIZE)}
+        read_only = name in LIBRARY_READ_ONLY
+        priority = PRIORITY_EXTRACTION if read_only else PRIORITY_ACTION
+        holder = {}
+        result = self.execute_javascript_sync(LIBRARY_CALL_JS, timeout, SCRIPT_WORLD, arguments, priority, read_only, holder)
+        if result == LIBRARY_MISSING:
+            # Pages loaded before the user script was added don't have the library yet
+            self.execute_javascript_sync(LIBRARY_JS, timeout, SCRIPT_WORLD, priority=priority, coalesce=True)
+            result = self.execute_javascript_sync(LIBRARY_CALL_JS, timeout, SCRIPT_WORLD, arguments, priority, read_only, holder)
+        try:
+            yield from self.iter_transfer(result, SCRIPT_WORLD, timeout, release=False)
+        finally:
+            # A coalesced result is shared with other callers, the last one done with it frees its buffer
+            if self.dispatcher.finish_reading(holder["request"]):
+                self.release_buffer(result, SCRIPT_WORLD, timeout)
+
+    def iter_transfer(self, result: str, world: str | None, timeout: int = 10000, release: bool = True):
+        """
+        Yield a script result, pulling it chunk by chunk if the page kept it in a buffer.
+
+        Args:
+            result (str): value returned by the script, either the result or a buffer handle
+            world (str | None): Script world holding the buffer
+            timeout (int): Timeout in milliseconds for each chunk
+            release (bool): free the page buffer once read or when the consumer stops early
+        """
+        if not result.startswith(BUFFER_PREFIX):
+            yield result
+            return
+        buffer_id, length = result[len(BUFFER_PREFIX):].split(":")
+        length = int(length)
+        offset = 0
+        try:
+            while offset < length:
+                end, _, chunk = self.execute_javascript_sync(BUFFER_TAKE_JS[world], timeout, world, {
+                    "id": buffer_id,
+                    "offset": str(offset),
+                    "size": str(TRANSFER_CHUNK_SIZE)
+                }).partition(":")
+                if int(end) <= offset:
+                    raise Exception("Buffered result ended early")
+                offset = int(end)
+                yield chunk
+        finally:
+            if release:
+                self.release_buffer(result, world, timeout)
+
+    def release_buffer(self, result: str, world: str | None, timeout: int = 10000):
+        """Free the page buffer of a script result, if it has one"""
+        if not result.startswith(BUFFER_PREFIX):
+            return
+        try:
+            self.execute_javascript_sync(BUFFER_RELEASE_JS[world], timeout, world, {"id": result[len(BUFFER_PREFIX):].split(":")[0]})
+        except Exception:
+            pass
+
+    def _next_navigation(self) -> int | None:
+        """Id of the navigation an action is about to trigger"""
+        try:
+            # The action must not wait on the navigation that opens the page it works on
+            self.ensure_page_loaded()
+        except Exception:
+            pass
+        if self.load_watcher is None:
+            return None
+        return self.load_watcher.navigation + 1
+
+    def _navigation_started(self, navigation: int | None, timeout: float = 0) -> bool:
+        """Check if the navigation an action was expected to trigger started, waiting at most timeout seconds"""
+        if navigation is None or self.load_watcher is None:
+            return False
+        if timeout:
+            self.load_watcher.wait("started", timeout, navigation)
+        return self.load_watcher.navigation >= navigation
+
+    def _wait_after_action(self, result: dict, wait_for: str, navigation: int | None) -> dict:
+        """Wait for the navigation triggered by an action if a load state was requested"""
+        if not wait_for or navigation is None or not result.get("success"):
+            return result
+        if wait_for not in LOAD_STATES:
+            result["load"] = {"success": False, "error": f"Unknown load state: {wait_for}"}
+        else:
+            result["load"] = self.load_watcher.wait(wait_for, self.get_load_timeout(), navigation)
+        return result
+
     # ============ Navigation Tools ============
 
-    def click_element(self, selector: str) -> dict:
+    def click_element(self, selector: str, wait_for: str = "") -> dict:
         """Click an element by CSS selector"""
-        escaped_selector = self._escape_js_string(selector)
-        js_code = f"""
-        (function() {{
-            const el = document.querySelector('{escaped_selector}');
-            if (el) {{
-                const tagName = el.tagName;
-                const href = el.href;
-                const text = el.innerText?.substring(0, 50) || '';
-                el.click();
-                return JSON.stringify({{ success: true, clicked: tagName, href: href || null, text: text }});
-            }}
-            return JSON.stringify({{ success: false, error: 'Element not found: {escaped_selector}' }});
-        }})()
-        """
-        try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+        navigation = self._next_navigation()
+        try:
+            result = self.call_library("click", {"selector": selector})
+            return self._wait_after_action(result, wait_for, navigation)
         except Exception as e:
             return {"success": False, "error": str(e)}
 
     def fill_input(self, selector: str, value: str) -> dict:
         """Fill an input field with a value"""
-        escaped_selector = self._escape_js_string(selector)
-        escaped_value = self._escape_js_string(value)
-        js_code = f"""
-        (function() {{
-            const el = document.querySelector('{escaped_selector}');
-            if (el) {{
-                el.value = '{escaped_value}';
-                el.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                el.dispatchEvent(new Event('change', {{ bubbles: true }}));
-                return JSON.stringify({{ success: true, filled: el.tagName, name: el.name || el.id }});
-            }}
-            return JSON.stringify({{ success: false, error: 'Element not found: {escaped_selector}' }});
-        }})()
-        """
-        try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+        try:
+            return self.call_library("fill", {"selector": selector, "value": value})
         except Exception as e:
             return {"success": False, "error": str(e)}
 
-    def submit_form(self, selector: str) -> dict:
+    def submit_form(self, selector: str, wait_for: str = "") -> dict:
         """Submit a form by selector"""
-        escaped_selector = self._escape_js_string(selector)
-        js_code = f"""
-        (function() {{
-            const form = document.querySelector('{escaped_selector}');
-            if (form) {{
-                form.submit();
-                return JSON.stringify({{ success: true, submitted: true }});
-            }}
-            return JSON.stringify({{ success: false, error: 'Form not found: {escaped_selector}' }});
-        }})()
-        """
-        try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+        navigation = self._next_navigation()
+        try:
+            result = self.call_library("submit", {"selector": selector})
         except Exception:
-            return {"success": True, "submitted": True, "note": "Form submitted, page navigation likely occurred"}
+            result = {"success": True, "submitted": True, "note": "Form submitted, page navigation likely occurred"}
+        return self._wait_after_action(result, wait_for, navigation)
+
+    def run_actions(self, steps: list | str) -> dict:
+        """
+        Run a list of steps with as few round trips to the page as possible.
+
+        Consecutive in-page steps run in a single script that ends after a
+        click or a submit, navigation waits use the load watcher and extract
+        steps get a page bundle. When a click or a submit navigates, the
+        next steps wait for the new page to load.
+
+        Args:
+            steps (list | str): steps as dicts with an action, or their JSON encoding
+
+        Returns:
+            dict: the outcome of every step run and the last extraction
+        """
+        try:
+            if isinstance(steps, str):
+                steps = json.loads(steps)
+            steps = [dict(step) for step in steps]
+        except (ValueError, TypeError) as e:
+            return {"success": False, "error": "Invalid steps: " + str(e)}
+        outcomes = []
+        extraction = None
+        navigation = None
+        failed = False
+        index = 0
+        while index < len(steps) and not failed:
+            step = steps[index]
+            action = step.get("action")
+            timeout = float(step.get("timeout") or 10)
+            if action in PAGE_STEPS:
+                batch = []
+                while index < len(steps) and steps[index].get("action") in PAGE_STEPS:
+                    batch.append({**steps[index], "timeout": float(steps[index].get("timeout") or 10) * 1000})
+                    index += 1
+                    if batch[-1]["action"] in NAVIGATING_STEPS:
+                        break
+                navigation = self._next_navigation()
+                try:
+                    results = self.call_library("sequence", {"steps": batch}, timeout=int(sum(step["timeout"] for step in batch)) + 5000)["results"]
+                except Exception as e:
+                    # The page unloads before returning when the last step navigates, the steps before it succeeded
+                    if self._navigation_started(navigation) and batch[-1]["action"] in NAVIGATING_STEPS:
+                        results = [{"action": step["action"], "success": True} for step in batch[:-1]]
+                        results.append({"action": batch[-1]["action"], "success": True, "note": "The page navigated before the steps returned"})
+                    else:
+                        results = [{"action": "sequence", "steps": [step["action"] for step in batch], "success": False, "error": str(e)}]
+                outcomes += results
+                failed = not results or not results[-1].get("success") or len(results) < len(batch)
+                # Steps after a navigating click or submit run on the new page
+                if not failed and index < len(steps) and steps[index].get("action") != "wait_for_navigation" \
+                        and batch[-1]["action"] in NAVIGATING_STEPS and self._navigation_started(navigation, 0.3):
+                    load = self.load_watcher.wait(self.get_setting("wait_state"), self.get_load_timeout(), navigation)
+                    outcomes[-1]["load"] = load
+                    failed = not load["success"]
+                continue
+            index += 1
+            if action == "wait_for_navigation":
+                state = step.get("state") or self.get_setting("wait_state")
+                if state not in LOAD_STATES:
+                    outcome = {"success": False, "error": f"Unknown load state: {state}"}
+                elif self.load_watcher is None:
+                    outcome = {"success": False, "error": "No page is open"}
+                else:
+                    outcome = self.load_watcher.wait(state, timeout, navigation)
+            elif action == "extract":
+                extraction = self.get_page_bundle(step.get("parts"), step.get("budgets"))
+                outcome = {"success": "error" not in extraction}
+                if not outcome["success"]:
+                    outcome["error"] = extraction["error"]
+            else:
+                outcome = {"success": False, "error": f"Unknown action: {action}"}
+            outcomes.append({"action": action, **outcome})
+            failed = not outcome["success"]
+        return {
+            "success": not failed and index >= len(steps),
+            "completed": sum(1 for outcome in outcomes if outcome.get("success")),
+            "total": len(steps),
+            "steps": outcomes,
+            "extraction": extraction
+        }
 
     def scroll_page(self, direction: str = "down", amount: int = 500) -> dict:
         """Scroll the page in a direction"""
-        js_code = f"""
-        (function() {{
-            const direction = '{direction}';
-            const amount = {amount};
-            let scrolled = false;
-            
-            if (direction === 'down') {{
-                window.scrollBy(0, amount);
-                scrolled = true;
-            }} else if (direction === 'up') {{
-                window.scrollBy(0, -amount);
-                scrolled = true;
-            }} else if (direction === 'top') {{
-                window.scrollTo(0, 0);
-                scrolled = true;
-            }} else if (direction === 'bottom') {{
-                window.scrollTo(0, document.body.scrollHeight);
-                scrolled = true;
-            }}
-            
-            return JSON.stringify({{
-                success: scrolled,
-                scrollY: window.scrollY,
-                scrollHeight: document.body.scrollHeight,
-                viewportHeight: window.innerHeight
-            }});
-        }})()
+        try:
+            return self.call_library("scroll", {"direction": direction, "amount": amount})
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def harvest_scroll(self, max_items: int = 200, max_chars: int = 50000, max_seconds: float = 20) -> dict:
+        """
+        Scroll to the bottom until the page stops growing and collect the inserted items.
+
+        Args:
+            max_items (int): stop after collecting this many items
+            max_chars (int): stop after collecting this many characters
+            max_seconds (float): stop after this many seconds
+
+        Returns:
+            dict: the batches of new items, deduplicated, with the reason the harvest stopped
         """
+        max_ms = int(float(max_seconds) * 1000)
+        args = {"maxItems": int(max_items), "maxChars": int(max_chars), "maxMs": max_ms, "idleMs": 2000, "stepMs": 400}
         try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+            result = self.call_library("harvest", args, timeout=max_ms + 10000)
         except Exception as e:
             return {"success": False, "error": str(e)}
+        result["batches"] = fit_to_budget(result["batches"], int(max_chars) + 1024)
+        return {"success": True, **result}
+
+    def get_page_snapshot(self) -> dict:
+        """Get the structured snapshot of the page, captured once per navigation and DOM generation"""
+        # A page read without the browser is opened first, the cached snapshot is of the previous page
+        self.ensure_page_loaded()
+        self.open_browser()
+        cache = self.snapshot_cache
+        if cache is None:
+            return self.call_library("snapshot")
+        # Concurrent tool calls wait for the same capture instead of starting their own
+        with cache.capture_lock:
+            key = self.load_watcher.snapshot_key()
+            snapshot = cache.get(key)
+            if snapshot is None:
+                snapshot = self.call_library("snapshot")
+                if snapshot.get("tracked"):
+                    cache.put(key, snapshot)
+            return snapshot
 
-    # ============ Reduced Content Tools (Low Token Usage) ============
+    def _snapshot_part(self, name: str) -> tuple[dict, dict]:
+        """Get the page info and one part of the snapshot, raising on extractor errors"""
+        snapshot = self.get_page_snapshot()
+        part = snapshot[name]
+        if "error" in part:
+            raise Exception(part["error"])
+        return snapshot["info"], part
 
-    def get_page_text(self, max_chars: int = 2000) -> dict:
-        """Get plain text content of the page"""
-        js_code = f"""
-        (function() {{
-            const maxChars = {max_chars};
-            const body = document.body;
-            
-            // Remove script and style elements from consideration
-            const clone = body.cloneNode(true);
-            clone.querySelectorAll('script, style, noscript').forEach(el => el.remove());
-            
-            let text = clone.innerText.replace(/\\s+/g, ' ').trim();
-            if (text.length > maxChars) {{
-                text = text.substring(0, maxChars) + '...';
-            }}
-            
-            return JSON.stringify({{
-                url: window.location.href,
-                title: document.title,
-                text: text,
-                totalLength: clone.innerText.length,
-                truncated: clone.innerText.length > maxChars
-            }});
-        }})()
-        """
-        try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+    def get_page_text(self, max_chars: int = 2000, diff: bool = False) -> dict:
+        """Get plain text content of the page, or the lines changed since the last call on the tab"""
+        try:
+            info, part = self._snapshot_part("text")
         except Exception as e:
             return {"error": str(e)}
+        max_chars = int(max_chars)
+        text = part["text"]
+        tab = self.active_tab()
+        previous = tab.last_text if tab is not None else None
+        if tab is not None:
+            tab.last_text = (info["url"], text)
+        if str(diff).lower() in ("true", "1") and previous is not None and previous[0] == info["url"]:
+            lines = lambda value: [line.strip() for line in value.split("\n") if line.strip()]
+            changes = diff_blocks(lines(previous[1]), lines(text))
+            fitted = fit_to_budget(changes, max_chars)
+            return {"url": info["url"], "title": info["title"], "diff": fitted, "truncated": fitted is not changes}
+        if len(text) > max_chars:
+            text = text[:max_chars] + "..."
+        return {
+            "url": info["url"],
+            "title": info["title"],
+            "text": text,
+            "totalLength": part["totalLength"],
+            "truncated": part["totalLength"] > max_chars
+        }
 
     def get_page_links(self, max_links: int = 30) -> dict:
         """Get all links on the page"""
-        js_code = f"""
-        (function() {{
-            const maxLinks = {max_links};
-            const links = document.querySelectorAll('a[href]');
-            const result = [];
-            
-            const seen = new Set();
-            for (const a of links) {{
-                if (result.length >= maxLinks) break;
-                
-                const href = a.href;
-                const text = a.innerText.trim().substring(0, 80);
-                
-                // Skip empty links, anchors, and duplicates
-                if (!text || href.startsWith('javascript:') || seen.has(href)) continue;
-                seen.add(href);
-                
-                result.push({{ text, href }});
-            }}
-            
-            return JSON.stringify({{
-                url: window.location.href,
-                totalLinks: links.length,
-                links: result
-            }});
-        }})()
-        """
         try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+            info, part = self._snapshot_part("links")
         except Exception as e:
             return {"error": str(e)}
+        self.prefetch_links(part["links"], info["url"])
+        return {
+            "url": info["url"],
+            "totalLinks": part["totalLinks"],
+            "links": part["links"][:int(max_links)]
+        }
 
     def get_page_headings(self) -> dict:
         """Get all headings from the page"""
-        js_code = """
-        (function() {
-            const headings = [];
-            document.querySelectorAll('h1, h2, h3, h4, h5, h6').forEach(h => {
-                const text = h.innerText.trim();
-                if (text) {
-                    headings.push({
-                        level: h.tagName,
-                        text: text.substring(0, 150)
-                    });
-                }
-            });
-            
-            return JSON.stringify({
-                url: window.location.href,
-                title: document.title,
-                headings: headings
-            });
-        })()
-        """
         try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+            info, part = self._snapshot_part("headings")
         except Exception as e:
             return {"error": str(e)}
+        return {"url": info["url"], "title": info["title"], "headings": part["headings"]}
 
     def get_page_outline(self) -> dict:
         """Get a minimal structural outline of the page"""
-        js_code = """
-        (function() {
-            const outline = {
-                url: window.location.href,
-                title: document.title,
-                metaDescription: document.querySelector('meta[name="description"]')?.content?.substring(0, 200) || '',
-                structure: {
-                    hasNav: !!document.querySelector('nav, [role="navigation"]'),
-                    hasSearch: !!document.querySelector('input[type="search"], [role="search"]'),
-                    hasMain: !!document.querySelector('main, [role="main"]'),
-                    hasSidebar: !!document.querySelector('aside, [role="complementary"]'),
-                    hasFooter: !!document.querySelector('footer')
-                },
-                counts: {
-                    headings: document.querySelectorAll('h1, h2, h3, h4, h5, h6').length,
-                    links: document.querySelectorAll('a[href]').length,
-                    forms: document.querySelectorAll('form').length,
-                    buttons: document.querySelectorAll('button, input[type="submit"]').length,
-                    inputs: document.querySelectorAll('input, textarea, select').length,
-                    images: document.querySelectorAll('img').length,
-                    tables: document.querySelectorAll('table').length
-                },
-                firstHeading: document.querySelector('h1')?.innerText?.substring(0, 100) || ''
-            };
-            
-            return JSON.stringify(outline);
-        })()
-        """
         try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+            info, part = self._snapshot_part("outline")
         except Exception as e:
             return {"error": str(e)}
+        return {"url": info["url"], "title": info["title"], **part}
 
     def get_interactive_elements(self) -> dict:
         """Get buttons, inputs, and forms on the page"""
-        js_code = """
-        (function() {
-            const result = {
-                url: window.location.href,
-                buttons: [],
-                inputs: [],
-                forms: []
-            };
-            
-            // Buttons
-            document.querySelectorAll('button, input[type="submit"], input[type="button"], [role="button"]').forEach((btn, idx) => {
-                if (idx < 15) {
-                    result.buttons.push({
-                        text: (btn.innerText || btn.value || btn.title || 'button').substring(0, 50),
-                        id: btn.id || null,
-                        class: btn.className?.substring(0, 50) || null,
-                        type: btn.type || null
-                    });
-                }
-            });
-            
-            // Inputs
-            document.querySelectorAll('input:not([type="hidden"]):not([type="submit"]):not([type="button"]), textarea, select').forEach((inp, idx) => {
-                if (idx < 20) {
-                    const label = inp.labels?.[0]?.innerText || inp.placeholder || inp.name || '';
-                    result.inputs.push({
-                        type: inp.type || inp.tagName.toLowerCase(),
-                        name: inp.name || null,
-                        id: inp.id || null,
-                        label: label.substring(0, 50),
-                        required: inp.required || false
-                    });
-                }
-            });
-            
-            // Forms
-            document.querySelectorAll('form').forEach((form, idx) => {
-                if (idx < 10) {
-                    result.forms.push({
-                        id: form.id || null,
-                        action: form.action || null,
-                        method: form.method || 'get',
-                        inputCount: form.querySelectorAll('input, textarea, select').length
-                    });
-                }
-            });
-            
-            return JSON.stringify(result);
-        })()
-        """
         try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+            info, part = self._snapshot_part("interactive")
         except Exception as e:
             return {"error": str(e)}
+        return {"url": info["url"], **part}
 
     def get_main_content(self, max_chars: int = 3000) -> dict:
         """Extract main content area only"""
-        js_code = f"""
-        (function() {{
-            const maxChars = {max_chars};
-            
-            // Try to find main content area
-            const mainSelectors = ['main', 'article', '[role="main"]', '.content', '#content', '.post', '.article', '.entry-content'];
-            let mainContent = null;
-            
-            for (const sel of mainSelectors) {{
-                mainContent = document.querySelector(sel);
-                if (mainContent) break;
-            }}
-            
-            if (!mainContent) {{
-                mainContent = document.body;
-            }}
-            
-            // Clone and clean
-            const clone = mainContent.cloneNode(true);
-            clone.querySelectorAll('script, style, noscript, nav, header, footer, aside').forEach(el => el.remove());
-            
-            let text = clone.innerText.replace(/\\s+/g, ' ').trim();
-            const totalLength = text.length;
-            
-            if (text.length > maxChars) {{
-                text = text.substring(0, maxChars) + '...';
-            }}
-            
-            return JSON.stringify({{
-                url: window.location.href,
-                title: document.title,
-                content: text,
-                totalLength: totalLength,
-                truncated: totalLength > maxChars,
-                selector: mainContent.tagName + (mainContent.id ? '#' + mainContent.id : '')
-            }});
-        }})()
-        """
-        try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+        try:
+            info, part = self._snapshot_part("main")
         except Exception as e:
             return {"error": str(e)}
+        max_chars = int(max_chars)
+        content = part["content"]
+        total_length = len(content)
+        if total_length > max_chars:
+            content = content[:max_chars] + "..."
+        return {
+            "url": info["url"],
+            "title": info["title"],
+            "content": content,
+            "totalLength": total_length,
+            "truncated": total_length > max_chars,
+            "selector": part["selector"]
+        }
 
-    def search_page_text(self, query: str) -> dict:
-        """Search for text on the page and get surrounding context"""
-        escaped_query = self._escape_js_string(query)
-        js_code = f"""
-        (function() {{
-            const query = '{escaped_query}'.toLowerCase();
-            const body = document.body.innerText;
-            const bodyLower = body.toLowerCase();
-            const results = [];
-            
-            let pos = 0;
-            while (results.length < 10) {{
-                const idx = bodyLower.indexOf(query, pos);
-                if (idx === -1) break;
-                
-                // Get context around the match (100 chars before and after)
-                const start = Math.max(0, idx - 100);
-                const end = Math.min(body.length, idx + query.length + 100);
-                const context = body.substring(start, end).replace(/\\s+/g, ' ');
-                
-                results.push({{
-                    position: idx,
-                    context: (start > 0 ? '...' : '') + context + (end < body.length ? '...' : '')
-                }});
-                
-                pos = idx + query.length;
-            }}
-            
-            return JSON.stringify({{
-                url: window.location.href,
-                query: '{escaped_query}',
-                found: results.length > 0,
-                matchCount: results.length,
-                matches: results
-            }});
-        }})()
-        """
-        try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+    def search_page_text(self, query: str, scope: str = "page", max_results: int = 10) -> dict:
+        """Search for text on the page, or in all the visited pages, and get surrounding context"""
+        max_results = int(max_results)
+        if scope == "all":
+            return self.search_visited_pages(query, max_results)
+        try:
+            self.ensure_page_loaded()
+            info, part = self._snapshot_part("text")
         except Exception as e:
             return {"error": str(e)}
+        # The index is built once per DOM version
+        cache = self.snapshot_cache
+        build = lambda: TextIndex(part["text"])
+        index = cache.derive(self.load_watcher.snapshot_key(), "text_index", build) if cache is not None else build()
+        matches, total = index.search(query, max_results)
+        return {
+            "url": info["url"],
+            "query": query,
+            "found": len(matches) > 0,
+            "matchCount": len(matches),
+            "totalMatches": total,
+            "matches": matches
+        }
 
-    def get_tables(self) -> dict:
-        """Extract table data from the page"""
-        js_code = """
-        (function() {
-            const tables = [];
-            
-            document.querySelectorAll('table').forEach((table, tableIdx) => {
-                if (tableIdx >= 5) return;
-                
-                const tableData = {
-                    index: tableIdx,
-                    id: table.id || null,
-                    caption: table.querySelector('caption')?.innerText?.substring(0, 100) || null,
-                    headers: [],
-                    rows: []
-                };
-                
-                // Get headers
-                table.querySelectorAll('th').forEach(th => {
-                    tableData.headers.push(th.innerText.trim().substring(0, 50));
-                });
-                
-                // Get rows (limit to first 20)
-                table.querySelectorAll('tr').forEach((tr, rowIdx) => {
-                    if (rowIdx >= 20) return;
-                    
-                    const cells = [];
-                    tr.querySelectorAll('td').forEach(td => {
-                        cells.push(td.innerText.trim().substring(0, 100));
-                    });
-                    
-                    if (cells.length > 0) {
-                        tableData.rows.push(cells);
-                    }
-                });
-                
-                tables.push(tableData);
-            });
-            
-            return JSON.stringify({
-                url: window.location.href,
-                tableCount: document.querySelectorAll('table').length,
-                tables: tables
-            });
-        })()
-        """
+    def search_visited_pages(self, query: str, max_results: int = 10) -> dict:
+        """Search the pages in the page store, ranking chunks with the keyword index"""
+        if self.rag_state is None:
+            self.rag_state = RagIndexState()
+        self.rag_state.sync(self.old_pages)
+        matches = []
+        for _, document in self.rag_state.get_keyword_index().search(query, max_results):
+            header, _, chunk = document[len("text:Source: "):].partition("\n\n")
+            found, _ = TextIndex(chunk).search(query, 1)
+            if found:
+                matches.append({"url": header, **found[0]})
+        return {
+            "scope": "all",
+            "query": query,
+            "pages": len(self.old_pages),
+            "found": len(matches) > 0,
+            "matchCount": len(matches),
+            "matches": matches
+        }
+
+    def get_table_index(self) -> tuple[dict, TableIndex]:
+        """Get the page info and the tables of the page, indexed once per DOM version"""
+        self.ensure_page_loaded()
+        info = self.get_page_snapshot()["info"]
+        cache = self.snapshot_cache
+        build = lambda: TableIndex(self.call_library("table_grid", {"maxCell": 2000})["tables"])
+        return info, cache.derive(self.load_watcher.snapshot_key(), "table_index", build) if cache is not None else build()
+
+    def get_tables(self, max_tables: int = 20) -> dict:
+        """Get the columns, column types, size and first rows of the tables of the page"""
+        try:
+            info, index = self.get_table_index()
+        except Exception as e:
+            return {"error": str(e)}
+        return {
+            "url": info["url"],
+            "tableCount": len(index.tables),
+            "tables": fit_to_budget(index.summary()[:int(max_tables)], 8000)
+        }
+
+    def get_table_rows(self, table: int = 0, offset: int = 0, limit: int = 50, format: str = "csv", max_chars: int = 8000) -> dict:
+        """Get the rows of a table of the page, nextOffset is the offset of the following rows"""
         try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+            info, index = self.get_table_index()
+            return {"url": info["url"], **index.rows(int(table), int(offset), int(limit), format, int(max_chars))}
         except Exception as e:
             return {"error": str(e)}
 
     def get_images(self, max_images: int = 20) -> dict:
         """Get images with alt text from the page"""
-        js_code = f"""
-        (function() {{
-            const maxImages = {max_images};
-            const images = [];
-            
-            document.querySelectorAll('img').forEach((img, idx) => {{
-                if (idx >= maxImages) return;
-                
-                images.push({{
-                    src: img.src,
-                    alt: img.alt?.substring(0, 100) || '',
-                    width: img.naturalWidth || img.width,
-                    height: img.naturalHeight || img.height
-                }});
-            }});
-            
-            return JSON.stringify({{
-                url: window.location.href,
-                totalImages: document.querySelectorAll('img').length,
-                images: images
-            }});
-        }})()
-        """
         try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+            info, part = self._snapshot_part("images")
         except Exception as e:
             return {"error": str(e)}
+        result = {
+            "url": info["url"],
+            "totalImages": part["totalImages"],
+            "images": part["images"][:int(max_images)]
+        }
+        if self.is_scrape_mode(info["url"]):
+            result["note"] = "Images are not downloaded in scrape mode, only their source and alt text are available"
+        return result
 
     def get_page_info(self) -> dict:
         """Get basic page info"""
-        js_code = """
-        (function() {
-            return JSON.stringify({
-                url: window.location.href,
-                title: document.title,
-                metaDescription: document.querySelector('meta[name="description"]')?.content || '',
-                metaKeywords: document.querySelector('meta[name="keywords"]')?.content || '',
-                canonical: document.querySelector('link[rel="canonical"]')?.href || '',
-                language: document.documentElement.lang || '',
-                charset: document.characterSet,
-                viewport: document.querySelector('meta[name="viewport"]')?.content || ''
-            });
-        })()
-        """
         try:
-            result = self.execute_javascript_sync(js_code)
-            return json.loads(result)
+            return self._snapshot_part("info")[0]
+        except Exception as e:
+            return {"error": str(e)}
+
+    def get_page_bundle(self, parts: list | str | None = None, budgets: dict | str | None = None) -> dict:
+        """Run several extractors in a single script and fit each part in its character budget"""
+        try:
+            if isinstance(parts, str):
+                parts = json.loads(parts) if parts.strip().startswith("[") else [p.strip() for p in parts.split(",")]
+            if isinstance(budgets, str):
+                budgets = json.loads(budgets) if budgets.strip() else {}
+            parts = [p for p in (parts or ["info", "outline", "headings", "links"]) if p]
+            unknown = [p for p in parts if p not in BUNDLE_BUDGETS]
+            if unknown:
+                return {"error": f"Unknown parts: {', '.join(unknown)}, use any of {', '.join(BUNDLE_BUDGETS)}"}
+            budgets = {p: int((budgets or {}).get(p, BUNDLE_BUDGETS[p])) for p in parts}
+            self.ensure_page_loaded()
         except Exception as e:
             return {"error": str(e)}
 
+        # Tables come from the table index, like get_tables
+        tables = budgets.pop("tables", None)
+        # A fresh snapshot already holds every part, no browser round trip needed
+        cache = self.snapshot_cache
+        snapshot = cache.get(self.load_watcher.snapshot_key()) if cache is not None else None
+        if snapshot is not None:
+            result = {"url": snapshot["info"]["url"], "parts": {}, "truncated": []}
+            for part in budgets:
+                fitted = fit_to_budget(snapshot[part], budgets[part])
+                if fitted is not snapshot[part]:
+                    result["truncated"].append(part)
+                result["parts"][part] = fitted
+        else:
+            try:
+                result = self.call_library("bundle", {"budgets": budgets})
+            except Exception as e:
+                return {"error": str(e)}
+        if tables is not None:
+            try:
+                info, index = self.get_table_index()
+                part = {"tableCount": len(index.tables), "tables": index.summary()}
+                result.setdefault("url", info["url"])
+            except Exception as e:
+                part = {"error": str(e)}
+            fitted = fit_to_budget(part, tables)
+            if fitted is not part:
+                result["truncated"].append("tables")
+            result["parts"]["tables"] = fitted
+        return result
+
+    def get_stats(self) -> dict:
+        """Get performance counters of the navigator"""
+        stats = {}
+        if self.pool is not None:
+            stats["tabs"] = {tab.id: tab.get_stats() for tab in self.pool.list()}
+        if self.http_client is not None:
+            stats["static_fetch"] = {**self.static_stats, **self.http_client.stats}
+        if self.prefetcher is not None:
+            stats["prefetch"] = self.prefetcher.get_stats()
+        if self.boilerplate is not None:
+            stats["boilerplate"] = {**self.boilerplate.stats, "domains": len(self.boilerplate.domains)}
+        if self.summary_cache is not None:
+            stats["summaries"] = self.summary_cache.get_stats()
+        if self.page_store is not None:
+            stats["page_store"] = self.page_store.get_stats()
+        if self.rag_state is not None and self.rag_state.keyword_index is not None:
+            keyword_index = self.rag_state.keyword_index
+            stats["keyword_index"] = {"chunks": len(keyword_index), "terms": len(keyword_index.postings), "removed": keyword_index.removed}
+        if self.index_snapshot is not None:
+            stats["index"] = {"chunks": len(self.index_snapshot.rows), "removed_rows": self.index_snapshot.removed,
+                              "bytes": self.index_snapshot.size(), "pages": len(self.rag_state.pages),
+                              "version": self.rag_state.index_version, "error": self.index_snapshot.error}
+        elif self.snapshot_error is not None:
+            stats["index"] = {"error": self.snapshot_error}
+        if self.resource_blocker is not None:
+            stats["content_filter"] = {"filters": len(self.resource_blocker.filters), "error": self.resource_blocker.error}
+        if self.load_stats is not None:
+            stats["page_loads"] = {
+                mode: {**counters, "avg_load_ms": counters["load_ms"] // max(1, counters["pages"]),
+                       "avg_transfer_bytes": counters["transfer_bytes"] // max(1, counters["pages"])}
+                for mode, counters in self.load_stats.items()
+            }
+        return stats
+
     def execute_custom_js(self, js_code: str) -> str:
         """Execute custom JavaScript and return the result"""
         try:
-            return self.execute_javascript_sync(js_code)
+            result = self.execute_javascript_sync(PAGE_EVAL_JS, arguments={"code": js_code, "chunk": str(TRANSFER_CHUNK_SIZE)}, priority=PRIORITY_ACTION)
+            if result == EVAL_BLOCKED:
+                return self.execute_javascript_sync(js_code, priority=PRIORITY_ACTION)
+            return "".join(self.iter_transfer(result, None))
         except Exception as e:
             return json.dumps({"error": str(e)})